@@ -1,4 +1,5 @@
 from contraction_methods.contraction_tree import ContractionTree
+from contraction_methods.parallel_method import BackgroundPlanner, ParallelMethod
 
 import contraction_methods.tensorcsp_method
 import contraction_methods.line_graph_method
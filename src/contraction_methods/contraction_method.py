@@ -9,3 +9,22 @@ class ContractionMethod:
         :return: An iterator of contraction trees for the provided network.
         """
         pass
+
+    def warm_up(self, **solver_args):
+        """
+        Prepare to construct contraction trees (e.g. start solvers) before the tensor network is known.
+
+        :param solver_args: The additional arguments that will be given to generate_contraction_trees.
+        :return: None
+        """
+        pass
+
+    def decomposed_graph(self, tensor_network):
+        """
+        Get the graph whose tree decompositions are used to construct contraction trees, if any.
+        The treewidth of each contraction tree found is the width of such a decomposition.
+
+        :param tensor_network: The tensor network to find contraction trees for.
+        :return: (# of vertices, an array of edges with vertices numbered from 1), or None.
+        """
+        return None
@@ -16,8 +16,48 @@ cdef class CostInfo:
     cdef unordered_map[size_t, double] open_edge_total_memory   # Total memory cap after slicing each free index
 
 cdef class ContractionTreeContext:
-    cdef object nodes
-    cdef int root
+    # Each node is stored as an index into the following arrays (leaves have no left or right child)
+    cdef vector[int] lefts
+    cdef vector[int] rights
+    cdef vector[int] tensor_indices
+    cdef vector[size_t] maxranks
+    cdef vector[double] log_sizes                               # log2 of the number of entries of each node
+
+    # The free edges of each node are stored contiguously in free_pool
+    cdef vector[size_t] free_start
+    cdef vector[size_t] free_count
+    cdef vector[size_t] free_capacity
+    cdef vector[int] free_pool
+
+    # The edge maps of each join node are stored contiguously in left_map_pool and right_map_pool
+    cdef vector[size_t] map_start
+    cdef vector[size_t] map_count
+    cdef vector[size_t] map_capacity
+    cdef vector[int] left_map_pool
+    cdef vector[int] right_map_pool
+
+    cdef size_t version                                         # Incremented whenever an existing node changes
+    cdef object flat_cache                                      # (root, version, FlatContractionTree) last flattened
+
+    # Scratch marks for linear-time edge set operations, indexed by edge_slot
+    # (an edge is marked iff its mark_stamp is the current stamp)
+    cdef vector[size_t] mark_stamp
+    cdef vector[int] mark_value
+    cdef size_t stamp
+
+    cdef vector[double] edge_dimensions                         # Dimension of each edge, indexed by edge_slot
+
+    cdef int new_node(self, int tensor_index)
+    cdef size_t edge_slot(self, int edge)
+    cdef void clear_marks(self)
+    cdef bint mark_edge(self, int edge, int value)
+    cdef void mark_edges(self, int node)
+    cdef int marked_value(self, int edge)
+    cdef double dimension(self, int edge)
+    cpdef int set_edge_dimension(self, int edge, double dimension) except -2
+    cdef size_t reserve_free_edges(self, int node, size_t count)
+    cdef size_t reserve_edge_maps(self, int node, size_t count)
+    cdef vector[int] postorder(self, int root)
 
     cpdef int empty(self)
     cpdef int leaf(self, TensorNetwork tensor_network, int tensor_index) except -2
@@ -28,5 +68,15 @@ cdef class ContractionTreeContext:
     cpdef int include_rank_zero_tensors(self, TensorNetwork tensor_network, int contraction_tree) except -2
     cpdef int reindex(self, vector[int] new_tid_from_old, vector[int] new_eid_from_old) except -2
     cpdef int group_if_below(self, int upper, bool upper_left, bool lower_left, size_t if_below) except -2
+    cdef vector[int] joins_below(self, int root)
+    cdef int recompute_below(self, int root) except -2
+    cpdef int rotate(self, int upper, bool upper_left, bool lower_left) except -2
+    cdef size_t joined_rank(self, int first, int second, double * log_size)
+    cdef double join_cost(self, double left_log_size, double right_log_size, double log_size, double memory_weight)
+    cpdef int anneal(self, int root, double time_budget, size_t max_rank, double memory_weight, int seed) except -2
+    cpdef int optimize_windows(self, int root, size_t window_size, size_t max_rank) except -2
+    cdef int solve_window(self, vector[int] & internal, vector[int] & frontier, size_t max_rank) except -2
+    cpdef int regroup(self, int root, size_t rank_limit) except -2
+    cpdef int sort_small(self, int root) except -2
+    cpdef int order_by_memory(self, int root, cset[int] & sliced_edges) except -2
     cpdef CostInfo estimate_cost(self, size_t node_id, cset[int] & sliced_edges)
-
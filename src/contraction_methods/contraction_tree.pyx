@@ -1,6 +1,18 @@
 # distutils: language=c++
 # distutils: extra_compile_args=-O3
 
+import numpy
+import random
+import time
+
+from libc.math cimport exp, log2, pow, sqrt, INFINITY
+from libc.stdint cimport uint64_t
+from libc.stdlib cimport rand, srand, RAND_MAX
+
+cdef extern from *:
+    int popcount "__builtin_popcountll"(unsigned long long)
+    int count_trailing_zeros "__builtin_ctzll"(unsigned long long)
+
 class ContractionTree:
     """
     A recursive interface into a contraction tree, useful for tensor network contraction
@@ -8,43 +20,51 @@ class ContractionTree:
     def __init__(self, context, node):
         self.__context = context
         self.__node = node
-        self.__node_info = context.get_data(node)
 
     @property
     def left(self):
-        return ContractionTree(self.__context, self.__node_info.left)
+        return ContractionTree(self.__context, self.__context.left(self.__node))
 
     @property
     def right(self):
-        return ContractionTree(self.__context, self.__node_info.right)
+        return ContractionTree(self.__context, self.__context.right(self.__node))
 
     @property
     def tensor_index(self):
-        return self.__node_info.tensor_index
+        return self.__context.tensor_index(self.__node)
 
     @property
     def is_leaf(self):
-        return self.__node_info.is_leaf
+        return self.__context.is_leaf(self.__node)
 
     @property
     def maxrank(self):
-        return self.__node_info.maxrank
+        return self.__context.maxrank(self.__node)
 
     @property
     def left_edge_map(self):
-        return self.__node_info.left_edge_map
+        return self.__context.left_edge_map(self.__node)
 
     @property
     def right_edge_map(self):
-        return self.__node_info.right_edge_map
+        return self.__context.right_edge_map(self.__node)
 
     @property
     def rank(self):
-        return len(self.__node_info.free_edges)
+        return self.__context.rank(self.__node)
 
     @property
     def free_edges(self):
-        return self.__node_info.free_edges
+        return self.__context.free_edges(self.__node)
+
+    def flatten(self):
+        """
+        Get the arrays describing this tree, with nodes numbered in postorder.
+
+        The result is cached until the tree is modified, so it should not be modified by the caller.
+        :return: A FlatContractionTree
+        """
+        return self.__context.flatten(self.__node)
 
     def reroot(self, network, large_rank):
         """
@@ -54,20 +74,23 @@ class ContractionTree:
         :param large_rank: A tensor is large if its rank is >= [large_rank].
         :return: A new ContractionTree
         """
+        cdef ContractionTreeContext context = self.__context
         result_tree_context = ContractionTreeContext()
 
         cdef vector[int] stack
         cdef vector[int] path_up    # [a, b, c, d] indicates a grouping of (a (b (c d)))
         cdef size_t i
-        for node in self.iterate_postorder():
-            if node.is_leaf:
-                stack.push_back(result_tree_context.leaf(network, node.tensor_index))
+        cdef int node, left, right
+        cdef vector[int] order = context.postorder(self.__node)
+        for node in order:
+            if context.lefts[node] < 0:
+                stack.push_back(result_tree_context.leaf(network, context.tensor_indices[node]))
             else:
                 right = stack.back()
                 stack.pop_back()
                 left = stack.back()
                 stack.pop_back()
-                if len(path_up) == 0 and node.__node_info.maxrank >= large_rank:
+                if path_up.size() == 0 and context.maxranks[node] >= large_rank:
                     path_up.push_back(result_tree_context.join(left, right))
                     stack.push_back(-1)
                 else:
@@ -80,7 +103,7 @@ class ContractionTree:
                     else:
                         stack.push_back(result_tree_context.join(left, right))
 
-        if len(path_up) == 0: # No large tensors found
+        if path_up.size() == 0: # No large tensors found
             return result_tree_context.get_tree(stack[0])
         else:
             top = path_up[path_up.size()-1]
@@ -88,6 +111,67 @@ class ContractionTree:
                 top = result_tree_context.join(path_up[i-1], top)
             return result_tree_context.get_tree(top)
 
+    def copy(self):
+        """
+        Copy this tree into a fresh context that contains exactly the nodes of this tree.
+
+        :return: A new ContractionTree
+        """
+        cdef ContractionTreeContext context = self.__context
+        cdef ContractionTreeContext result_tree_context = ContractionTreeContext()
+        cdef vector[int] stack
+        cdef vector[int] free_edges
+        cdef int node, left, right
+        cdef size_t i
+        result_tree_context.edge_dimensions = context.edge_dimensions
+        cdef vector[int] order = context.postorder(self.__node)
+        for node in order:
+            if context.lefts[node] < 0:
+                free_edges.clear()
+                for i in range(context.free_count[node]):
+                    free_edges.push_back(context.free_pool[context.free_start[node] + i])
+                stack.push_back(result_tree_context.leaf_manual(context.tensor_indices[node], free_edges))
+            else:
+                right = stack.back()
+                stack.pop_back()
+                left = stack.back()
+                stack.pop_back()
+                stack.push_back(result_tree_context.join(left, right))
+        return result_tree_context.get_tree(stack.back())
+
+    def anneal(self, time_budget, max_rank=None, memory_weight=1.0):
+        """
+        Search for a cheaper tree by simulated annealing over subtree rotations.
+
+        The search minimizes the estimated FLOPs plus [memory_weight] times the size of every
+        intermediate tensor, and never creates an intermediate tensor of rank above [max_rank].
+
+        :param time_budget: Time (s) to spend on the search
+        :param max_rank: Largest rank allowed for intermediate tensors (default: the maxrank of this tree)
+        :param memory_weight: Penalty per entry of each intermediate tensor
+        :return: A new ContractionTree, no more expensive than this tree
+        """
+        if max_rank is None:
+            max_rank = self.maxrank
+        result = self.copy()
+        result.__context.anneal(result.__node, time_budget, max_rank, memory_weight, random.getrandbits(31))
+        return result
+
+    def optimize_windows(self, window_size=12, max_rank=None):
+        """
+        Cut the tree into windows of at most [window_size] subtrees, and replace the contraction order
+        within each window by an optimal order (under the FLOPs of estimate_cost).
+
+        :param window_size: Largest number of subtrees to reorder at once; the time used grows as 3^window_size
+        :param max_rank: Largest rank allowed for intermediate tensors (default: the maxrank of this tree)
+        :return: A new ContractionTree, with no more FLOPs than this tree
+        """
+        if max_rank is None:
+            max_rank = self.maxrank
+        result = self.copy()
+        result.__context.optimize_windows(result.__node, window_size, max_rank)
+        return result
+
     def regroup(self, rank_limit):
         """
         At places in the tree (A (B C)) where
@@ -100,66 +184,24 @@ class ContractionTree:
         :param rank_limit: A tensor is small if its maxrank is below [rank_limit]
         :return: None (Modifies the current tree)
         """
-        # Entries of stack are (small_on_left, small), where:
-        #   small_on_left == True means that a small tensor is on the left and a large tensor is on the right
-        #   small_on_left == False means that a small tensor is on the right and a large tensor is on the left
-        #   small_on_left == None otherwise (i.e., at a leaf, or both small, or both large)
-        #   small is True if the current tensor is small, and large otherwise
-        stack = []
-
-        for node in self.iterate_postorder():
-            if node.is_leaf:
-                stack.append((None, node.maxrank < rank_limit))
-            else:
-                right_small_on_left, right_small = stack.pop()
-                left_small_on_left, left_small = stack.pop()
-
-                if right_small_on_left is not None and left_small:  # (A (B C)) or (A (C B)) => (C (A B))
-                    if self.__context.group_if_below(node.__node, True, right_small_on_left, rank_limit) == 1:
-                        # Now left is large, right is small
-                        left_small = False
-                        right_small = True
-                elif left_small_on_left is not None and right_small:  # ((B C) A) or ((C B) A) => ((A B) C)
-                    if self.__context.group_if_below(node.__node, False, left_small_on_left, rank_limit) == 1:
-                        # Now right is large, left is small
-                        left_small = True
-                        right_small = False
-
-                # Determine the location of the large tensor
-                if left_small and not right_small:
-                    small_on_left = True
-                elif right_small and not left_small:
-                    small_on_left = False
-                else:
-                    small_on_left = None
-                stack.append((small_on_left, node.maxrank < rank_limit))
+        self.__context.regroup(self.__node, rank_limit)
 
     def sort_small(self):
         """
         Sort each join node in the tree so that the smaller tensor appears on the right
         :return: None (modified the current tree)
         """
+        self.__context.sort_small(self.__node)
 
-        cdef vector[int] stack  # 1 if the edge order below might have changed
-        cdef int temp, result
-        for node in self.iterate_postorder():
-            if node.is_leaf:
-                stack.push_back(0)
-            else:
-                result = stack.back()
-                stack.pop_back()
-                result += stack.back()
-                stack.pop_back()
-                if node.left.rank < node.right.rank:
-                    temp = node.__node_info.left
-                    node.__node_info.left = node.__node_info.right
-                    node.__node_info.right = temp
-                    result += 1
-                if result > 0:
-                    node.__context.compute_join_properties(node.__node)
-                    stack.push_back(1)
-                else:
-                    stack.push_back(0)
+    def order_by_memory(self, slices=frozenset()):
+        """
+        Order the children of each join node so that the memory cap needed to contract this tree is minimized,
+        without changing the FLOPs.
+
+        :param slices: A set of edges that have been sliced (and so have dimension 1)
+        :return: None (modified the current tree)
+        """
+        self.__context.order_by_memory(self.__node, slices)
 
     def estimate_cost(self, slices=frozenset()):
         """
@@ -172,15 +214,75 @@ class ContractionTree:
         return result.get_total_FLOPs(), result.get_total_memory(), result.get_best_edge(), result.get_max_rank()
 
     def iterate_postorder(self):
-        processed = [(self, False)]
-        while len(processed) > 0:
-            node, expanded = processed.pop()
-            if expanded or node.is_leaf:
-                yield node
-            else:
-                processed.append((node, True))
-                processed.append((node.right, False))
-                processed.append((node.left, False))
+        for node in self.__context.postorder_list(self.__node):
+            yield ContractionTree(self.__context, node)
+
+
+class FlatContractionTree:
+    """
+    A contraction tree stored as flat arrays, with nodes numbered in postorder (so the root is last).
+
+    Leaves have left[i] == right[i] == -1. The free edges of node i are free_edges[free_ptr[i]:free_ptr[i+1]],
+    with log2 of their dimensions in log_dimensions[free_ptr[i]:free_ptr[i+1]].
+    The edges contracted at join node i are at positions left_map[map_ptr[i]:map_ptr[i+1]] of the free edges
+    of the left child and right_map[map_ptr[i]:map_ptr[i+1]] of the free edges of the right child.
+    """
+
+    def __init__(
+        self, left, right, tensor_index, maxrank, free_ptr, free_edges, log_dimensions, map_ptr, left_map, right_map
+    ):
+        self.left = left
+        self.right = right
+        self.tensor_index = tensor_index
+        self.maxrank = maxrank
+        self.free_ptr = free_ptr
+        self.free_edges = free_edges
+        self.log_dimensions = log_dimensions
+        self.map_ptr = map_ptr
+        self.left_map = left_map
+        self.right_map = right_map
+        self.size = len(left)
+        self.__axes = None
+
+    @property
+    def axes(self):
+        """
+        The axes to contract at each node (as in tensordot), or None at each leaf.
+        """
+        if self.__axes is None:
+            left_map = self.left_map.tolist()
+            right_map = self.right_map.tolist()
+            map_ptr = self.map_ptr.tolist()
+            self.__axes = [
+                None if l < 0 else (left_map[start:end], right_map[start:end])
+                for l, start, end in zip(self.left.tolist(), map_ptr[:-1], map_ptr[1:])
+            ]
+        return self.__axes
+
+    def node_free_edges(self, i):
+        return self.free_edges[self.free_ptr[i]:self.free_ptr[i+1]]
+
+    def ranks(self, sliced_edges=frozenset()):
+        """
+        Compute the number of free edges of each node that are not sliced.
+
+        :param sliced_edges: A set of edges that have been sliced
+        :return: An array with the number of unsliced free edges of each node
+        """
+        unsliced = numpy.logical_not(numpy.isin(self.free_edges, list(sliced_edges)))
+        counts = numpy.concatenate(([0], numpy.cumsum(unsliced)))
+        return counts[self.free_ptr[1:]] - counts[self.free_ptr[:-1]]
+
+    def log_sizes(self, sliced_edges=frozenset()):
+        """
+        Compute log2 of the number of entries of each node, once the sliced edges are removed.
+
+        :param sliced_edges: A set of edges that have been sliced
+        :return: An array with log2 of the size of each node
+        """
+        unsliced = numpy.logical_not(numpy.isin(self.free_edges, list(sliced_edges)))
+        totals = numpy.concatenate(([0], numpy.cumsum(self.log_dimensions * unsliced)))
+        return totals[self.free_ptr[1:]] - totals[self.free_ptr[:-1]]
 
 
 cdef class CostInfo:
@@ -197,53 +299,257 @@ cdef class CostInfo:
         return self.best_edge
 
 
-cdef class ContractionTreeNode:
-    cdef public int left
-    cdef public int right
-    cdef public int tensor_index
-    cdef public vector[int] free_edges
-    cdef public object left_edge_map
-    cdef public object right_edge_map
-
-    cdef public size_t maxrank
-    cdef public bint is_leaf
-
-
 cdef class ContractionTreeContext:
     def __init__(self):
-        self.nodes = []
-
-    def get_data(self, index):
-        return self.nodes[index]
+        self.version = 0
+        self.flat_cache = None
+        self.stamp = 0
 
     def get_tree(self, index):
         if index < 0:
             raise RuntimeError("Cannot get interface to empty tree")
         return ContractionTree(self, index)
 
+    def left(self, int node):
+        return self.lefts[node]
+
+    def right(self, int node):
+        return self.rights[node]
+
+    def tensor_index(self, int node):
+        return self.tensor_indices[node]
+
+    def is_leaf(self, int node):
+        return self.lefts[node] < 0
+
+    def maxrank(self, int node):
+        return self.maxranks[node]
+
+    def rank(self, int node):
+        return self.free_count[node]
+
+    def free_edges(self, int node):
+        return [self.free_pool[self.free_start[node] + i] for i in range(self.free_count[node])]
+
+    def left_edge_map(self, int node):
+        return [self.left_map_pool[self.map_start[node] + i] for i in range(self.map_count[node])]
+
+    def right_edge_map(self, int node):
+        return [self.right_map_pool[self.map_start[node] + i] for i in range(self.map_count[node])]
+
+    cdef int new_node(self, int tensor_index):
+        self.lefts.push_back(-1)
+        self.rights.push_back(-1)
+        self.tensor_indices.push_back(tensor_index)
+        self.maxranks.push_back(0)
+        self.log_sizes.push_back(0)
+        self.free_start.push_back(self.free_pool.size())
+        self.free_count.push_back(0)
+        self.free_capacity.push_back(0)
+        self.map_start.push_back(self.left_map_pool.size())
+        self.map_count.push_back(0)
+        self.map_capacity.push_back(0)
+        return self.lefts.size() - 1
+
+    cdef size_t reserve_free_edges(self, int node, size_t count):
+        """
+        Make room for [count] free edges of [node], reusing the current storage of the node if possible.
+        :return: The position in free_pool to write the free edges of the node
+        """
+        if count > self.free_capacity[node]:
+            self.free_start[node] = self.free_pool.size()
+            self.free_capacity[node] = count
+            self.free_pool.resize(self.free_pool.size() + count)
+        self.free_count[node] = count
+        return self.free_start[node]
+
+    cdef size_t reserve_edge_maps(self, int node, size_t count):
+        """
+        Make room for [count] contracted edges of [node], reusing the current storage of the node if possible.
+        :return: The position in left_map_pool and right_map_pool to write the edge maps of the node
+        """
+        if count > self.map_capacity[node]:
+            self.map_start[node] = self.left_map_pool.size()
+            self.map_capacity[node] = count
+            self.left_map_pool.resize(self.left_map_pool.size() + count)
+            self.right_map_pool.resize(self.right_map_pool.size() + count)
+        self.map_count[node] = count
+        return self.map_start[node]
+
+    cdef vector[int] postorder(self, int root):
+        """
+        List the nodes below [root] in postorder, with the left child before the right child.
+        """
+        cdef vector[int] result
+        cdef vector[int] stack  # Negative entries ~n indicate that n is ready, after its children
+        cdef int current
+        stack.push_back(root)
+        while stack.size() > 0:
+            current = stack.back()
+            stack.pop_back()
+            if current < 0:
+                result.push_back(~current)
+            elif self.lefts[current] < 0:
+                result.push_back(current)
+            else:
+                stack.push_back(~current)
+                stack.push_back(self.rights[current])
+                stack.push_back(self.lefts[current])
+        return result
+
+    cdef size_t edge_slot(self, int edge):
+        """
+        Map an edge id to a distinct non-negative slot (edges of disconnected indices are negative).
+        """
+        if edge >= 0:
+            return 2 * <size_t>edge
+        return 2 * <size_t>(~edge) + 1
+
+    cdef void clear_marks(self):
+        self.stamp += 1
+
+    cdef bint mark_edge(self, int edge, int value):
+        """
+        Mark [edge] with [value], unless it is already marked.
+        :return: True if the edge was not already marked
+        """
+        cdef size_t slot = self.edge_slot(edge)
+        if slot >= self.mark_stamp.size():
+            self.mark_stamp.resize(2 * slot + 2, 0)
+            self.mark_value.resize(2 * slot + 2, 0)
+        if self.mark_stamp[slot] == self.stamp:
+            return False
+        self.mark_stamp[slot] = self.stamp
+        self.mark_value[slot] = value
+        return True
+
+    cdef void mark_edges(self, int node):
+        """
+        Clear all marks, then mark each free edge of [node] with its first position in the free edges.
+        """
+        cdef size_t start = self.free_start[node], count = self.free_count[node]
+        cdef size_t i
+        self.clear_marks()
+        for i in range(count):
+            self.mark_edge(self.free_pool[start + i], i)
+
+    cdef int marked_value(self, int edge):
+        """
+        :return: The value marked for [edge], or -1 if the edge is not marked
+        """
+        cdef size_t slot = self.edge_slot(edge)
+        if slot < self.mark_stamp.size() and self.mark_stamp[slot] == self.stamp:
+            return self.mark_value[slot]
+        return -1
+
+    cdef double dimension(self, int edge):
+        """
+        :return: The dimension of [edge], which is 2 unless otherwise specified
+        """
+        cdef size_t slot = self.edge_slot(edge)
+        if slot < self.edge_dimensions.size():
+            return self.edge_dimensions[slot]
+        return 2
+
+    cpdef int set_edge_dimension(self, int edge, double dimension) except -2:
+        """
+        Record the dimension of an edge. This must be done before any node with the edge is created.
+
+        :param edge: The edge id
+        :param dimension: The dimension of the edge
+        :return: 0 if successful, or -2 for an exception
+        """
+        cdef size_t slot = self.edge_slot(edge)
+        if slot >= self.edge_dimensions.size():
+            self.edge_dimensions.resize(2 * slot + 2, 2)
+        self.edge_dimensions[slot] = dimension
+        return 0
+
+    def postorder_list(self, int root):
+        return self.postorder(root)
+
+    def flatten(self, int root):
+        """
+        Get the arrays describing the tree below [root], with nodes numbered in postorder.
+
+        :param root: The root of the tree
+        :return: A FlatContractionTree, which is cached until the tree is modified
+        """
+        if self.flat_cache is not None and self.flat_cache[0] == root and self.flat_cache[1] == self.version:
+            return self.flat_cache[2]
+
+        cdef vector[int] order = self.postorder(root)
+        cdef size_t n = order.size()
+        cdef vector[int] position
+        position.resize(self.lefts.size(), -1)
+        cdef size_t i, j, num_free = 0, num_maps = 0
+        for i in range(n):
+            position[order[i]] = i
+            num_free += self.free_count[order[i]]
+            num_maps += self.map_count[order[i]]
+
+        left = numpy.empty(n, dtype=numpy.intc)
+        right = numpy.empty(n, dtype=numpy.intc)
+        tensor_index = numpy.empty(n, dtype=numpy.intc)
+        maxrank = numpy.empty(n, dtype=numpy.intc)
+        free_ptr = numpy.empty(n + 1, dtype=numpy.intc)
+        free_edges = numpy.empty(num_free, dtype=numpy.intc)
+        log_dimensions = numpy.empty(num_free, dtype=numpy.double)
+        map_ptr = numpy.empty(n + 1, dtype=numpy.intc)
+        left_map = numpy.empty(num_maps, dtype=numpy.intc)
+        right_map = numpy.empty(num_maps, dtype=numpy.intc)
+        cdef int[:] left_view = left, right_view = right, tensor_index_view = tensor_index, maxrank_view = maxrank
+        cdef int[:] free_ptr_view = free_ptr, free_edges_view = free_edges
+        cdef double[:] log_dimensions_view = log_dimensions
+        cdef int[:] map_ptr_view = map_ptr, left_map_view = left_map, right_map_view = right_map
+
+        cdef int node
+        free_ptr_view[0] = 0
+        map_ptr_view[0] = 0
+        for i in range(n):
+            node = order[i]
+            if self.lefts[node] < 0:
+                left_view[i] = -1
+                right_view[i] = -1
+            else:
+                left_view[i] = position[self.lefts[node]]
+                right_view[i] = position[self.rights[node]]
+            tensor_index_view[i] = self.tensor_indices[node]
+            maxrank_view[i] = self.maxranks[node]
+            for j in range(self.free_count[node]):
+                free_edges_view[free_ptr_view[i] + j] = self.free_pool[self.free_start[node] + j]
+                log_dimensions_view[free_ptr_view[i] + j] = log2(self.dimension(self.free_pool[self.free_start[node] + j]))
+            free_ptr_view[i + 1] = free_ptr_view[i] + self.free_count[node]
+            for j in range(self.map_count[node]):
+                left_map_view[map_ptr_view[i] + j] = self.left_map_pool[self.map_start[node] + j]
+                right_map_view[map_ptr_view[i] + j] = self.right_map_pool[self.map_start[node] + j]
+            map_ptr_view[i + 1] = map_ptr_view[i] + self.map_count[node]
+
+        result = FlatContractionTree(
+            left, right, tensor_index, maxrank, free_ptr, free_edges, log_dimensions, map_ptr, left_map, right_map
+        )
+        self.flat_cache = (root, self.version, result)
+        return result
+
     cpdef int empty(self):
         return -1
 
     cpdef int leaf(self, TensorNetwork tensor_network, int tensor_index) except -2:
-        cdef ContractionTreeNode new_leaf = ContractionTreeNode()
-        new_leaf.is_leaf = True
-        new_leaf.tensor_index = tensor_index
-        cdef int edge_id
-        for edge_id in tensor_network.__index_lists[tensor_index]:
-            new_leaf.free_edges.push_back(edge_id)
-
-        new_leaf.maxrank = new_leaf.free_edges.size()
-        self.nodes.append(new_leaf)
-        return len(self.nodes) - 1
+        shape = tensor_network.__nodes[tensor_index].shape
+        cdef size_t i
+        for i in range(tensor_network.__index_lists[tensor_index].size()):
+            self.set_edge_dimension(tensor_network.__index_lists[tensor_index][i], shape[i])
+        return self.leaf_manual(tensor_index, tensor_network.__index_lists[tensor_index])
 
     cpdef int leaf_manual(self, int tensor_index, vector[int] free_edges) except -2:
-        cdef ContractionTreeNode new_leaf = ContractionTreeNode()
-        new_leaf.is_leaf = True
-        new_leaf.tensor_index = tensor_index
-        new_leaf.free_edges = free_edges
-        new_leaf.maxrank = new_leaf.free_edges.size()
-        self.nodes.append(new_leaf)
-        return len(self.nodes) - 1
+        cdef int new_leaf = self.new_node(tensor_index)
+        cdef size_t start = self.reserve_free_edges(new_leaf, free_edges.size())
+        cdef size_t i
+        for i in range(free_edges.size()):
+            self.free_pool[start + i] = free_edges[i]
+            self.log_sizes[new_leaf] += log2(self.dimension(free_edges[i]))
+        self.maxranks[new_leaf] = free_edges.size()
+        return new_leaf
 
     cpdef int compute_join_properties(self, int node) except -2:
         """
@@ -251,40 +557,49 @@ cdef class ContractionTreeContext:
         :param node: The id of the join node to process.
         :return: The id of the node if successful, or -2 for an exception
         """
-        cdef ContractionTreeNode new_join = self.nodes[node]
-        cdef ContractionTreeNode left_tree = self.nodes[new_join.left]
-        cdef ContractionTreeNode right_tree = self.nodes[new_join.right]
+        cdef int left_tree = self.lefts[node]
+        cdef int right_tree = self.rights[node]
+        cdef size_t left_start = self.free_start[left_tree], left_count = self.free_count[left_tree]
+        cdef size_t right_start = self.free_start[right_tree], right_count = self.free_count[right_tree]
 
         # Compute the set of free edges for the new contraction tree
-        new_join.free_edges.clear()
-        new_join.left_edge_map = []
-        new_join.right_edge_map = []
-        cdef bint found
-        cdef size_t i, j
-        for i in range(left_tree.free_edges.size()):
-            found = False
-            for j in range(right_tree.free_edges.size()):
-                if left_tree.free_edges[i] == right_tree.free_edges[j]:
-                    new_join.left_edge_map.append(i)
-                    new_join.right_edge_map.append(j)
-                    found = True
-                    break
-            if not found:
-                new_join.free_edges.push_back(left_tree.free_edges[i])
-
-        for j in range(right_tree.free_edges.size()):
-            found = False
-            for i in range(left_tree.free_edges.size()):
-                if left_tree.free_edges[i] == right_tree.free_edges[j]:
-                    found = True
-                    break
-            if not found:
-                new_join.free_edges.push_back(right_tree.free_edges[j])
+        cdef vector[int] free_edges
+        cdef vector[int] left_edge_map
+        cdef vector[int] right_edge_map
+        cdef size_t i
+        cdef int position
+        # Edges of the left tree are free unless they appear in the right tree
+        self.mark_edges(right_tree)
+        for i in range(left_count):
+            position = self.marked_value(self.free_pool[left_start + i])
+            if position >= 0:
+                left_edge_map.push_back(i)
+                right_edge_map.push_back(position)
+            else:
+                free_edges.push_back(self.free_pool[left_start + i])
+
+        # Edges of the right tree are free unless they appear in the left tree
+        self.mark_edges(left_tree)
+        for i in range(right_count):
+            if self.marked_value(self.free_pool[right_start + i]) < 0:
+                free_edges.push_back(self.free_pool[right_start + i])
+
+        # Store the free edges and edge maps (note this may move the storage of any node)
+        cdef size_t start = self.reserve_free_edges(node, free_edges.size())
+        self.log_sizes[node] = 0
+        for i in range(free_edges.size()):
+            self.free_pool[start + i] = free_edges[i]
+            self.log_sizes[node] += log2(self.dimension(free_edges[i]))
+        start = self.reserve_edge_maps(node, left_edge_map.size())
+        for i in range(left_edge_map.size()):
+            self.left_map_pool[start + i] = left_edge_map[i]
+            self.right_map_pool[start + i] = right_edge_map[i]
 
         # Compute the max rank of the new contraction tree
-        new_join.maxrank = max(new_join.free_edges.size(),
-                               left_tree.maxrank,
-                               right_tree.maxrank)
+        self.maxranks[node] = max(free_edges.size(),
+                                  self.maxranks[left_tree],
+                                  self.maxranks[right_tree])
+        self.version += 1
         return node
 
     cpdef int join(self, int left, int right) except -2:
@@ -292,12 +607,10 @@ cdef class ContractionTreeContext:
             return right
         if right == -1:
             return left
-        cdef ContractionTreeNode new_join = ContractionTreeNode()
-        new_join.left = left
-        new_join.right = right
-
-        self.nodes.append(new_join)
-        return self.compute_join_properties(len(self.nodes) - 1)
+        cdef int new_join = self.new_node(-1)
+        self.lefts[new_join] = left
+        self.rights[new_join] = right
+        return self.compute_join_properties(new_join)
 
     cpdef int include_rank_zero_tensors(self, TensorNetwork tensor_network, int contraction_tree) except -2:
         combine_zero_rank = self.empty()
@@ -312,19 +625,20 @@ cdef class ContractionTreeContext:
 
     cpdef int reindex(self, vector[int] new_tid_from_old, vector[int] new_eid_from_old) except -2:
         cdef size_t i
-        cdef ContractionTreeNode node
-        for node in self.nodes:
-            if node.is_leaf:
-                node.tensor_index = new_tid_from_old[node.tensor_index]
-            for i in range(node.free_edges.size()):
-                node.free_edges[i] = new_eid_from_old[node.free_edges[i]]
+        for i in range(self.lefts.size()):
+            if self.lefts[i] < 0:
+                self.tensor_indices[i] = new_tid_from_old[self.tensor_indices[i]]
+        for i in range(self.free_pool.size()):
+            if self.free_pool[i] >= 0:
+                self.free_pool[i] = new_eid_from_old[self.free_pool[i]]
+        self.version += 1
         return 0
 
 
     cpdef int group_if_below(self, int upper, bool upper_left, bool lower_left, size_t if_below) except -2:
         """
         At a node (A (B C)) where (A B) is small, regroup this tree like (C (A B)).
-        
+
         :param upper: The upper join node to consider, which must have a join node as a child.
         :param upper_left: The location of A (True -> left, False -> right)
         :param lower_left: The location of B (True -> left, False -> right)
@@ -332,167 +646,727 @@ cdef class ContractionTreeContext:
         :return: 1 if a swap occurred, otherwise 0
         """
         # Pick out the id of the nodes to consider grouping
-        cdef ContractionTreeNode upper_node = self.nodes[upper]
-        cdef int upper_chosen_id, lower_chosen_id, lower_other_id, lower
+        cdef int upper_chosen_id, lower_chosen_id, lower
         if upper_left:
-            upper_chosen_id = upper_node.left
-            lower = upper_node.right
+            upper_chosen_id = self.lefts[upper]
+            lower = self.rights[upper]
         else:
-            upper_chosen_id = upper_node.right
-            lower = upper_node.left
+            upper_chosen_id = self.rights[upper]
+            lower = self.lefts[upper]
 
-        cdef ContractionTreeNode lower_node = self.nodes[lower]
         if lower_left:
-            lower_chosen_id = lower_node.left
-            lower_other_id = lower_node.right
+            lower_chosen_id = self.lefts[lower]
         else:
-            lower_chosen_id = lower_node.right
-            lower_other_id = lower_node.left
+            lower_chosen_id = self.rights[lower]
 
         # Compute the rank of the tensor obtained from joining the upper and lower chosen nodes
-        cdef ContractionTreeNode upper_chosen_node = self.nodes[upper_chosen_id]
-        cdef ContractionTreeNode lower_chosen_node = self.nodes[lower_chosen_id]
+        cdef size_t rank = self.joined_rank(upper_chosen_id, lower_chosen_id, NULL)
+
+        if rank < if_below:
+            # Perform the swap, and recompute the internal properties of the nodes
+            self.rotate(upper, upper_left, lower_left)
+            return 1
+        return 0
+
+    cdef vector[int] joins_below(self, int root):
+        """
+        Find all join nodes below [root], where each join node appears before its descendants.
+        """
+        cdef vector[int] joins
+        cdef vector[int] stack
+        cdef int current
+        stack.push_back(root)
+        while stack.size() > 0:
+            current = stack.back()
+            stack.pop_back()
+            if self.lefts[current] >= 0:
+                joins.push_back(current)
+                stack.push_back(self.lefts[current])
+                stack.push_back(self.rights[current])
+        return joins
+
+    cdef int recompute_below(self, int root) except -2:
+        """
+        Recompute the free edges, edge maps, and maxrank of every join node below [root], from the bottom up.
+        """
+        cdef vector[int] joins = self.joins_below(root)
+        cdef size_t i
+        for i in range(joins.size()):
+            self.compute_join_properties(joins[joins.size() - 1 - i])
+        return 0
+
+    cpdef int rotate(self, int upper, bool upper_left, bool lower_left) except -2:
+        """
+        At a node (A (B C)), regroup this tree like (C (B A)).
+
+        Only the free edges of the two modified nodes are recomputed; the edge maps of the
+        ancestors of [upper] must be recomputed afterwards.
+
+        :param upper: The upper join node to consider, which must have a join node as a child.
+        :param upper_left: The location of A (True -> left, False -> right)
+        :param lower_left: The location of B (True -> left, False -> right)
+        :return: The id of the lower join node, which now joins A and B
+        """
+        cdef int upper_chosen_id, lower_other_id, lower
+        if upper_left:
+            upper_chosen_id = self.lefts[upper]
+            lower = self.rights[upper]
+        else:
+            upper_chosen_id = self.rights[upper]
+            lower = self.lefts[upper]
+
+        if lower_left:
+            lower_other_id = self.rights[lower]
+        else:
+            lower_other_id = self.lefts[lower]
+
+        if upper_left:
+            self.lefts[upper] = lower_other_id
+        else:
+            self.rights[upper] = lower_other_id
+        if lower_left:
+            # Note the larger node is on the right if the small node on the left
+            self.rights[lower] = upper_chosen_id
+        else:
+            self.lefts[lower] = upper_chosen_id
+
+        self.compute_join_properties(lower)
+        self.compute_join_properties(upper)
+        return lower
+
+    cdef size_t joined_rank(self, int first, int second, double * log_size):
+        """
+        Compute the rank of the tensor obtained by joining two nodes, without creating it.
+
+        If [log_size] is not NULL, also store log2 of the number of entries of the tensor there.
+        """
+        cdef size_t first_start = self.free_start[first], first_count = self.free_count[first]
         cdef size_t i
-        cdef size_t rank = upper_chosen_node.free_edges.size() + lower_chosen_node.free_edges.size()
-        for i in range(upper_chosen_node.free_edges.size()):
-            found = False
-            for j in range(lower_chosen_node.free_edges.size()):
-                if upper_chosen_node.free_edges[i] == lower_chosen_node.free_edges[j]:
-                    rank -= 2   # Edges that appear in both are removed
+        cdef size_t rank = first_count + self.free_count[second]
+        cdef double shared_log_size = 0
+        self.mark_edges(second)
+        for i in range(first_count):
+            if self.marked_value(self.free_pool[first_start + i]) >= 0:
+                rank -= 2   # Edges that appear in both are removed
+                shared_log_size += log2(self.dimension(self.free_pool[first_start + i]))
+        if log_size != NULL:
+            log_size[0] = self.log_sizes[first] + self.log_sizes[second] - 2 * shared_log_size
+        return rank
+
+    cdef double join_cost(self, double left_log_size, double right_log_size, double log_size, double memory_weight):
+        """
+        The objective of [anneal] at a single join: the FLOPs used by estimate_cost
+        and a penalty on the size of the resulting tensor.
+        """
+        return pow(2, (left_log_size + right_log_size + log_size) / 2) + memory_weight * pow(2, log_size)
+
+    cpdef int anneal(self, int root, double time_budget, size_t max_rank, double memory_weight, int seed) except -2:
+        """
+        Improve the tree below [root] in-place by simulated annealing over rotations (A (B C)) -> (C (B A)).
+
+        A rotation only changes the lower join node, so the change in cost of each move is computed
+        from the sizes of A, B, C, and the new lower node alone.
+
+        :param root: The root of the tree to improve.
+        :param time_budget: Time (s) to spend on the search.
+        :param max_rank: Reject any rotation that creates a tensor of rank above [max_rank].
+        :param memory_weight: Penalty per entry of each intermediate tensor.
+        :param seed: Seed for the random moves.
+        :return: 1 if the tree was changed, otherwise 0
+        """
+        cdef vector[int] joins = self.joins_below(root)
+        cdef vector[int] best_left, best_right
+        if joins.size() < 2:
+            return 0
+
+        # Record the best tree seen so far (initially the original tree), which is restored at the end
+        cdef size_t i
+        cdef double total = 0
+        for i in range(joins.size()):
+            best_left.push_back(self.lefts[joins[i]])
+            best_right.push_back(self.rights[joins[i]])
+            total += self.join_cost(
+                self.log_sizes[self.lefts[joins[i]]],
+                self.log_sizes[self.rights[joins[i]]],
+                self.log_sizes[joins[i]],
+                memory_weight
+            )
+        cdef double best_total = total
+        cdef bint improved = False
+
+        # The temperature is measured in log2 of the total cost, and decays geometrically
+        cdef double start_temperature = 1.0, end_temperature = 0.001, temperature = start_temperature
+        cdef double start_time = time.time(), elapsed
+        cdef size_t iteration = 0
+        cdef int upper, lower, a_id, b_id, c_id
+        cdef bool upper_left, lower_left
+        cdef size_t new_rank
+        cdef double a_size, b_size, c_size, lower_size, upper_size, new_size
+        cdef double old_cost, new_cost
+        srand(seed)
+        while True:
+            iteration += 1
+            if iteration % 1024 == 0:
+                # Only snapshot at checkpoints, since copying the tree on every improving move is too slow
+                if total < best_total:
+                    best_total = total
+                    improved = True
+                    for i in range(joins.size()):
+                        best_left[i] = self.lefts[joins[i]]
+                        best_right[i] = self.rights[joins[i]]
+                elapsed = time.time() - start_time
+                if elapsed >= time_budget:
                     break
+                temperature = start_temperature * pow(end_temperature / start_temperature, elapsed / time_budget)
 
-        if rank < if_below:
-            # Perform the swap
+            upper = joins[rand() % joins.size()]
+            upper_left = rand() % 2 == 0
+            lower_left = rand() % 2 == 0
             if upper_left:
-                upper_node.left = lower_other_id
+                a_id = self.lefts[upper]
+                lower = self.rights[upper]
             else:
-                upper_node.right = lower_other_id
+                a_id = self.rights[upper]
+                lower = self.lefts[upper]
+            if self.lefts[lower] < 0:
+                continue
             if lower_left:
-                # Note the larger node is on the right if the small node on the left
-                lower_node.right = upper_chosen_id
+                b_id = self.lefts[lower]
+                c_id = self.rights[lower]
             else:
-                lower_node.left = upper_chosen_id
+                b_id = self.rights[lower]
+                c_id = self.lefts[lower]
+
+            new_rank = self.joined_rank(a_id, b_id, &new_size)
+            if new_rank > max_rank:
+                continue
+            a_size = self.log_sizes[a_id]
+            b_size = self.log_sizes[b_id]
+            c_size = self.log_sizes[c_id]
+            lower_size = self.log_sizes[lower]
+            upper_size = self.log_sizes[upper]
+            old_cost = self.join_cost(b_size, c_size, lower_size, memory_weight) \
+                       + self.join_cost(a_size, lower_size, upper_size, memory_weight)
+            new_cost = self.join_cost(a_size, b_size, new_size, memory_weight) \
+                       + self.join_cost(new_size, c_size, upper_size, memory_weight)
+
+            if new_cost > old_cost and \
+                    rand() >= RAND_MAX * exp(-(log2(total - old_cost + new_cost) - log2(total)) / temperature):
+                continue
+            self.rotate(upper, upper_left, lower_left)
+            total += new_cost - old_cost
+
+        for i in range(joins.size()):
+            self.lefts[joins[i]] = best_left[i]
+            self.rights[joins[i]] = best_right[i]
+
+        # Rotations move join nodes below others, so the edge maps must be recomputed everywhere
+        self.recompute_below(root)
+        return 1 if improved else 0
+
+    cpdef int optimize_windows(self, int root, size_t window_size, size_t max_rank) except -2:
+        """
+        Improve the tree below [root] in-place by optimally reordering windows of the tree.
 
-            # Finally, recompute the internal properties of the nodes
-            self.compute_join_properties(lower)
-            self.compute_join_properties(upper)
-            return 1
+        Each window is a connected set of join nodes whose children outside the window (the frontier)
+        number at most [window_size]. The frontier of each window are the roots of the windows below it.
+
+        :param root: The root of the tree to improve.
+        :param window_size: Largest number of frontier subtrees in each window.
+        :param max_rank: Largest rank allowed for intermediate tensors.
+        :return: The number of windows that were improved
+        """
+        cdef vector[int] window_roots
+        cdef vector[int] frontier
+        cdef vector[int] internal
+        cdef int window_root, node
+        cdef size_t j
+        cdef bint expanded
+        cdef int improved = 0
+        window_roots.push_back(root)
+        while window_roots.size() > 0:
+            window_root = window_roots.back()
+            window_roots.pop_back()
+            if self.lefts[window_root] < 0:
+                continue
+
+            # Expand the window breadth-first until the frontier is large enough
+            frontier.clear()
+            internal.clear()
+            internal.push_back(window_root)
+            frontier.push_back(self.lefts[window_root])
+            frontier.push_back(self.rights[window_root])
+            expanded = True
+            while expanded and frontier.size() < window_size:
+                expanded = False
+                j = 0
+                while j < frontier.size() and frontier.size() < window_size:
+                    node = frontier[j]
+                    if self.lefts[node] >= 0:
+                        internal.push_back(node)
+                        frontier[j] = self.lefts[node]
+                        frontier.push_back(self.rights[node])
+                        expanded = True
+                    j += 1
+
+            improved += self.solve_window(internal, frontier, max_rank)
+            for j in range(frontier.size()):
+                window_roots.push_back(frontier[j])
+
+        if improved > 0:
+            self.recompute_below(root)
+        return improved
+
+    cdef int solve_window(self, vector[int] & internal, vector[int] & frontier, size_t max_rank) except -2:
+        """
+        Find the contraction order of [frontier] with the fewest FLOPs by dynamic programming over subsets,
+        and use it if it is cheaper than the current order.
+
+        :param internal: The join nodes of the window; internal[0] is the root of the window.
+        :param frontier: The subtrees joined by the window.
+        :param max_rank: Largest rank allowed for intermediate tensors.
+        :return: 1 if the window was changed, otherwise 0
+        """
+        cdef size_t k = frontier.size()
+        if k <= 2:
+            return 0
+
+        # Compute the FLOPs of the current order
+        cdef double current_cost = 0
+        cdef size_t i, j
+        for i in range(internal.size()):
+            current_cost += self.join_cost(
+                self.log_sizes[self.lefts[internal[i]]],
+                self.log_sizes[self.rights[internal[i]]],
+                self.log_sizes[internal[i]],
+                0
+            )
+
+        # Assign each edge of the frontier a bit
+        cdef size_t num_edges = 0
+        cdef vector[double] edge_log_dimension
+        cdef int e
+        self.clear_marks()
+        for i in range(k):
+            for j in range(self.free_count[frontier[i]]):
+                e = self.free_pool[self.free_start[frontier[i]] + j]
+                if self.mark_edge(e, num_edges):
+                    edge_log_dimension.push_back(log2(self.dimension(e)))
+                    num_edges += 1
+        cdef size_t words = (num_edges + 63) // 64
+        if words == 0:
+            words = 1
+
+        # The free edges of a set of subtrees are exactly the edges that appear in one subtree of the set
+        cdef size_t num_sets = (<size_t>1) << k
+        cdef vector[uint64_t] free_bits
+        cdef vector[size_t] rank
+        cdef vector[double] log_size
+        cdef vector[double] cost
+        cdef vector[size_t] best_split
+        free_bits.resize(num_sets * words, 0)
+        rank.resize(num_sets, 0)
+        log_size.resize(num_sets, 0)
+        cost.resize(num_sets, INFINITY)
+        best_split.resize(num_sets, 0)
+        cdef size_t subset, lowest, w, which
+        cdef uint64_t bits
+        for i in range(k):
+            for j in range(self.free_count[frontier[i]]):
+                which = self.marked_value(self.free_pool[self.free_start[frontier[i]] + j])
+                free_bits[((<size_t>1) << i) * words + which // 64] |= (<uint64_t>1) << (which % 64)
+        for subset in range(1, num_sets):
+            lowest = subset & (~subset + 1)
+            if lowest != subset:
+                for w in range(words):
+                    free_bits[subset * words + w] = free_bits[(subset ^ lowest) * words + w] ^ free_bits[lowest * words + w]
+            for w in range(words):
+                bits = free_bits[subset * words + w]
+                rank[subset] += popcount(bits)
+                while bits != 0:
+                    log_size[subset] += edge_log_dimension[w * 64 + count_trailing_zeros(bits)]
+                    bits &= bits - 1
+
+        # Compute the cheapest way to contract each set, splitting off the set containing the lowest subtree
+        cdef size_t left_set, right_set
+        cdef double split_cost
+        for subset in range(1, num_sets):
+            lowest = subset & (~subset + 1)
+            if lowest == subset:
+                cost[subset] = 0
+                continue
+            if rank[subset] > max_rank and subset != num_sets - 1:
+                continue
+            left_set = (subset - 1) & subset
+            while left_set > 0:
+                if left_set & lowest:
+                    right_set = subset ^ left_set
+                    split_cost = cost[left_set] + cost[right_set]
+                    if split_cost < cost[subset]:
+                        split_cost += self.join_cost(log_size[left_set], log_size[right_set], log_size[subset], 0)
+                        if split_cost < cost[subset]:
+                            cost[subset] = split_cost
+                            best_split[subset] = left_set
+                left_set = (left_set - 1) & subset
+        if not cost[num_sets - 1] < current_cost * (1 - 1e-9):
+            return 0
+
+        # Rebuild the window using the same join nodes, with the window root in place
+        cdef vector[int] unused_joins
+        for i in range(1, internal.size()):
+            unused_joins.push_back(internal[i])
+        cdef vector[size_t] set_stack
+        cdef vector[int] node_stack
+        cdef vector[int] rebuilt
+        cdef size_t child_set
+        cdef int node
+        cdef int child_ids[2]
+        set_stack.push_back(num_sets - 1)
+        node_stack.push_back(internal[0])
+        while set_stack.size() > 0:
+            subset = set_stack.back()
+            set_stack.pop_back()
+            node = node_stack.back()
+            node_stack.pop_back()
+            rebuilt.push_back(node)
+            for i in range(2):
+                child_set = best_split[subset] if i == 0 else subset ^ best_split[subset]
+                if child_set & (child_set - 1) == 0:
+                    # A single frontier subtree
+                    for w in range(k):
+                        if child_set == (<size_t>1) << w:
+                            child_ids[i] = frontier[w]
+                else:
+                    child_ids[i] = unused_joins.back()
+                    unused_joins.pop_back()
+                    set_stack.push_back(child_set)
+                    node_stack.push_back(child_ids[i])
+            self.lefts[node] = child_ids[0]
+            self.rights[node] = child_ids[1]
+        for i in range(rebuilt.size()):
+            self.compute_join_properties(rebuilt[rebuilt.size() - 1 - i])
+        return 1
+
+    cpdef int regroup(self, int root, size_t rank_limit) except -2:
+        """
+        Regroup (A (B C)) like (C (A B)) where A, B, and (A B) are small but C is large (see ContractionTree.regroup).
+
+        :param root: The root of the tree to regroup
+        :param rank_limit: A tensor is small if its maxrank is below [rank_limit]
+        :return: 0 if successful, or -2 for an exception
+        """
+        # Entries of the stacks are (small_on_left, small), where:
+        #   small_on_left == 1 means that a small tensor is on the left and a large tensor is on the right
+        #   small_on_left == 0 means that a small tensor is on the right and a large tensor is on the left
+        #   small_on_left == -1 otherwise (i.e., at a leaf, or both small, or both large)
+        #   small is True if the current tensor is small, and large otherwise
+        cdef vector[int] small_on_left_stack
+        cdef vector[int] small_stack
+        cdef int node, small_on_left, left_small_on_left, right_small_on_left
+        cdef bint left_small, right_small
+
+        cdef vector[int] order = self.postorder(root)
+        for node in order:
+            if self.lefts[node] < 0:
+                small_on_left_stack.push_back(-1)
+                small_stack.push_back(self.maxranks[node] < rank_limit)
+            else:
+                right_small_on_left = small_on_left_stack.back()
+                small_on_left_stack.pop_back()
+                right_small = small_stack.back()
+                small_stack.pop_back()
+                left_small_on_left = small_on_left_stack.back()
+                small_on_left_stack.pop_back()
+                left_small = small_stack.back()
+                small_stack.pop_back()
+
+                if right_small_on_left != -1 and left_small:  # (A (B C)) or (A (C B)) => (C (A B))
+                    if self.group_if_below(node, True, right_small_on_left == 1, rank_limit) == 1:
+                        # Now left is large, right is small
+                        left_small = False
+                        right_small = True
+                elif left_small_on_left != -1 and right_small:  # ((B C) A) or ((C B) A) => ((A B) C)
+                    if self.group_if_below(node, False, left_small_on_left == 1, rank_limit) == 1:
+                        # Now right is large, left is small
+                        left_small = True
+                        right_small = False
+
+                # Determine the location of the large tensor
+                if left_small and not right_small:
+                    small_on_left = 1
+                elif right_small and not left_small:
+                    small_on_left = 0
+                else:
+                    small_on_left = -1
+                small_on_left_stack.push_back(small_on_left)
+                small_stack.push_back(self.maxranks[node] < rank_limit)
         return 0
 
-    cpdef CostInfo estimate_cost(self, size_t node_id, cset[int] & sliced_edges):
+    cpdef int sort_small(self, int root) except -2:
         """
+        Sort each join node below [root] so that the smaller tensor appears on the right.
 
-        :param slices: A set of edges that have been sliced (and so have dimension 1)
-        :return: 
-        
-        Compute the time and memory cap required to contract starting from this node.
-        
-        :param node_id: The node to contract from
+        :param root: The root of the tree to sort
+        :return: 0 if successful, or -2 for an exception
+        """
+        cdef vector[int] stack  # 1 if the edge order below might have changed
+        cdef int node, temp, result
+        cdef vector[int] order = self.postorder(root)
+        for node in order:
+            if self.lefts[node] < 0:
+                stack.push_back(0)
+            else:
+                result = stack.back()
+                stack.pop_back()
+                result += stack.back()
+                stack.pop_back()
+                if self.free_count[self.lefts[node]] < self.free_count[self.rights[node]]:
+                    temp = self.lefts[node]
+                    self.lefts[node] = self.rights[node]
+                    self.rights[node] = temp
+                    result += 1
+                if result > 0:
+                    self.compute_join_properties(node)
+                    stack.push_back(1)
+                else:
+                    stack.push_back(0)
+        return 0
+
+    cpdef int order_by_memory(self, int root, cset[int] & sliced_edges) except -2:
+        """
+        Order the children of each join node below [root] so that the memory cap of estimate_cost is minimized.
+
+        As in Sethi-Ullman numbering, the child whose evaluation needs the most memory (beyond the memory of its
+        result, which is held while the other child is computed) is computed first, i.e. placed on the left.
+        The minimal memory cap of each subtree does not depend on the order above it, so choosing the better order
+        at each join (bottom-up) is optimal. The FLOPs and max-rank of the tree do not change.
+
+        :param root: The root of the tree to order
         :param sliced_edges: A set of edges that have been sliced (and so have dimension 1)
-        :return: Various information on cost (total FLOPs, memory cap, best edge to slice to reduce memory)
+        :return: 0 if successful, or -2 for an exception
         """
-        cdef CostInfo result = CostInfo()
-        cdef ContractionTreeNode node = self.nodes[node_id]
+        cdef vector[int] order = self.postorder(root)
+        cdef int node, left, right, e
+        cdef size_t i
 
-        # Compute the memory required to store the left, right, and result tensors
-        result.local_memory = 1
-        cdef int i
-        for i in node.free_edges:
-            if sliced_edges.find(i) == sliced_edges.end():
-                result.local_memory *= 2
+        # Compute the memory required to store each tensor (before any marks are reused by compute_join_properties)
+        cdef vector[double] local_memory = vector[double](self.lefts.size(), 1)
+        self.clear_marks()
+        for e in sliced_edges:
+            self.mark_edge(e, 1)
+        for node in order:
+            for i in range(self.free_count[node]):
+                e = self.free_pool[self.free_start[node] + i]
+                if self.marked_value(e) < 0:
+                    local_memory[node] *= self.dimension(e)
+
+        # Stacks of the memory cap of the subtrees processed so far, and whether their edge order might have changed
+        cdef vector[double] total_memory
+        cdef vector[int] changed
+        cdef double left_total, right_total, local_cap, keep_cap, swap_cap
+        cdef int result
+        for node in order:
+            if self.lefts[node] < 0:
+                total_memory.push_back(local_memory[node])
+                changed.push_back(0)
+                continue
+
+            right_total = total_memory.back()
+            total_memory.pop_back()
+            left_total = total_memory.back()
+            total_memory.pop_back()
+            result = changed.back()
+            changed.pop_back()
+            result += changed.back()
+            changed.pop_back()
+
+            left = self.lefts[node]
+            right = self.rights[node]
+            local_cap = local_memory[node] + 2 * local_memory[left] + 2 * local_memory[right]
+            keep_cap = max(left_total, local_memory[left] + right_total, local_cap)
+            swap_cap = max(right_total, local_memory[right] + left_total, local_cap)
+            if swap_cap < keep_cap:
+                self.lefts[node] = right
+                self.rights[node] = left
+                keep_cap = swap_cap
+                result += 1
+            total_memory.push_back(keep_cap)
+            if result > 0:
+                self.compute_join_properties(node)
+                changed.push_back(1)
+            else:
+                changed.push_back(0)
+        return 0
 
-        if node.is_leaf:
-            result.FLOPs = 0
-            result.total_memory = result.local_memory
-            result.largest_tensor = 0
-            for i in node.free_edges:
-                if sliced_edges.find(i) == sliced_edges.end():
-                    result.open_edge_total_memory[i] = result.total_memory / 2
-                    result.largest_tensor += 1
-            # Leaf tensors do not yet have bond indices
-            result.best_edge = -1
-            result.best_edge_memory = (2**64)
-            return result
-
-        cdef CostInfo left = self.estimate_cost(node.left, sliced_edges)
-        cdef CostInfo right = self.estimate_cost(node.right, sliced_edges)
-
-        cdef ContractionTreeNode left_node = self.nodes[node.left]
-        cdef ContractionTreeNode right_node = self.nodes[node.right]
-
-        # The left tensor is computed first
-        cdef double left_cap = left.total_memory
-        # The left tensor must be stored while computing the right
-        cdef double right_cap = left.local_memory + right.total_memory
-        # The left and right tensors must be stored while computing the result
-        # and left and right must be transposed first
-        cdef double local_cap = result.local_memory + 2 * left.local_memory + 2 * right.local_memory
-
-        # The overall memory cap needed is max(left_cap, right_cap, local_cap)
-        # The best edge to slice (not including edges free in both left and right) follows the maximum value as well
-        if left_cap >= right_cap and left_cap >= local_cap:
-            result.total_memory = left_cap
-            result.best_edge = left.best_edge
-            result.best_edge_memory = left.best_edge_memory
-        elif right_cap >= local_cap:
-            result.total_memory = right_cap
-            result.best_edge = right.best_edge
-            result.best_edge_memory = left.local_memory + right.best_edge_memory
-        else:
-            result.total_memory = local_cap
-            result.best_edge = left.best_edge
-            # Note that this does not actually decrease the memory cap
-            # The optimal edge to slice is one of the open edges
-            result.best_edge_memory = local_cap
-
-        # Compute the number of multiplications that must be performed across all np.tensordot calls during identify
-        cdef size_t log_terms_in_sum = int(
-            (left_node.free_edges.size() + right_node.free_edges.size() - node.free_edges.size()) / 2
-        )
-        cdef size_t log_num_sums = node.free_edges.size()
+    cpdef CostInfo estimate_cost(self, size_t node_id, cset[int] & sliced_edges):
+        """
+        Compute the time and memory cap required to contract starting from this node.
 
-        # One multiply to compute each term and one add to sum it in
-        if log_terms_in_sum + log_num_sums > 100:
-            result.FLOPs = 2**100  # Cap
-        else:
-            result.FLOPs = left.FLOPs + right.FLOPs + 2 ** (log_terms_in_sum + log_num_sums)
-
-        # Compute the largest encountered tensor, including the resulting tensor from here
-        result.largest_tensor = 0
-        for i in node.free_edges:
-            if sliced_edges.find(i) == sliced_edges.end():
-                result.largest_tensor += 1
-        result.largest_tensor = max(result.largest_tensor, left.largest_tensor, right.largest_tensor)
-
-
-        # For each free edge, compute the memory cap needed if it is sliced
-        for e in left_node.free_edges:
-            if right.open_edge_total_memory.find(e) == right.open_edge_total_memory.end():
-                result.open_edge_total_memory[e] = max(max(
-                    left.open_edge_total_memory[e],
-                    (left.local_memory / 2) + right.total_memory),
-                    (result.local_memory / 2) + 2 * (left.local_memory / 2) + 2 * right.local_memory
-                )
+        The tree is processed in postorder, keeping the cost information of pending subtrees on a stack.
 
-        cdef double new_cap
-        for e in right_node.free_edges:
-            if left.open_edge_total_memory.find(e) == left.open_edge_total_memory.end():
-                result.open_edge_total_memory[e] = max(max(
-                    left.total_memory,
-                    left.local_memory + right.open_edge_total_memory[e]),
-                    (result.local_memory / 2) + 2 * left.local_memory + 2 * right.local_memory
-                )
-            elif sliced_edges.find(e) == sliced_edges.end():
-                # For each newly bond edge, compute the new memory cap if it is sliced
-                new_cap = max(max(
-                    left.open_edge_total_memory[e],
-                    (left.local_memory / 2) + right.open_edge_total_memory[e]),
-                    result.local_memory + 2 * (left.local_memory / 2) + 2 * (right.local_memory / 2)
-                )
-                # Check if this new bond edge is now the best edge to slice
-                if new_cap < result.best_edge_memory:
-                    result.best_edge = e
-                    result.best_edge_memory = new_cap
+        :param node_id: The node to contract from
+        :param sliced_edges: A set of edges that have been sliced (and so have dimension 1)
+        :return: Various information on cost (total FLOPs, memory cap, best edge to slice to reduce memory)
+        """
+        # Stacks of the cost information of the subtrees processed so far (see CostInfo)
+        cdef vector[double] FLOPs
+        cdef vector[double] total_memory
+        cdef vector[double] local_memory
+        cdef vector[int] largest_tensor
+        cdef vector[int] best_edge
+        cdef vector[double] best_edge_memory
+        cdef vector[unordered_map[size_t, double]] open_edge_total_memory
+
+        cdef unordered_map[size_t, double] left_open, right_open
+        cdef double left_FLOPs, left_total, left_local, left_best_memory
+        cdef double right_FLOPs, right_total, right_local, right_best_memory
+        cdef int left_largest, left_best, right_largest, right_best
+        cdef double result_local, left_cap, right_cap, local_cap, new_cap
+        cdef double dimension, join_FLOPs
+        cdef size_t i, top
+        cdef int node, e, left_node, right_node, largest
+
+        # Mark the sliced edges, so that each edge can be checked in constant time
+        self.clear_marks()
+        for e in sliced_edges:
+            self.mark_edge(e, 1)
+
+        cdef vector[int] order = self.postorder(node_id)
+        for node in order:
+            # Compute the memory required to store the left, right, and result tensors
+            result_local = 1
+            largest = 0
+            for i in range(self.free_count[node]):
+                if self.marked_value(self.free_pool[self.free_start[node] + i]) < 0:
+                    result_local *= self.dimension(self.free_pool[self.free_start[node] + i])
+                    largest += 1
+
+            if self.lefts[node] < 0:
+                top = FLOPs.size()
+                FLOPs.push_back(0)
+                total_memory.push_back(result_local)
+                local_memory.push_back(result_local)
+                largest_tensor.push_back(largest)
+                open_edge_total_memory.push_back(unordered_map[size_t, double]())
+                for i in range(self.free_count[node]):
+                    e = self.free_pool[self.free_start[node] + i]
+                    if self.marked_value(e) < 0:
+                        open_edge_total_memory[top][e] = result_local / self.dimension(e)
+                # Leaf tensors do not yet have bond indices
+                best_edge.push_back(-1)
+                best_edge_memory.push_back(2**64)
+                continue
+
+            # Pop the cost information of the right and left subtrees
+            right_FLOPs = FLOPs.back()
+            right_total = total_memory.back()
+            right_local = local_memory.back()
+            right_largest = largest_tensor.back()
+            right_best = best_edge.back()
+            right_best_memory = best_edge_memory.back()
+            right_open.swap(open_edge_total_memory.back())
+            FLOPs.pop_back()
+            total_memory.pop_back()
+            local_memory.pop_back()
+            largest_tensor.pop_back()
+            best_edge.pop_back()
+            best_edge_memory.pop_back()
+            open_edge_total_memory.pop_back()
+
+            left_FLOPs = FLOPs.back()
+            left_total = total_memory.back()
+            left_local = local_memory.back()
+            left_largest = largest_tensor.back()
+            left_best = best_edge.back()
+            left_best_memory = best_edge_memory.back()
+            left_open.swap(open_edge_total_memory.back())
+            top = FLOPs.size() - 1
+            # The result replaces the left subtree on the stack
+            open_edge_total_memory[top].clear()
+
+            left_node = self.lefts[node]
+            right_node = self.rights[node]
+
+            # The left tensor is computed first
+            left_cap = left_total
+            # The left tensor must be stored while computing the right
+            right_cap = left_local + right_total
+            # The left and right tensors must be stored while computing the result
+            # and left and right must be transposed first
+            local_cap = result_local + 2 * left_local + 2 * right_local
+
+            # The overall memory cap needed is max(left_cap, right_cap, local_cap)
+            # The best edge to slice (not including edges free in both left and right) follows the maximum value as well
+            if left_cap >= right_cap and left_cap >= local_cap:
+                total_memory[top] = left_cap
+                best_edge[top] = left_best
+                best_edge_memory[top] = left_best_memory
+            elif right_cap >= local_cap:
+                total_memory[top] = right_cap
+                best_edge[top] = right_best
+                best_edge_memory[top] = left_local + right_best_memory
+            else:
+                total_memory[top] = local_cap
+                best_edge[top] = left_best
+                # Note that this does not actually decrease the memory cap
+                # The optimal edge to slice is one of the open edges
+                best_edge_memory[top] = local_cap
+            local_memory[top] = result_local
+
+            # Compute the number of multiplications that must be performed across all np.tensordot calls during identify
+            # The left and right tensors together contain the contracted edges twice and the result edges once,
+            # so the number of terms in each sum times the number of sums is sqrt(left * right * result)
+            join_FLOPs = sqrt(left_local * right_local * result_local)
+
+            # One multiply to compute each term and one add to sum it in
+            if join_FLOPs > 2.0**100:
+                FLOPs[top] = 2.0**100  # Cap
+            else:
+                FLOPs[top] = left_FLOPs + right_FLOPs + join_FLOPs
+
+            # Compute the largest encountered tensor, including the resulting tensor from here
+            largest_tensor[top] = max(largest, left_largest, right_largest)
+
+            # For each free edge, compute the memory cap needed if it is sliced
+            for i in range(self.free_count[left_node]):
+                e = self.free_pool[self.free_start[left_node] + i]
+                if right_open.find(e) == right_open.end():
+                    dimension = self.dimension(e)
+                    open_edge_total_memory[top][e] = max(max(
+                        left_open[e],
+                        (left_local / dimension) + right_total),
+                        (result_local / dimension) + 2 * (left_local / dimension) + 2 * right_local
+                    )
+
+            for i in range(self.free_count[right_node]):
+                e = self.free_pool[self.free_start[right_node] + i]
+                dimension = self.dimension(e)
+                if left_open.find(e) == left_open.end():
+                    open_edge_total_memory[top][e] = max(max(
+                        left_total,
+                        left_local + right_open[e]),
+                        (result_local / dimension) + 2 * left_local + 2 * right_local
+                    )
+                elif self.marked_value(e) < 0:
+                    # For each newly bond edge, compute the new memory cap if it is sliced
+                    new_cap = max(max(
+                        left_open[e],
+                        (left_local / dimension) + right_open[e]),
+                        result_local + 2 * (left_local / dimension) + 2 * (right_local / dimension)
+                    )
+                    # Check if this new bond edge is now the best edge to slice
+                    if new_cap < best_edge_memory[top]:
+                        best_edge[top] = e
+                        best_edge_memory[top] = new_cap
+
+        cdef CostInfo result = CostInfo()
+        result.FLOPs = FLOPs.back()
+        result.total_memory = total_memory.back()
+        result.local_memory = local_memory.back()
+        result.largest_tensor = largest_tensor.back()
+        result.best_edge = best_edge.back()
+        result.best_edge_memory = best_edge_memory.back()
+        result.open_edge_total_memory.swap(open_edge_total_memory.back())
         return result
 
 
@@ -5,6 +5,8 @@ import random
 import time
 
 from contraction_methods.contraction_method import ContractionMethod
+from contraction_methods import pipeline
+from contraction_methods import sampling
 import decompositions.decomposition_solver
 import util
 
@@ -15,6 +17,32 @@ from tensor_network.tensor_network cimport TensorNetwork
 from libcpp.unordered_map cimport unordered_map
 from libcpp.vector cimport vector
 
+cdef void intersect_sorted(vector[int] & small, vector[int] & large, vector[int] & result):
+    """
+    Compute the intersection of two sorted lists, in time O(|small| log |large|).
+
+    :param small: The smaller sorted list
+    :param large: The larger sorted list
+    :param result: Set to the sorted intersection
+    """
+    result.clear()
+    cdef size_t low = 0, high, middle
+    cdef int item
+    for item in small:
+        # Binary search for the first position of [large] from [low] that is at least [item]
+        high = large.size()
+        while low < high:
+            middle = (low + high) // 2
+            if large[middle] < item:
+                low = middle + 1
+            else:
+                high = middle
+        if low == large.size():
+            return
+        if large[low] == item:
+            result.push_back(item)
+
+
 cdef extract_tree_decomposition_edges(TensorNetwork tensor_network, TreeDecomposition decomposition):
     """
     For each edge in the tensor network, choose one of the nodes in the tree decomposition
@@ -29,24 +57,23 @@ cdef extract_tree_decomposition_edges(TensorNetwork tensor_network, TreeDecompos
     :return: A mapping from each tree decomposition leaf to the corresponding edge of the network.
     """
 
-    # Use 64-bit to avoid overflow in bag_pair_id with fewer than 2^32 tensors
-    cdef long long a, b, id1, id2, bag_pair_id, sorted_tensors
-    max_bag_item = len(tensor_network)
+    # Use 64-bit to avoid overflow in the pair ids with fewer than 2^32 tensors
+    cdef long long id1, id2, sorted_tensors
+    cdef long long max_bag_item = len(tensor_network)
 
-    # For every pair of tensors, record which nodes contain both in its bag
-    cdef unordered_map[int, vector[int]] pairs_in_nodes
+    # For every tensor, record which nodes contain it in its bag (in increasing order),
+    #   which takes space linear in the size of the decomposition
+    cdef vector[vector[int]] nodes_of_tensor = vector[vector[int]](max_bag_item)
     cdef size_t node
+    cdef int a
     for node in range(decomposition.bags.size()):
         for a in decomposition.bags[node]:
-            for b in decomposition.bags[node]:
-                if a != b:
-                    bag_pair_id = a * max_bag_item + b  # Since ctuple does not have default hashing defined in cython
-                    if pairs_in_nodes.find(bag_pair_id) == pairs_in_nodes.end():
-                        pairs_in_nodes[bag_pair_id] = vector[int]()
-                    pairs_in_nodes[bag_pair_id].push_back(node)
+            if 0 <= a < max_bag_item and (nodes_of_tensor[a].empty() or nodes_of_tensor[a].back() != <int>node):
+                nodes_of_tensor[a].push_back(node)
 
     # For each tensor network edge, choose a leaf that contains both incident tensors
     cdef unordered_map[long long, int] chosen_node_cache
+    cdef vector[int] candidates
     cdef size_t chosen_node_index
     cdef int chosen_node
     cdef unordered_map[int, int] node_to_edge
@@ -56,11 +83,17 @@ cdef extract_tree_decomposition_edges(TensorNetwork tensor_network, TreeDecompos
         id2 = tensor_network.__edges[edge_id].tensor2_id
         sorted_tensors = min(id1, id2) * max_bag_item + max(id1, id2)
         if chosen_node_cache.find(sorted_tensors) == chosen_node_cache.end():
-            if pairs_in_nodes[sorted_tensors].size() == 1:
+            if nodes_of_tensor[id1].size() <= nodes_of_tensor[id2].size():
+                intersect_sorted(nodes_of_tensor[id1], nodes_of_tensor[id2], candidates)
+            else:
+                intersect_sorted(nodes_of_tensor[id2], nodes_of_tensor[id1], candidates)
+            if candidates.size() == 0:
+                raise RuntimeError("No bag contains the tensors " + str(id1) + " and " + str(id2))
+            elif candidates.size() == 1:
                 chosen_node_index = 0
             else:
-                chosen_node_index = random.randint(0, pairs_in_nodes[sorted_tensors].size()-1)
-            chosen_node = pairs_in_nodes[sorted_tensors][chosen_node_index]
+                chosen_node_index = random.randint(0, candidates.size()-1)
+            chosen_node = candidates[chosen_node_index]
             chosen_node_cache[sorted_tensors] = decomposition.extend_leaf(chosen_node)
         else:
             chosen_node = chosen_node_cache[sorted_tensors]
@@ -74,74 +107,73 @@ cdef class ChildInfo:
     cdef unordered_map[size_t, int] intermediate_edge
 
 
-cdef ChildInfo factor_tree(
-    vector[vector[int]] & neighbors,
+cdef ChildInfo factor_leaf(
     int node,
-    int parent,
     TensorNetwork tensor_network,
     ContractionTreeContext context,
     unordered_map[int, int] & node_to_edge
 ):
     """
-    Traverse a tree decomposition to implement Factor-Tree.
-
-    In particular, this implements Part 2 of the proof Thm 4 of https://arxiv.org/abs/1908.04381.
+    Start Factor-Tree at a leaf of the tree decomposition.
 
-    :param neighbors: The neighbors of the underlying tree to traverse.
-    :param node: The current node to process.
-    :param parent: The parent of this node in the tree decomposition.
+    :param node: The leaf to process.
     :param tensor_network: The underlying tensor network.
     :param context: A storage object for the created contraction trees.
     :param node_to_edge: A mapping from tree leaf node ids to tensor edges.
-    :return: A processor to implement Factor-Tree on the corresponding tree.
+    :return: The contraction tree and the edges propagated from this leaf.
     """
-    cdef vector[int] children
-    cdef size_t i
-    for i in range(neighbors[node].size()):
-        if neighbors[node][i] != parent:
-            children.push_back(neighbors[node][i])
-
-    # If we are at a node with a single child, just propagate up the marked edges
-    if children.size() == 1:
-        return factor_tree(neighbors, children[0], node, tensor_network, context, node_to_edge)
-
     cdef ChildInfo result = ChildInfo()
     cdef size_t tensor_id
     cdef size_t edge_id
-    if children.size() == 0:
-        # We are at the leaf of the tree decomposition
-        result.contraction_tree = context.empty()
-        if node_to_edge.find(node) == node_to_edge.end():
-            # If no edges are marked at this leaf, do nothing
-            return result
+    # We are at the leaf of the tree decomposition
+    result.contraction_tree = context.empty()
+    if node_to_edge.find(node) == node_to_edge.end():
+        # If no edges are marked at this leaf, do nothing
+        return result
+    else:
+        # Otherwise, we propagate up the edge marked at this leaf
+        edge_id = node_to_edge[node]
+        edge = tensor_network.__edges[edge_id]
+        tensor_id = edge.tensor1_id
+        if tensor_network.__index_lists[tensor_id].size() <= 1:
+            # Rank 1 tensors can be contracted immediately
+            result.contraction_tree = context.join(
+                result.contraction_tree, context.leaf(tensor_network, tensor_id)
+            )
         else:
-            # Otherwise, we propagate up the edge marked at this leaf
-            edge_id = node_to_edge[node]
-            edge = tensor_network.__edges[edge_id]
-            tensor_id = edge.tensor1_id
-            if tensor_network.__index_lists[tensor_id].size() <= 1:
-                # Rank 1 tensors can be contracted immediately
-                result.contraction_tree = context.join(
-                    result.contraction_tree, context.leaf(tensor_network, tensor_id)
-                )
-            else:
-                result.intermediate_edge[tensor_id] = edge.id
+            result.intermediate_edge[tensor_id] = edge.id
 
-            tensor_id = edge.tensor2_id
-            if tensor_network.__index_lists[tensor_id].size() <= 1:
-                # Rank 1 tensors can be contracted immediately
-                result.contraction_tree = context.join(
-                    result.contraction_tree, context.leaf(tensor_network, tensor_id)
-                )
-            else:
-                result.intermediate_edge[tensor_id] = edge.id
+        tensor_id = edge.tensor2_id
+        if tensor_network.__index_lists[tensor_id].size() <= 1:
+            # Rank 1 tensors can be contracted immediately
+            result.contraction_tree = context.join(
+                result.contraction_tree, context.leaf(tensor_network, tensor_id)
+            )
+        else:
+            result.intermediate_edge[tensor_id] = edge.id
+
+        return result
 
-            return result
 
-    # Otherwise, we are at an internal node of degree 3, and we have the propagated edges from two children
-    cdef ChildInfo left = factor_tree(neighbors, children[0], node, tensor_network, context, node_to_edge)
-    cdef ChildInfo right = factor_tree(neighbors, children[1], node, tensor_network, context, node_to_edge)
+cdef ChildInfo factor_join(
+    ChildInfo left,
+    ChildInfo right,
+    TensorNetwork tensor_network,
+    ContractionTreeContext context
+):
+    """
+    Continue Factor-Tree at an internal node of degree 3 of the tree decomposition,
+    given the propagated edges from its two children.
 
+    :param left: The result at the first child.
+    :param right: The result at the second child.
+    :param tensor_network: The underlying tensor network.
+    :param context: A storage object for the created contraction trees.
+    :return: The contraction tree and the edges propagated from this node.
+    """
+    cdef ChildInfo result = ChildInfo()
+    cdef size_t tensor_id
+    cdef size_t i
     cdef int left_contraction = left.contraction_tree
     cdef int right_contraction = right.contraction_tree
 
@@ -229,12 +261,77 @@ cdef ChildInfo factor_tree(
     return result
 
 
-cdef object extract_contraction_tree_from_tree(TensorNetwork tensor_network, TreeDecomposition decomposition):
+cdef ChildInfo factor_tree(
+    vector[vector[int]] & neighbors,
+    int root,
+    TensorNetwork tensor_network,
+    ContractionTreeContext context,
+    unordered_map[int, int] & node_to_edge
+):
+    """
+    Traverse a tree decomposition to implement Factor-Tree.
+
+    In particular, this implements Part 2 of the proof Thm 4 of https://arxiv.org/abs/1908.04381.
+    The tree is traversed with an explicit stack (rather than by recursion) to handle deep trees.
+
+    :param neighbors: The neighbors of the underlying tree to traverse.
+    :param root: The root of the traversal, which must be a leaf.
+    :param tensor_network: The underlying tensor network.
+    :param context: A storage object for the created contraction trees.
+    :param node_to_edge: A mapping from tree leaf node ids to tensor edges.
+    :return: The contraction tree and the edges propagated from the root.
+    """
+    # Order the nodes so that each node comes after its first subtree and then its second subtree
+    #   (the reverse of a preorder that visits the second child first)
+    cdef vector[int] parent = vector[int](neighbors.size(), -1)
+    cdef vector[int] order
+    cdef vector[int] stack = [root]
+    cdef int node, child
+    while not stack.empty():
+        node = stack.back()
+        stack.pop_back()
+        order.push_back(node)
+        for child in neighbors[node]:
+            if child != parent[node]:
+                parent[child] = node
+                stack.push_back(child)
+
+    results = [None] * neighbors.size()
+    cdef vector[int] children
+    cdef size_t i, j
+    cdef int first_child, second_child
+    for i in range(order.size()):
+        node = order[order.size() - 1 - i]
+        children.clear()
+        for j in range(neighbors[node].size()):
+            if neighbors[node][j] != parent[node]:
+                children.push_back(neighbors[node][j])
+
+        if children.size() == 0:
+            results[node] = factor_leaf(node, tensor_network, context, node_to_edge)
+        elif children.size() == 1:
+            # If we are at a node with a single child, just propagate up the marked edges
+            first_child = children[0]
+            results[node] = results[first_child]
+        else:
+            first_child, second_child = children[0], children[1]
+            results[node] = factor_join(
+                results[first_child], results[second_child], tensor_network, context
+            )
+        for child in children:
+            results[child] = None
+    return results[root]
+
+
+cdef object extract_contraction_tree_from_tree(
+    TensorNetwork tensor_network, TreeDecomposition decomposition, int root_node
+):
     """
     Extract the contraction tree obtained from Factor+Tree using the provided tree decomposition.
 
     :param tensor_network: The tensor network to find a contraction tree for.
     :param decomposition: The tree decomposition of [tensor_network] to use.
+    :param root_node: The node of the decomposition to root the contraction tree at.
     :return:
     """
     # Construct a mapping from the leaves of the decomposition and the edges of the network
@@ -244,30 +341,33 @@ cdef object extract_contraction_tree_from_tree(TensorNetwork tensor_network, Tre
     # Ensure every node of the tree decomposition has degree 3 or fewer.
     decomposition.split_high_degree_nodes()
     # To avoid handling the root as a special case, make it a leaf
-    cdef int root = decomposition.extend_leaf(1)
+    cdef int root = decomposition.extend_leaf(root_node)
 
     # Run Factor+Tree on the tree decomposition
     context = ContractionTreeContext()
-    result = factor_tree(decomposition.neighbors, root, -1, tensor_network, context, node_to_edge)
+    result = factor_tree(decomposition.neighbors, root, tensor_network, context, node_to_edge)
     full_tree = context.include_rank_zero_tensors(tensor_network, result.contraction_tree)
     return context.get_tree(full_tree)
 
 
-cdef object extract_contraction_tree_from_branch(TensorNetwork tensor_network, BranchDecomposition decomposition):
+cdef object extract_contraction_tree_from_branch(
+    TensorNetwork tensor_network, BranchDecomposition decomposition, int root_node
+):
     """
     Extract the contraction tree obtained from Factor+Tree using the provided branch decomposition.
 
     :param tensor_network: The tensor network to find a contraction tree for.
     :param decomposition: The branch decomposition of [tensor_network] to use.
+    :param root_node: The node of the decomposition to root the contraction tree at.
     :return:
     """
     # To avoid handling the root as a special case, make it a leaf
-    cdef int root = decomposition.extend_leaf(1)
+    cdef int root = decomposition.extend_leaf(root_node)
 
     # Run Factor+Tree on the branch decomposition
     context = ContractionTreeContext()
     result = factor_tree(
-        decomposition.neighbors, root, -1, tensor_network, context, decomposition.node_to_edge
+        decomposition.neighbors, root, tensor_network, context, decomposition.node_to_edge
     )
     full_tree = context.include_rank_zero_tensors(tensor_network, result.contraction_tree)
     return context.get_tree(full_tree)
@@ -277,38 +377,69 @@ class FactorTree(ContractionMethod):
     def __init__(self, solver):
         self.__solver = solver
 
-    def generate_contraction_trees(self, tensor_network, timer, **solver_args):
+    def generate_contraction_trees(
+        self, tensor_network, timer, extraction_workers=0, extraction_samples=1, **solver_args
+    ):
         """
         Construct and yield contraction trees for the provided network.
 
         :param tensor_network: The tensor network to find contraction trees for.
         :param timer: A timer to check expiration of.
+        :param extraction_workers: Number of processes to extract contraction trees in (0 to use this process).
+        :param extraction_samples: Number of contraction trees to extract from each decomposition
+                                   (with different roots and edge placements), keeping the best.
         :param solver_args: Additional arguments for the contraction tree algorithm.
         :return: An iterator of contraction trees for the provided network.
         """
 
-        util.log("Starting solver at " + str(time.time()), util.Verbosity.solver_output)
-        best_width = None
-        for decomposition in self.__solver.generate_decompositions(
-            lambda file: tensor_network.save_structure(file, False),
-            {"print_tw_below": 100, **solver_args},
-            timer
-        ):
+        def extract_sample(decomposition, root):
+            network = tensor_network.copy()  # make a copy of the network to modify
+            if extraction_samples > 1:
+                decomposition = decomposition.copy()  # each sample extends the decomposition
+            if isinstance(decomposition, TreeDecomposition):
+                tree = extract_contraction_tree_from_tree(network, decomposition, root)
+            else:
+                tree = extract_contraction_tree_from_branch(network, decomposition, root)
+            return tree, network
+
+        def extract(decomposition):
             util.log("Parsed decomposition at " + str(time.time()), util.Verbosity.solver_output)
 
-            network = tensor_network.copy()  # make a copy of the network to modify
+            if not isinstance(decomposition, (TreeDecomposition, BranchDecomposition)):
+                raise RuntimeError("Unknown decomposition type " + str(decomposition))
+
+            # Samples differ by root, and by the (random) placement of network edges in tree decompositions
+            roots = sampling.candidate_roots(decomposition, extraction_samples)
+            tree, network = sampling.best_sample(
+                (extract_sample(decomposition, roots[i % len(roots)]) for i in range(extraction_samples)),
+                timer,
+            )
             if isinstance(decomposition, TreeDecomposition):
-                tree = extract_contraction_tree_from_tree(network, decomposition)
                 tree.tree_decomposition = decomposition
                 tree.treewidth = decomposition.width()
-            elif isinstance(decomposition, BranchDecomposition):
-                tree = extract_contraction_tree_from_branch(network, decomposition)
+            else:
                 tree.branch_decomposition = decomposition
                 tree.branchwidth = decomposition.width()
-            else:
-                raise RuntimeError("Unknown decomposition type " + str(decomposition))
             util.log("Built contraction tree " + str(time.time()), util.Verbosity.solver_output)
-            yield tree, network
+            return tree, network
+
+        util.log("Starting solver at " + str(time.time()), util.Verbosity.solver_output)
+        yield from pipeline.extract_pipelined(
+            lambda solver_timer: self.__solver.generate_decompositions(
+                lambda file, deduplicate: tensor_network.save_structure(file, False, deduplicate),
+                {"print_tw_below": 100, **solver_args},
+                solver_timer
+            ),
+            extract,
+            timer,
+            extraction_workers,
+        )
+
+    def warm_up(self, **solver_args):
+        self.__solver.warm_up({"print_tw_below": 100, **solver_args})
+
+    def decomposed_graph(self, tensor_network):
+        return len(tensor_network), tensor_network.structure_edges(True)
 
 
 SOLVERS = {
@@ -1,31 +1,49 @@
+import collections
 from typing import List
 
 from contraction_methods.contraction_method import ContractionMethod
 from contraction_methods.contraction_tree import ContractionTreeContext
+from contraction_methods import pipeline
+from contraction_methods import sampling
 import decompositions.decomposition_solver
 
 
 def extract_contraction_tree_line(tensor_network, tree_decomposition, root):
     context = ContractionTreeContext()
     trees = [context.leaf(tensor_network, i) for i in range(len(tensor_network))]
-    edges = [frozenset(context.get_tree(tree).free_edges) for tree in trees]
+
+    # Index the tensors incident to each edge, and track how many edges of each tensor are
+    # still missing from the current bag. A tensor is placed at the first bag (in postorder)
+    # that brings its count to zero. Rank-zero tensors are included separately afterwards.
+    incident_tensors = collections.defaultdict(list)
+    remaining = []
+    for tensor, tree in enumerate(trees):
+        free_edges = set(context.free_edges(tree))
+        remaining.append(len(free_edges))
+        for edge in free_edges:
+            incident_tensors[edge].append(tensor)
+    placed = [count == 0 for count in remaining]
 
     def combine_children_contraction_trees(node: int, children_trees: List[int]) -> int:
-        # Find all tensors whose clique is contained in the current bag
-        bag = set(tree_decomposition.bags[node])
-        matches = {
-            (tree, free_edges)
-            for tree, free_edges in zip(trees, edges)
-            if bag.issuperset(free_edges)
-        }
-        for tree, free_edges in matches:
-            trees.remove(tree)
-            edges.remove(free_edges)
+        # Find all unplaced tensors whose clique is contained in the current bag
+        matches = []
+        touched = []
+        for edge in set(tree_decomposition.bags[node]):
+            for tensor in incident_tensors.get(edge, ()):
+                if placed[tensor]:
+                    continue
+                remaining[tensor] -= 1
+                touched.append(tensor)
+                if remaining[tensor] == 0:
+                    placed[tensor] = True
+                    matches.append(trees[tensor])
+        for tensor in touched:
+            remaining[tensor] += 1
 
         complete_tree = context.empty()
         for tree in children_trees:
             complete_tree = context.join(complete_tree, tree)
-        for tree, _ in matches:
+        for tree in matches:
             complete_tree = context.join(complete_tree, tree)
         return complete_tree
 
@@ -39,26 +57,59 @@ class LineGraph(ContractionMethod):
     def __init__(self, solver):
         self.__solver = solver
 
-    def generate_contraction_trees(self, tensor_network, timer, **solver_args):
+    def generate_contraction_trees(
+        self,
+        tensor_network,
+        timer,
+        extraction_workers=0,
+        extraction_samples=1,
+        **solver_args
+    ):
         """
         Construct and yield contraction trees for the provided network.
 
         :param tensor_network: The tensor network to find contraction trees for.
         :param timer: A timer to check expiration of.
+        :param extraction_workers: Number of processes to extract contraction trees in (0 to use this process).
+        :param extraction_samples: Number of contraction trees to extract from each decomposition
+                                   (with different roots), keeping the best.
         :param solver_args: Additional arguments for the contraction tree algorithm.
         :return: An iterator of contraction trees for the provided network.
         """
 
-        for tree_decomposition in self.__solver.generate_decompositions(
-            lambda file: tensor_network.save_line_structure(file),
-            {"print_tw_below": 100, **solver_args},
-            timer,
-        ):
-            tree = extract_contraction_tree_line(tensor_network, tree_decomposition, 1)
+        def extract(tree_decomposition):
+            roots = sampling.candidate_roots(tree_decomposition, extraction_samples)
+            (tree,) = sampling.best_sample(
+                (
+                    (extract_contraction_tree_line(tensor_network, tree_decomposition, root),)
+                    for root in roots
+                ),
+                timer,
+            )
             tree.tree_decomposition = tree_decomposition
             tree.treewidth = tree_decomposition.width()
+            return tree
+
+        for tree in pipeline.extract_pipelined(
+            lambda solver_timer: self.__solver.generate_decompositions(
+                lambda file, deduplicate: tensor_network.save_line_structure(
+                    file, deduplicate
+                ),
+                {"print_tw_below": 100, **solver_args},
+                solver_timer,
+            ),
+            extract,
+            timer,
+            extraction_workers,
+        ):
             yield tree, tensor_network
 
+    def warm_up(self, **solver_args):
+        self.__solver.warm_up({"print_tw_below": 100, **solver_args})
+
+    def decomposed_graph(self, tensor_network):
+        return tensor_network.num_edges(), tensor_network.line_structure_edges(True)
+
 
 SOLVERS = {
     "line-Tamaki": LineGraph(
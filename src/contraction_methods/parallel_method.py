@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import queue
+import random
+
+from contraction_methods.contraction_method import ContractionMethod
+import util
+
+
+def split_affinity(affinity, num_workers):
+    """
+    Divide a CPU affinity among several workers.
+
+    :param affinity: A CPU list in the format of taskset (e.g. "0-3,8"), or None for all available CPUs
+    :param num_workers: Number of workers to divide the CPUs among
+    :return: A list of [num_workers] CPU lists, in the format of taskset
+    """
+    if affinity is None:
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = util.parse_cpu_list(affinity)
+
+    if len(cpus) < num_workers:
+        # Workers must share CPUs
+        return [str(cpus[i % len(cpus)]) for i in range(num_workers)]
+    per_worker = len(cpus) // num_workers
+    return [
+        ",".join(map(str, cpus[i * per_worker : (i + 1) * per_worker]))
+        for i in range(num_workers)
+    ]
+
+
+def run_worker(method, tensor_network, results, seed, affinity, solver_args):
+    """
+    Run a single planner pipeline, sending each contraction tree found to [results].
+
+    :param method: The ContractionMethod to run
+    :param tensor_network: The tensor network to find contraction trees for
+    :param results: A multiprocessing queue to send (tree, network) pairs to; (None, None) is sent when finished
+    :param seed: A random seed for this worker
+    :param affinity: CPU affinity for this worker
+    :param solver_args: Other arguments for the contraction tree algorithm
+    :return: None
+    """
+    random.seed(seed)  # Each worker must place edges differently
+    try:
+        with util.TimeoutTimer(0) as timer:  # The main process stops the workers
+            for tree, network in method.generate_contraction_trees(
+                tensor_network, timer, seed=seed, affinity=affinity, **solver_args
+            ):
+                results.put((tree, network))
+    finally:
+        results.put((None, None))
+
+
+class BackgroundPlanner:
+    """
+    Run several independently seeded copies of a planner in background processes, each on its own CPUs,
+    so that the caller can use each contraction tree as soon as it is found.
+    """
+
+    def __init__(
+        self, method, num_workers, tensor_network, seed=0, affinity=None, **solver_args
+    ):
+        """
+        :param method: The ContractionMethod to run
+        :param num_workers: Number of workers to run
+        :param tensor_network: The tensor network to find contraction trees for
+        :param seed: A random seed; each worker uses a different seed derived from it
+        :param affinity: CPU affinity to divide among the workers
+        :param solver_args: Additional arguments for the contraction tree algorithm
+        """
+        # Fork so that the workers do not need to pickle the network
+        context = multiprocessing.get_context("fork")
+        self.__results = context.Queue()
+        self.__workers = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    method,
+                    tensor_network,
+                    self.__results,
+                    seed + i,
+                    worker_affinity,
+                    solver_args,
+                ),
+                daemon=True,
+            )
+            for i, worker_affinity in enumerate(split_affinity(affinity, num_workers))
+        ]
+        self.__running = 0
+
+    def __enter__(self):
+        """
+        Start the workers.
+        :return: This planner
+        """
+        for worker in self.__workers:
+            worker.start()
+        self.__running = len(self.__workers)
+        util.log(
+            "Started " + str(len(self.__workers)) + " planner workers",
+            util.Verbosity.progress,
+        )
+        return self
+
+    def __exit__(self, exit_type, value, traceback):
+        """
+        Stop the workers. Solvers started by the workers are killed along with them (see util.kill_on_crash)
+        :return: None
+        """
+        for worker in self.__workers:
+            worker.terminate()
+        self.__running = 0
+
+    @property
+    def finished(self):
+        return self.__running == 0
+
+    def poll(self, timeout=0):
+        """
+        Get the next contraction tree found by any worker.
+
+        :param timeout: Time (s) to wait for a tree (None to wait until one is found or all workers finish)
+        :return: The next (tree, network) pair, or None if no tree was found in time
+        """
+        while self.__running > 0:
+            try:
+                tree, network = self.__results.get(
+                    block=timeout != 0, timeout=timeout
+                )
+            except queue.Empty:
+                return None
+            if tree is None:
+                self.__running -= 1
+            else:
+                return tree, network
+        return None
+
+
+class ParallelMethod(ContractionMethod):
+    """
+    Run several independently seeded copies of a planner in parallel, each on its own CPUs.
+    """
+
+    def __init__(self, method, num_workers):
+        self.__method = method
+        self.__num_workers = num_workers
+
+    def generate_contraction_trees(
+        self, tensor_network, timer, seed=0, affinity=None, **solver_args
+    ):
+        """
+        Construct and yield contraction trees for the provided network, from all workers.
+
+        :param tensor_network: The tensor network to find contraction trees for.
+        :param timer: A timer to check expiration of.
+        :param seed: A random seed; each worker uses a different seed derived from it.
+        :param affinity: CPU affinity to divide among the workers.
+        :param solver_args: Additional arguments for the contraction tree algorithm.
+        :return: An iterator of contraction trees for the provided network.
+        """
+        # Note the workers are stopped on a GeneratorExit (i.e. when this generator is garbage collected)
+        with BackgroundPlanner(
+            self.__method,
+            self.__num_workers,
+            tensor_network,
+            seed=seed,
+            affinity=affinity,
+            **solver_args
+        ) as background:
+            while not background.finished:
+                if timer.expired():
+                    # If the timer does not successfully go off (i.e., Windows), trigger it here
+                    raise TimeoutError()
+                found = background.poll(timeout=1)
+                if found is not None:
+                    yield found
+
+    def decomposed_graph(self, tensor_network):
+        return self.__method.decomposed_graph(tensor_network)
@@ -0,0 +1,126 @@
+import multiprocessing
+import queue
+import threading
+
+extractor = None  # The extraction function of the current pool of worker processes
+
+
+def set_extractor(extract):
+    global extractor
+    extractor = extract
+
+
+def run_extractor(decomposition):
+    return extractor(decomposition)
+
+
+class ReaderTimer:
+    """
+    The timer used by a solver running in a background thread. It also expires once the reader is stopped,
+    and wakes the reader up regularly to check.
+    """
+
+    def __init__(self, timer, stopped, interval=0.1):
+        """
+        :param timer: The timer of the planner
+        :param stopped: A threading.Event that is set when the reader should stop
+        :param interval: The longest time (s) between checks
+        """
+        self.__timer = timer
+        self.__stopped = stopped
+        self.__interval = interval
+
+    def expired(self):
+        return self.__stopped.is_set() or self.__timer.expired()
+
+    def remaining(self):
+        remaining = self.__timer.remaining()
+        if remaining is None:
+            return self.__interval
+        return min(remaining, self.__interval)
+
+
+def extract_pipelined(generate_decompositions, extract, timer, num_workers=0):
+    """
+    Extract contraction trees from the decompositions found by a solver, skipping decompositions that are wider
+    than the best one so far.
+
+    Decompositions are read (and parsed) in a background thread, so the solver never waits on a full pipe while
+    trees are extracted. If several decompositions arrive during an extraction, only the narrowest is extracted.
+
+    :param generate_decompositions: A function from a timer to an iterator of decompositions
+    :param extract: A function to extract the result (e.g. a contraction tree) from a decomposition
+    :param timer: A timer to check expiration of
+    :param num_workers: Number of forked processes to extract in (0 to extract in this process)
+    :return: An iterator of the extracted results
+    """
+    events = queue.Queue()  # (kind, item) for each decomposition, extracted result, and the end of the solver
+    stopped = threading.Event()
+
+    def read():
+        try:
+            for decomposition in generate_decompositions(ReaderTimer(timer, stopped)):
+                events.put(("decomposition", decomposition))
+            events.put(("finished", None))
+        except BaseException as e:
+            events.put(("finished", e))
+
+    # Fork the workers before starting any threads
+    pool = None
+    if num_workers > 0:
+        # The extraction function is inherited by the forked workers, since closures cannot be pickled
+        pool = multiprocessing.get_context("fork").Pool(
+            num_workers, initializer=set_extractor, initargs=(extract,)
+        )
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    best_width = {}  # By the type of decomposition, since tree and branch decompositions are not comparable
+    waiting = []
+    running = 0
+    reading = True
+    try:
+        while reading or len(waiting) > 0 or running > 0:
+            # Collect all available events before extracting, so that only the narrowest decomposition is extracted
+            ready = len(waiting) > 0 and running < max(num_workers, 1)
+            try:
+                kind, item = events.get(block=not ready)
+            except queue.Empty:
+                kind, item = None, None
+
+            if kind == "decomposition":
+                waiting.append(item)
+            elif kind == "finished":
+                reading = False
+                if item is not None:
+                    raise item
+            elif kind == "extracted":
+                running -= 1
+                yield item
+            elif kind == "failed":
+                raise item
+            else:
+                decomposition = min(waiting, key=lambda d: d.width())
+                waiting = []
+
+                width = decomposition.width()
+                width_type = type(decomposition)
+                if width_type in best_width and width > best_width[width_type]:
+                    continue
+                best_width[width_type] = width
+
+                if pool is None:
+                    yield extract(decomposition)
+                else:
+                    running += 1
+                    pool.apply_async(
+                        run_extractor,
+                        (decomposition,),
+                        callback=lambda result: events.put(("extracted", result)),
+                        error_callback=lambda e: events.put(("failed", e)),
+                    )
+    finally:  # Note this triggers on a GeneratorExit (i.e. when this generator is garbage collected)
+        stopped.set()
+        reader.join()
+        if pool is not None:
+            pool.terminate()
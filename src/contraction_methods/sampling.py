@@ -0,0 +1,95 @@
+import collections
+
+
+def distances(neighbors, source):
+    """
+    Compute the distance from [source] to every node reachable from it.
+
+    :param neighbors: The neighbors of each node of a tree
+    :param source: The node to start from
+    :return: A dictionary from each reachable node to its distance from [source]
+    """
+    result = {source: 0}
+    frontier = collections.deque([source])
+    while len(frontier) > 0:
+        node = frontier.popleft()
+        for neighbor in neighbors[node]:
+            if neighbor not in result:
+                result[neighbor] = result[node] + 1
+                frontier.append(neighbor)
+    return result
+
+
+def candidate_roots(decomposition, count, default=1):
+    """
+    Choose nodes of a decomposition to root the extraction of contraction trees at.
+
+    The default root comes first, then the center of the tree (the middle of a longest path), then the other
+    nodes by decreasing bag size (for tree decompositions) and increasing distance from the center.
+
+    :param decomposition: A tree or branch decomposition
+    :param count: The number of roots to choose
+    :param default: The root used when only a single root is chosen
+    :return: A list of at most [count] distinct nodes
+    """
+    roots = [default]
+    if count <= 1:
+        return roots
+    neighbors = decomposition.neighbors
+    if default >= len(neighbors):
+        return roots
+
+    # The middle of a longest path minimizes the height of the tree
+    from_default = distances(neighbors, default)
+    end = max(from_default, key=from_default.get)
+    from_end = distances(neighbors, end)
+    other_end = max(from_end, key=from_end.get)
+    from_other_end = distances(neighbors, other_end)
+    center = min(
+        from_end, key=lambda node: max(from_end[node], from_other_end[node])
+    )
+
+    from_center = distances(neighbors, center)
+    bags = getattr(decomposition, "bags", None)
+    if bags is None:
+        order = sorted(from_center, key=lambda node: from_center[node])
+    else:
+        order = sorted(
+            from_center, key=lambda node: (-len(bags[node]), from_center[node])
+        )
+    for node in [center] + order:
+        if len(roots) >= count:
+            break
+        if node not in roots:
+            roots.append(node)
+    return roots
+
+
+def score(tree):
+    """
+    Score a contraction tree by the cost model used for planning: the max-rank first, then the FLOPs,
+    then the memory.
+
+    :param tree: The contraction tree to score
+    :return: A tuple, where lower is better
+    """
+    FLOPs, memory, _, maxrank = tree.estimate_cost()
+    return maxrank, FLOPs, memory
+
+
+def best_sample(samples, timer=None):
+    """
+    Choose the best of several extractions from the same decomposition.
+
+    :param samples: An iterator of (contraction tree, ...) tuples; the first is always used
+    :param timer: A timer to check expiration of; once expired, no more samples are extracted
+    :return: The tuple with the lowest score
+    """
+    best, best_score = None, None
+    for sample in samples:
+        sample_score = score(sample[0])
+        if best is None or sample_score < best_score:
+            best, best_score = sample, sample_score
+        if timer is not None and timer.expired():
+            break
+    return best
@@ -1,9 +1,12 @@
 # distutils: language=c++
 # distutils: extra_compile_args=-O3
 
-import util
+import numpy
 import time
 
+import util
+from decompositions import decomposition_parser
+
 from libcpp.vector cimport vector
 
 cdef class BranchDecomposition:
@@ -25,6 +28,20 @@ cdef class BranchDecomposition:
         """
         return self.__width
 
+    @property
+    def neighbors(self):
+        return self.neighbors
+
+    def copy(self):
+        """
+        :return: A copy of this branch decomposition, which can be modified independently
+        """
+        cdef BranchDecomposition result = BranchDecomposition()
+        result.neighbors = self.neighbors
+        result.node_to_edge = self.node_to_edge
+        result.__width = self.__width
+        return result
+
     cdef int add_node(self):
         self.neighbors.push_back(vector[int]())
         return self.neighbors.size() - 1
@@ -73,38 +90,62 @@ cdef class BranchDecomposition:
         def record(comment):
             util.log(comment.rstrip(), util.Verbosity.solver_output)
 
-        dimacs = util.DimacsStream(stream, process_comment=record)
-
         if header is None:
-            header = dimacs.parse_line("s")
+            header = util.DimacsStream(stream, process_comment=record).parse_line("s")
             if header is None:
                 return None
-        num_bags, num_nodes, branch_width, _ = int(header[2]), int(header[3]), int(header[4]), int(header[5])
         util.log("Read header at " + str(time.time()), util.Verbosity.solver_output)
 
+        return BranchDecomposition.from_text(header, decomposition_parser.read_block(stream, separator))
+
+    @staticmethod
+    def from_text(header, text):
+        """
+        Construct a BranchDecomposition from the body of a .bd file, which is tokenized in bulk.
+
+        :param header: The parsed header of the branch decomposition
+        :param text: The bag and edge lines of the branch decomposition, without comments
+        :return: The parsed BranchDecomposition
+        """
+        num_bags, num_nodes, branch_width = int(header[2]), int(header[3]), int(header[4])
+        bag_text, edge_text = decomposition_parser.split_block(text)
+        nodes, offsets, items = decomposition_parser.parse_bags(bag_text)
+        if len(nodes) < num_bags:
+            raise RuntimeError("EOF reached while reading bags")
+        if len(nodes) > num_bags:
+            raise RuntimeError("More bags than identified in header")
+
+        if numpy.any(numpy.diff(offsets) != 1):
+            raise RuntimeError("Unable to determine edge on node")
+
+        edges = decomposition_parser.parse_edges(edge_text, num_nodes)
+        return BranchDecomposition.from_arrays(
+            num_nodes, branch_width, nodes.astype(numpy.intc), items.astype(numpy.intc), edges
+        )
+
+    @staticmethod
+    def from_arrays(size_t num_nodes, size_t branch_width, leaf_nodes, leaf_edges, edges):
+        """
+        Construct a BranchDecomposition from arrays.
+
+        :param num_nodes: The number of nodes in the decomposition
+        :param branch_width: The width of the decomposition
+        :param leaf_nodes: The nodes that are labeled by an edge of the graph
+        :param leaf_edges: The edge of the graph labeling each of [leaf_nodes]
+        :param edges: A (number of edges) x 2 array of the endpoints of each edge
+        :return: The BranchDecomposition
+        """
+        cdef int[:] nodes = leaf_nodes
+        cdef int[:] labels = leaf_edges
+        cdef int[:, :] endpoints = edges
         cdef size_t i
-        result = BranchDecomposition()
-        result.neighbors.reserve(num_nodes)
-        result.node_to_edge.reserve(num_bags)
-        result.__width = branch_width
-        for i in range(<size_t>num_nodes):
-            result.neighbors.push_back(vector[int]())
-
-        bags = []
-        for _ in range(num_bags):
-            bag = dimacs.parse_line("b")
-            if bag is None:
-                raise RuntimeError("EOF reached while reading bags")
-            if len(bag) != 3:
-                raise RuntimeError("Unable to determine edge on node")
-            result.node_to_edge[int(bag[1])-1] = int(bag[2]) - 1
-
-        numbers = frozenset("0123456789" + separator)
-        while True:
-            edge = dimacs.parse_line(numbers)
-            # Allow EOF or '=' to end the tree-decomposition
-            if edge is None or edge[0] == separator:
-                break
-            result.add_edge(int(edge[0]) - 1, int(edge[1]) - 1)
+        cdef BranchDecomposition result = BranchDecomposition()
 
+        result.neighbors.resize(num_nodes)
+        result.node_to_edge.reserve(nodes.shape[0])
+        result.__width = branch_width
+        for i in range(<size_t>nodes.shape[0]):
+            result.node_to_edge[nodes[i]] = labels[i]
+        for i in range(<size_t>endpoints.shape[0]):
+            result.add_edge(endpoints[i, 0], endpoints[i, 1])
         return result
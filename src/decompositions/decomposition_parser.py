@@ -0,0 +1,129 @@
+import numpy
+
+import util
+
+
+def read_block(stream, separator="="):
+    """
+    Read the body of a single decomposition (i.e., everything after its header) from a .td/.bd
+    stream, up to the separator or EOF. Comments are logged.
+
+    :param stream: Stream to read lines from
+    :param separator: Character separator to indicate the end of a decomposition
+    :return: The text of the body, without comments
+    """
+    lines = []
+    for line in stream:
+        prefix = line[:1]
+        if prefix == "c" or prefix == "O":
+            util.log(line.rstrip(), util.Verbosity.solver_output)
+        elif prefix == separator:
+            break
+        else:
+            lines.append(line)
+    return "".join(lines)
+
+
+def strip_comments(text):
+    """
+    Remove all comment lines from the provided text. Comments are logged.
+
+    :param text: Text of a .td/.bd stream
+    :return: The text without comment lines
+    """
+    kept = []
+    start = 0  # The start of the current line
+    next_comment = {prefix: text.find("\n" + prefix) for prefix in "cO"}
+    while start < len(text):
+        if text.startswith(("c", "O"), start):
+            end = text.find("\n", start) + 1 or len(text)
+            util.log(text[start:end].rstrip(), util.Verbosity.solver_output)
+            start = end
+            continue
+
+        # Keep everything until the next comment line
+        for prefix, position in next_comment.items():
+            if 0 <= position < start:
+                next_comment[prefix] = text.find("\n" + prefix, start)
+        upcoming = [position + 1 for position in next_comment.values() if position >= 0]
+        if len(upcoming) == 0:
+            kept.append(text[start:])
+            break
+        kept.append(text[start : min(upcoming)])
+        start = min(upcoming)
+    return "".join(kept)
+
+
+def split_block(text):
+    """
+    Split the body of a decomposition into its bag lines (which come first) and its edge lines.
+
+    :param text: The text of the body, without comments
+    :return: The text of all bag lines, and the text of all edge lines
+    """
+    last_bag = text.rfind("\nb") + 1
+    if last_bag == 0 and not text.startswith("b"):
+        return "", text
+    end_of_bags = text.find("\n", last_bag) + 1
+    if end_of_bags == 0:
+        end_of_bags = len(text)
+
+    # Every line up to the last bag must be a bag line (other unexpected lines fail to tokenize)
+    bag_text = text[:end_of_bags]
+    num_lines = bag_text.count("\n") + (not bag_text.endswith("\n"))
+    if bag_text.count("\nb") + bag_text.startswith("b") != num_lines:
+        raise RuntimeError("Unexpected line among bags")
+    return bag_text, text[end_of_bags:]
+
+
+def tokenize(text):
+    """
+    Parse all integers in the provided text at once.
+
+    :param text: A string of whitespace-separated integers
+    :return: A numpy array of all integers, in order
+    """
+    try:
+        return numpy.array(text.split(), dtype=numpy.int64)
+    except (ValueError, OverflowError):
+        raise RuntimeError("Unable to parse decomposition")
+
+
+def parse_bags(bag_text):
+    """
+    Parse bag lines of the form "b <node> <item> <item> ...".
+
+    :param bag_text: The text of all bag lines
+    :return: The node of each bag, the offsets of the items of each bag, and all items (all 0-indexed)
+    """
+    # Each "b" becomes -1, marking the start of a bag (since nodes and items are positive)
+    tokens = tokenize(bag_text.replace("b", "-1"))
+    starts = numpy.flatnonzero(tokens == -1)
+    lengths = numpy.diff(starts, append=len(tokens)) - 2
+    if numpy.any(lengths < 0):
+        raise RuntimeError("Unable to determine node of bag")
+
+    is_item = numpy.ones(len(tokens), dtype=bool)
+    is_item[starts] = False
+    is_item[starts + 1] = False
+
+    offsets = numpy.zeros(len(starts) + 1, dtype=numpy.intp)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return tokens[starts + 1] - 1, offsets, tokens[is_item] - 1
+
+
+def parse_edges(edge_text, num_nodes):
+    """
+    Parse edge lines of the form "<node> <node>".
+
+    :param edge_text: The text of all edge lines
+    :param num_nodes: The number of nodes in the decomposition
+    :return: A (number of edges) x 2 numpy array of the endpoints of each edge (0-indexed)
+    """
+    tokens = tokenize(edge_text)
+    if len(tokens) % 2 != 0:
+        raise RuntimeError("Unable to determine endpoints of edge")
+    edges = tokens.reshape(-1, 2) - 1
+    if numpy.any(edges < 0) or numpy.any(edges >= num_nodes):
+        raise RuntimeError("Edge refers to an unknown node")
+    return edges.astype(numpy.intc)
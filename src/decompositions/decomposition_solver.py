@@ -1,65 +1,151 @@
-import subprocess
+import contextlib
+import os
 import tempfile
+import threading
+import time
 
-from decompositions import TreeDecomposition, BranchDecomposition
+from decompositions import TreeDecomposition, BranchDecomposition, decomposition_parser, solver_pool
 import util
 
 
-class DecompositionSolver:
-    def __init__(self, argument_map):
-        self.__argument_map = argument_map
+@contextlib.contextmanager
+def graph_file(write_graph, deduplicate):
+    """
+    Write a graph into an in-memory file (or a temporary file, where memfd_create is unavailable).
 
-    def generate_decompositions(self, write_graph, solver_parameters, timer):
+    :param write_graph: A function to write the graph into a file
+    :param deduplicate: Passed to [write_graph]; if True, repeated edges may be dropped
+    :return: A context manager giving the file, positioned at the start, and a path to reopen it by
+    """
+    if hasattr(os, "memfd_create"):
+        with open(os.memfd_create("graph"), "w+b") as input_file:
+            write_graph(input_file, deduplicate)
+            input_file.flush()
+            input_file.seek(0)
+            yield input_file, "/dev/fd/%d" % input_file.fileno()
+    else:
         with tempfile.NamedTemporaryFile() as input_file:
-            write_graph(input_file)
+            write_graph(input_file, deduplicate)
             input_file.flush()
             input_file.seek(0)
+            yield input_file, input_file.name
+
+
+def feed_graph(input_file, process):
+    """
+    Write a graph into the stdin of a (pooled) solver, then close it.
+
+    :param input_file: The file containing the graph, positioned at the start
+    :param process: The solver process
+    :return: None
+    """
+    try:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            view = memoryview(chunk)
+            while len(view) > 0:  # The pipe is unbuffered, so writes may be partial
+                view = view[process.stdin.write(view) :]
+    except (BrokenPipeError, ValueError):
+        pass  # The solver was stopped
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+class DecompositionSolver:
+    def __init__(self, argument_map, deduplicate=True):
+        """
+        :param argument_map: Command to run the solver, formatted with the solver parameters
+        :param deduplicate: If False, the solver is given repeated edges of the graph (which is
+                            needed when the output refers to edges by their position in the input)
+        """
+        self.__argument_map = argument_map
+        self.__deduplicate = deduplicate
+        self.__pool = solver_pool.SolverPool()
+
+    def __command(self, solver_parameters, graph_path=None):
+        parameters = {
+            "locate": util.FileLocator(),
+            "graph": graph_path,
+            **solver_parameters,
+        }
+        solve_cmd = [arg.format(**parameters) for arg in self.__argument_map]
+        if (
+            "affinity" in solver_parameters
+            and solver_parameters["affinity"] is not None
+        ):
+            solve_cmd = ["taskset", "-c", solver_parameters["affinity"]] + solve_cmd
+        return solve_cmd
+
+    @property
+    def reads_stdin(self):
+        """
+        :return: True if the solver only reads the graph from stdin (so it can be started before the graph is known)
+        """
+        return not any("{graph}" in arg for arg in self.__argument_map)
+
+    def warm_up(self, solver_parameters, count=1, replenish=False):
+        """
+        Start solvers ahead of time, to be used by later calls to generate_decompositions with the same parameters.
+
+        :param solver_parameters: Parameters of the solver
+        :param count: The number of solvers to have waiting
+        :param replenish: If True, start another solver whenever a waiting solver is used (e.g. for batches)
+        :return: None
+        """
+        if self.reads_stdin:
+            self.__pool.warm_up(self.__command(solver_parameters), count, replenish)
+
+    def generate_decompositions(self, write_graph, solver_parameters, timer):
+        with graph_file(write_graph, self.__deduplicate) as (input_file, graph_path):
+            feeder = None
+            process = None
+            if self.reads_stdin:
+                process = self.__pool.acquire(self.__command(solver_parameters))
+            if process is not None:
+                util.log("Using a solver started ahead of time", util.Verbosity.progress)
+                feeder = threading.Thread(target=feed_graph, args=(input_file, process))
+                feeder.start()
+            else:
+                process = solver_pool.start_solver(
+                    self.__command(solver_parameters, graph_path),
+                    input_file,
+                    pass_fds=(input_file.fileno(),),  # Allow the solver to reopen the graph by its path
+                )
 
-            parameters = {
-                "locate": util.FileLocator(),
-                "graph": input_file.name,
-                **solver_parameters,
-            }
-            solve_cmd = [arg.format(**parameters) for arg in self.__argument_map]
-            if (
-                "affinity" in solver_parameters
-                and solver_parameters["affinity"] is not None
-            ):
-                solve_cmd = ["taskset", "-c", solver_parameters["affinity"]] + solve_cmd
-            process = subprocess.Popen(
-                solve_cmd,
-                stdin=input_file,
-                bufsize=1,  # Line-buffered
-                universal_newlines=True,  # Required for line-buffered
-                stdout=subprocess.PIPE,
-                preexec_fn=util.kill_on_crash(),
-            )
-
-            buffered_stream = util.BufferedStream(process.stdout, timer)
             try:
-                while True:
-                    result = parse_decomposition(buffered_stream)
-                    if result is None:
-                        break
-                    yield result
+                for block in util.BlockStream(process.stdout, timer=timer):
+                    result = parse_decomposition(block)
+                    if result is not None:
+                        yield result
             finally:  # Note this triggers on a GeneratorExit (i.e. when this generator is garbage collected)
                 process.kill()
+                if feeder is not None:
+                    feeder.join()  # Before the graph file is closed
 
 
-def parse_decomposition(stream):
-    def record(comment):
-        util.log(comment.rstrip(), util.Verbosity.solver_output)
+def parse_decomposition(text):
+    """
+    Parse a single decomposition from the output of a solver.
 
-    dimacs = util.DimacsStream(
-        stream, process_comment=record, comment_prefixes=frozenset({"c", "O", "="})
-    )
-    header = dimacs.parse_line("s")
-    if header is None:
+    :param text: The output of the solver up to the separator line ending the decomposition
+    :return: The parsed TreeDecomposition or BranchDecomposition, or None if there is none
+    """
+    text = decomposition_parser.strip_comments(text).lstrip()
+    if len(text) == 0:
         return None
+
+    end_of_header = text.find("\n") + 1 or len(text)
+    header = text[:end_of_header].split()
+    if header[0] != "s":
+        raise RuntimeError("Unexpected line prefix in: {0}".format(text[:end_of_header]))
+    util.log("Read header at " + str(time.time()), util.Verbosity.solver_output)
+
     if header[1] == "td":
-        return TreeDecomposition.parse(stream, header=header)
+        return TreeDecomposition.from_text(header, text[end_of_header:])
     elif header[1] == "bd":
-        return BranchDecomposition.parse(stream, header=header)
+        return BranchDecomposition.from_text(header, text[end_of_header:])
     else:
         raise RuntimeError("Decomposition header unknown: " + str(header))
 
@@ -76,7 +162,8 @@ htd_online = DecompositionSolver(
     "{locate[solvers/htd-master/bin/htd_main]} -s {seed} --opt width --iterations 0 --strategy challenge --print-progress --preprocessing full".split()
 )
 
-hicks = DecompositionSolver("{locate[solvers/hicks/bw]}".split())
+# Hicks identifies the edges in its branch decompositions by their position in the input graph
+hicks = DecompositionSolver("{locate[solvers/hicks/bw]}".split(), deduplicate=False)
 
 portfolio1 = DecompositionSolver(
     [
@@ -115,5 +202,6 @@ portfolio4 = DecompositionSolver(
         "{locate[solvers/flow-cutter-pace17/flow_cutter_pace17]} -s {seed} -p {print_tw_below}",
         "{locate[solvers/htd-master/bin/htd_main]} -s {seed} --opt width --iterations 0 --strategy challenge --print-progress --preprocessing full",
         "{locate[solvers/hicks/bw]}",
-    ]
+    ],
+    deduplicate=False,
 )
@@ -0,0 +1,238 @@
+# distutils: language=c++
+# distutils: extra_compile_args=-O3
+
+import numpy
+import threading
+
+import util
+
+from libcpp.pair cimport pair
+from libcpp.queue cimport priority_queue
+from libcpp.unordered_set cimport unordered_set
+from libcpp.vector cimport vector
+
+ctypedef vector[unordered_set[int]] Adjacency
+
+
+cdef int degeneracy(Adjacency & adjacency, bint * cancelled) nogil:
+    """
+    Compute the degeneracy of a graph, i.e. the largest minimum degree seen while repeatedly
+    deleting a vertex of minimum degree. Every graph of treewidth k has a vertex of degree at most k,
+    and deleting vertices does not increase treewidth, so this is a lower bound on the treewidth.
+
+    :param adjacency: The neighbors of each vertex
+    :param cancelled: Stop early (returning -1) once this is set
+    :return: The degeneracy of the graph
+    """
+    cdef size_t num_vertices = adjacency.size()
+    cdef vector[int] degree
+    cdef vector[bint] removed = vector[bint](num_vertices, False)
+    cdef priority_queue[pair[int, int]] queue  # (-degree, vertex), with outdated entries skipped
+    cdef size_t v
+    for v in range(num_vertices):
+        degree.push_back(adjacency[v].size())
+        queue.push(pair[int, int](-degree[v], v))
+
+    cdef int result = 0, vertex, neighbor
+    cdef pair[int, int] top
+    while not queue.empty():
+        top = queue.top()
+        queue.pop()
+        vertex = top.second
+        if removed[vertex] or -top.first != degree[vertex]:
+            continue
+        if cancelled[0]:
+            return -1
+
+        result = max(result, degree[vertex])
+        removed[vertex] = True
+        for neighbor in adjacency[vertex]:
+            if not removed[neighbor]:
+                degree[neighbor] -= 1
+                queue.push(pair[int, int](-degree[neighbor], neighbor))
+    return result
+
+
+cdef int count_common_neighbors(Adjacency & adjacency, int a, int b) nogil:
+    if adjacency[a].size() > adjacency[b].size():
+        a, b = b, a
+    cdef int count = 0, neighbor
+    for neighbor in adjacency[a]:
+        if adjacency[b].count(neighbor) > 0:
+            count += 1
+    return count
+
+
+cdef int contraction_bound(Adjacency adjacency, bint least_common, bint * cancelled) nogil:
+    """
+    Compute a lower bound on the treewidth of a graph by repeatedly contracting a vertex of minimum degree
+    into one of its neighbors, and taking the largest minimum degree seen. Contracting edges does not increase
+    treewidth, so the minimum degree of every minor is a lower bound on the treewidth.
+
+    :param adjacency: The neighbors of each vertex (a copy, which is modified)
+    :param least_common: If True, contract into the neighbor with the fewest common neighbors
+                         (minor-min-width); otherwise contract into the neighbor of minimum degree
+                         (contraction degeneracy)
+    :param cancelled: Stop early (returning -1) once this is set
+    :return: The lower bound
+    """
+    cdef size_t num_vertices = adjacency.size()
+    cdef vector[bint] removed = vector[bint](num_vertices, False)
+    cdef priority_queue[pair[int, int]] queue  # (-degree, vertex), with outdated entries skipped
+    cdef size_t v
+    for v in range(num_vertices):
+        queue.push(pair[int, int](-<int>adjacency[v].size(), v))
+
+    cdef int result = 0, vertex, neighbor, target, score, best_score
+    cdef pair[int, int] top
+    while not queue.empty():
+        top = queue.top()
+        queue.pop()
+        vertex = top.second
+        if removed[vertex] or -top.first != <int>adjacency[vertex].size():
+            continue
+        if cancelled[0]:
+            return -1
+
+        removed[vertex] = True
+        if adjacency[vertex].empty():
+            continue
+        result = max(result, <int>adjacency[vertex].size())
+
+        # Choose the neighbor to contract the vertex into
+        target = -1
+        best_score = 0
+        for neighbor in adjacency[vertex]:
+            if least_common:
+                score = count_common_neighbors(adjacency, vertex, neighbor)
+            else:
+                score = adjacency[neighbor].size()
+            if target < 0 or score < best_score:
+                target, best_score = neighbor, score
+
+        # Move all edges of the vertex onto the target
+        for neighbor in adjacency[vertex]:
+            adjacency[neighbor].erase(vertex)
+            if neighbor != target:
+                adjacency[neighbor].insert(target)
+                adjacency[target].insert(neighbor)
+            queue.push(pair[int, int](-<int>adjacency[neighbor].size(), neighbor))
+        adjacency[vertex].clear()
+    return result
+
+
+cdef class TreewidthLowerBounds:
+    """
+    Cheap lower bounds on the treewidth of a graph, each of which can be cancelled from another thread.
+    """
+
+    cdef Adjacency adjacency
+    cdef bint cancelled
+
+    def __init__(self, num_vertices, edges):
+        """
+        :param num_vertices: The number of vertices of the graph
+        :param edges: An array of shape (# edges, 2) of vertex ids (numbered from 1)
+        """
+        self.adjacency.resize(num_vertices)
+        self.cancelled = False
+
+        cdef long long[:, :] edges_view = numpy.asarray(edges, dtype=numpy.int64).reshape(-1, 2)
+        cdef long long a, b, n = num_vertices
+        cdef Py_ssize_t i
+        for i in range(edges_view.shape[0]):
+            a, b = edges_view[i, 0], edges_view[i, 1]
+            if a != b and 1 <= a <= n and 1 <= b <= n:
+                self.adjacency[a - 1].insert(b - 1)
+                self.adjacency[b - 1].insert(a - 1)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def degeneracy(self):
+        """
+        :return: The degeneracy of the graph, or None if cancelled
+        """
+        cdef int result
+        with nogil:
+            result = degeneracy(self.adjacency, &self.cancelled)
+        return None if result < 0 else result
+
+    def contraction_degeneracy(self):
+        """
+        :return: The contraction degeneracy bound (contracting into min-degree neighbors), or None if cancelled
+        """
+        cdef int result
+        with nogil:
+            result = contraction_bound(self.adjacency, False, &self.cancelled)
+        return None if result < 0 else result
+
+    def minor_min_width(self):
+        """
+        :return: The minor-min-width bound (contracting into neighbors with fewest common neighbors),
+                 or None if cancelled
+        """
+        cdef int result
+        with nogil:
+            result = contraction_bound(self.adjacency, True, &self.cancelled)
+        return None if result < 0 else result
+
+
+class BackgroundLowerBound:
+    """
+    Compute the best of several lower bounds on the treewidth of a graph in a background thread.
+    """
+
+    def __init__(self, graph, on_finish=None):
+        """
+        :param graph: A function (called from the background thread) returning the graph as
+                      (# of vertices, an array of shape (# edges, 2) of vertex ids numbered from 1), or None
+        :param on_finish: A function to call (from the background thread) once the bound is known
+        """
+        self.value = None
+        self.__graph = graph
+        self.__bounds = None
+        self.__cancelled = False
+        self.__lock = threading.Lock()
+        self.__on_finish = on_finish
+        self.__thread = threading.Thread(target=self.__compute, daemon=True)
+        self.__thread.start()
+
+    def __compute(self):
+        graph = self.__graph()
+        if graph is None or self.__cancelled:
+            return
+        bounds = TreewidthLowerBounds(*graph)
+        with self.__lock:
+            if self.__cancelled:
+                return
+            self.__bounds = bounds
+
+        best = 0
+        for name, bound in [
+            ("degeneracy", bounds.degeneracy),
+            ("contraction degeneracy", bounds.contraction_degeneracy),
+            ("minor-min-width", bounds.minor_min_width),
+        ]:
+            value = bound()
+            if value is None:
+                return
+            util.log(
+                "Treewidth lower bound " + str(value) + " by " + name,
+                util.Verbosity.progress,
+            )
+            best = max(best, value)
+        self.value = best
+        if self.__on_finish is not None:
+            self.__on_finish()
+
+    def cancel(self):
+        """
+        Stop computing the bound, and wait for the background thread to stop.
+        :return: None
+        """
+        with self.__lock:
+            self.__cancelled = True
+            if self.__bounds is not None:
+                self.__bounds.cancel()
+        self.__thread.join()
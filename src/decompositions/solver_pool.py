@@ -0,0 +1,143 @@
+import atexit
+import concurrent.futures
+import os
+import subprocess
+import threading
+import time
+import weakref
+
+import util
+
+# Solvers that wait for their graph on a pipe. A forked child inherits the write end of each pipe, which would
+#   keep the solver from ever seeing the end of its graph, so the child closes them (see close_inherited_pipes)
+waiting_solvers = weakref.WeakSet()
+
+
+def close_inherited_pipes():
+    for process in list(waiting_solvers):
+        if process.stdin is not None and not process.stdin.closed:
+            process.stdin.close()
+    waiting_solvers.clear()
+
+
+os.register_at_fork(after_in_child=close_inherited_pipes)
+
+
+def start_solver(command, stdin, pass_fds=()):
+    """
+    Start a decomposition solver, with its output read in chunks as soon as it is available.
+
+    :param command: The command to run the solver
+    :param stdin: The input of the solver (a file, or subprocess.PIPE to give the graph later)
+    :param pass_fds: File descriptors to keep open in the solver
+    :return: The solver process
+    """
+    process = subprocess.Popen(
+        command,
+        stdin=stdin,
+        pass_fds=pass_fds,
+        bufsize=0,
+        stdout=subprocess.PIPE,
+        preexec_fn=util.kill_on_crash(),
+    )
+    if stdin == subprocess.PIPE:
+        waiting_solvers.add(process)
+    return process
+
+
+class SolverPool:
+    """
+    A pool of solver processes that are started before the graph is known, each waiting for a graph on stdin.
+
+    Starting a solver can take seconds (e.g. a JVM committing a large heap), so starting it ahead of time
+    (e.g. while the tensor network is constructed, or while the previous graph of a batch is solved) hides
+    that latency. Each process solves a single graph, since the solvers run until they are killed.
+    """
+
+    def __init__(self, max_age=600):
+        """
+        :param max_age: Restart idle processes that were started more than this long ago (s)
+        """
+        self.__max_age = max_age
+        self.__idle = {}  # command -> list of (start time, process)
+        self.__targets = {}  # command -> number of idle processes to keep
+        self.__owner = os.getpid()
+        self.__lock = threading.Lock()
+        self.__starter = None
+        atexit.register(self.close)
+
+    def warm_up(self, command, count=1, replenish=False):
+        """
+        Start idle processes for a command, if needed.
+
+        :param command: The command to run the solver
+        :param count: The number of idle processes to have
+        :param replenish: If True, start a new idle process whenever one is acquired
+        :return: None
+        """
+        command = tuple(command)
+        with self.__lock:
+            self.__check_owner()
+            if replenish:
+                self.__targets[command] = count
+            self.__fill(command, count)
+
+    def acquire(self, command):
+        """
+        Take a running idle process for a command. Processes that have exited are discarded,
+        and processes older than max_age are restarted.
+
+        :param command: The command to run the solver
+        :return: A process waiting for a graph on stdin, or None if there is none
+        """
+        command = tuple(command)
+        with self.__lock:
+            self.__check_owner()
+            idle = self.__idle.get(command, [])
+            result = None
+            while result is None and len(idle) > 0:
+                start_time, process = idle.pop(0)
+                if process.poll() is not None:
+                    util.log(
+                        "Discarding solver that exited with " + str(process.returncode),
+                        util.Verbosity.progress,
+                    )
+                elif time.time() - start_time > self.__max_age:
+                    process.kill()
+                    process.wait()
+                else:
+                    result = process
+            self.__fill(command, self.__targets.get(command, 0))
+            return result
+
+    def close(self):
+        """
+        Stop all idle processes.
+        :return: None
+        """
+        with self.__lock:
+            self.__check_owner()
+            for idle in self.__idle.values():
+                for _, process in idle:
+                    process.kill()
+                    process.wait()
+            self.__idle = {}
+            self.__targets = {}
+
+    def __fill(self, command, count):
+        idle = self.__idle.setdefault(command, [])
+        while len(idle) < count:
+            # Solvers are killed when the thread that started them exits (see util.kill_on_crash),
+            #   so start them from a thread that runs as long as this process
+            if self.__starter is None:
+                self.__starter = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            process = self.__starter.submit(start_solver, command, subprocess.PIPE)
+            idle.append((time.time(), process.result()))
+
+    def __check_owner(self):
+        # Processes started before a fork belong to the parent, so they cannot be used (or waited on) here
+        if os.getpid() != self.__owner:
+            self.__idle = {}
+            self.__targets = {}
+            self.__starter = None
+            self.__owner = os.getpid()
@@ -1,9 +1,12 @@
 # distutils: language=c++
 # distutils: extra_compile_args=-O3
 
-import util
+import numpy
 import time
 
+import util
+from decompositions import decomposition_parser
+
 from libcpp.vector cimport vector
 
 cdef class TreeDecomposition:
@@ -22,6 +25,19 @@ cdef class TreeDecomposition:
     def bags(self):
         return self.bags
 
+    @property
+    def neighbors(self):
+        return self.neighbors
+
+    def copy(self):
+        """
+        :return: A copy of this tree decomposition, which can be modified independently
+        """
+        cdef TreeDecomposition result = TreeDecomposition()
+        result.neighbors = self.neighbors
+        result.bags = self.bags
+        return result
+
     cdef int add_node(self, vector[int] bag):
         self.bags.push_back(bag)
         self.neighbors.push_back(vector[int]())
@@ -151,43 +167,84 @@ cdef class TreeDecomposition:
         def record(comment):
             util.log(comment.rstrip(), util.Verbosity.solver_output)
 
-        dimacs = util.DimacsStream(stream, process_comment=record)
-
         if header is None:
-            header = dimacs.parse_line("s")
+            header = util.DimacsStream(stream, process_comment=record).parse_line("s")
             if header is None:
                 return None
-        numbags, bag_size, _ = int(header[2]), int(header[3]), int(header[4])
         util.log("Read header at " + str(time.time()), util.Verbosity.solver_output)
 
-        cdef size_t num_nodes = numbags
+        return TreeDecomposition.from_text(header, decomposition_parser.read_block(stream, separator))
+
+    @staticmethod
+    def from_text(header, text):
+        """
+        Construct a TreeDecomposition from the body of a .td file, which is tokenized in bulk.
+
+        :param header: The parsed header of the tree decomposition
+        :param text: The bag and edge lines of the tree decomposition, without comments
+        :return: The parsed TreeDecomposition
+        """
+        numbags, bag_size = int(header[2]), int(header[3])
+        bag_text, edge_text = decomposition_parser.split_block(text)
+        nodes, offsets, items = decomposition_parser.parse_bags(bag_text)
+        if len(nodes) < numbags:
+            raise RuntimeError("EOF reached while reading bags")
+        if len(nodes) > numbags:
+            raise RuntimeError("More bags than identified in header")
+
+        lengths = numpy.diff(offsets)
+        if numpy.any(lengths > bag_size):
+            raise RuntimeError("Bag larger than identified width")
+
+        # Gather the items of each node contiguously, ignoring invalid node ids
+        item_nodes = numpy.repeat(nodes, lengths)
+        valid = (item_nodes >= 0) & (item_nodes < numbags)
+        item_nodes, items = item_nodes[valid], items[valid]
+        if numpy.any(item_nodes[1:] < item_nodes[:-1]):
+            order = numpy.argsort(item_nodes, kind="stable")
+            item_nodes, items = item_nodes[order], items[order]
+        bag_offsets = numpy.zeros(numbags + 1, dtype=numpy.intp)
+        numpy.cumsum(numpy.bincount(item_nodes, minlength=numbags), out=bag_offsets[1:])
+
+        edges = decomposition_parser.parse_edges(edge_text, numbags)
+        return TreeDecomposition.from_csr(bag_offsets, items.astype(numpy.intc), edges)
+
+    @staticmethod
+    def from_csr(bag_offsets, bag_items, edges):
+        """
+        Construct a TreeDecomposition from arrays.
+
+        :param bag_offsets: The bag of node i is bag_items[bag_offsets[i]:bag_offsets[i+1]]
+        :param bag_items: The items of all bags
+        :param edges: A (number of edges) x 2 array of the endpoints of each edge
+        :return: The TreeDecomposition
+        """
+        cdef Py_ssize_t[:] offsets = bag_offsets
+        cdef int[:] items = bag_items
+        cdef int[:, :] endpoints = edges
+        cdef size_t num_nodes = offsets.shape[0] - 1
         cdef size_t i
-        result = TreeDecomposition()
-        result.neighbors.reserve(num_nodes)
-        result.bags.reserve(num_nodes)
-        for i in range(num_nodes):
-            result.neighbors.push_back(vector[int]())
-            result.bags.push_back(vector[int]())
-
-        bags = []
-        for _ in range(numbags):
-            bag = dimacs.parse_line("b")
-            if bag is None:
-                raise RuntimeError("EOF reached while reading bags")
-            node = int(bag[1]) - 1
-            if len(bag) - 2 > bag_size:
-                raise RuntimeError("Bag larger than identified width")
-            if node < 0 or node >= num_nodes:
-                continue  # Invalid node id
-            for b in bag[2:]:
-                result.bags[node].push_back(int(b)-1)
-
-        numbers = frozenset("0123456789" + separator)
-        while True:
-            edge = dimacs.parse_line(numbers)
-            # Allow EOF or '=' to end the tree-decomposition
-            if edge is None or edge[0] == separator:
-                break
-            result.add_edge(int(edge[0]) - 1, int(edge[1]) - 1)
+        cdef TreeDecomposition result = TreeDecomposition()
 
+        result.neighbors.resize(num_nodes)
+        result.bags.resize(num_nodes)
+        for i in range(num_nodes):
+            if offsets[i + 1] > offsets[i]:
+                result.bags[i].assign(&items[offsets[i]], &items[offsets[i + 1] - 1] + 1)
+        reserve_neighbors(result.neighbors, endpoints)
+        for i in range(<size_t>endpoints.shape[0]):
+            result.add_edge(endpoints[i, 0], endpoints[i, 1])
         return result
+
+
+cdef void reserve_neighbors(vector[vector[int]] & neighbors, int[:, :] endpoints):
+    """
+    Reserve space in each adjacency list for the provided edges, so that each is allocated once.
+    """
+    cdef vector[size_t] degrees = vector[size_t](neighbors.size(), 0)
+    cdef size_t i
+    for i in range(<size_t>endpoints.shape[0]):
+        degrees[endpoints[i, 0]] += 1
+        degrees[endpoints[i, 1]] += 1
+    for i in range(neighbors.size()):
+        neighbors[i].reserve(neighbors[i].size() + degrees[i])
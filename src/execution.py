@@ -1,4 +1,5 @@
 import click
+import itertools
 import pickle
 import sys
 import traceback
@@ -152,5 +153,164 @@ def run(plan, tensor_library, slicer, slice_cutoff):
     return result
 
 
+def run_cube_and_conquer(formula, num_cube_variables, solve):
+    """
+    Count the models of a formula by cube and conquer: branch on the variables with the most impact,
+    simplify each conditioned formula by unit propagation, and contract each distinct simplified formula
+    with its own plan.
+
+    :param formula: The formula (a util.Formula) to count
+    :param num_cube_variables: Number of variables to branch on
+    :param solve: A function from a tensor network and its share of the remaining time (at least the inverse of the
+        number of subproblems left) to its contraction (or None on failure)
+    :return: The weighted model count of the formula, or None
+    """
+    cube_variables = formula.cube_variables(num_cube_variables)
+    counts = {}  # The count of each distinct simplified formula, by structure
+    result = 0
+    num_cubes, num_conflicts = 0, 0
+
+    # Search the cubes depth-first, so that a conflict prunes all cubes that extend it
+    stack = [[]]
+    while len(stack) > 0:
+        cube = stack.pop()
+        factor, simplified = formula.condition(cube)
+        if simplified is None:
+            num_conflicts += 1
+            continue
+        if len(cube) < len(cube_variables):
+            var = cube_variables[len(cube)]
+            stack.append(cube + [-var])
+            stack.append(cube + [var])
+            continue
+
+        num_cubes += 1
+        key = simplified.structure_key()
+        if key not in counts:
+            if len(simplified.clauses) == 0:
+                counts[key] = 1
+            else:
+                # This cube and every cube that extends one on the stack might still need to be solved
+                num_left = 1 + sum(
+                    2 ** (len(cube_variables) - len(pending)) for pending in stack
+                )
+                counts[key] = solve(
+                    tensor_network.tensor_network_constructions.cnf_count(simplified),
+                    1 / num_left,
+                )
+            if counts[key] is None:
+                return None
+        result += factor * counts[key]
+
+    util.log(
+        "Counted "
+        + str(num_cubes)
+        + " cubes ("
+        + str(num_conflicts)
+        + " conflicts pruned) with "
+        + str(len(counts))
+        + " distinct subproblems",
+        util.Verbosity.progress,
+    )
+    util.output_pair("# Cubes", num_cubes, util.Verbosity.plan_info)
+    util.output_pair("# Distinct Subproblems", len(counts), util.Verbosity.plan_info)
+    return result
+
+
+def run_concurrent(
+    background, tensor_library, slicer, prepare_plan, switch_ratio, slice_cutoff=None
+):
+    """
+    Contract the given tensor network with the best plan found so far, while planning continues in the background.
+
+    Slices are contracted one at a time. Between slices, each improved tree from the planner is prepared as a new
+    plan. Contraction restarts with the new plan if its predicted FLOPs are lower (by a factor of [switch_ratio])
+    than the predicted FLOPs remaining for the current plan; the slices already contracted are abandoned, so only
+    the slices that remain are weighed against the whole new plan. Both only count the slices that are contracted,
+    i.e. the first [slice_cutoff] slices that are not skipped as zero.
+
+    :param background: A started contraction_methods.BackgroundPlanner
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :param slicer: Slicer to use (from tensor_network.ALL_SLICERS) if MEMOUT
+    :param prepare_plan: A function to construct a SlicedExecutionPlan from a (tree, network) pair
+    :param switch_ratio: How much cheaper a new plan must be to switch to it
+    :param slice_cutoff: Limit the number of slices
+    :return: (The contraction of the tensor network or None, the last plan used or None)
+    """
+    plan = None
+    num_slices = None  # The number of slices to contract with the current plan
+    best_rank = None
+
+    def improved_plan(completed):
+        """
+        Find a plan worth switching to, given that [completed] slices of the current plan are done.
+        :return: The new plan, or None
+        """
+        nonlocal best_rank
+        while True:
+            found = background.poll(timeout=None if plan is None else 0)
+            if found is None:
+                return None
+            tree, factored_network = found
+            util.log("Found tree of max-rank " + str(tree.maxrank), util.Verbosity.progress)
+            if best_rank is not None and tree.maxrank >= best_rank:
+                continue
+            best_rank = tree.maxrank
+
+            candidate = prepare_plan(tree, factored_network)
+            if plan is None:
+                return candidate
+            remaining_FLOPs = plan.FLOPs * (num_slices - completed)
+            candidate_FLOPs = candidate.FLOPs * candidate.count_contracted_slices(
+                slice_cutoff
+            )
+            if candidate_FLOPs * switch_ratio < remaining_FLOPs:
+                util.log(
+                    "Switching to plan of "
+                    + str(candidate_FLOPs)
+                    + " FLOPs from plan with "
+                    + str(remaining_FLOPs)
+                    + " FLOPs remaining (abandoning "
+                    + str(completed)
+                    + " contracted slices)",
+                    util.Verbosity.progress,
+                )
+                return candidate
+
+    try:
+        plan = improved_plan(0)
+        while plan is not None:
+            try:
+                result = 0
+                completed = 0
+                num_slices = plan.count_contracted_slices(slice_cutoff)
+                for slice_network in itertools.islice(
+                    plan.network.slice_groups(plan.groups_to_slice, skip_zero=True),
+                    slice_cutoff,
+                ):
+                    replacement = improved_plan(completed)
+                    if replacement is not None:
+                        plan = replacement
+                        break
+                    result += tensor_library.contract(slice_network, plan.tree)[tuple()]
+                    completed += 1
+                else:
+                    return result, plan
+            except tensor_network.OutOfMemoryError:
+                # Slice the network and start again
+                slicer.slice_once(plan)
+        util.output_pair("Error", "No plan found", util.Verbosity.always)
+    except TimeoutError:
+        util.output_pair("Error", "Timeout during execution", util.Verbosity.always)
+    except MemoryError:
+        util.output_pair(
+            "Error", "Out of Memory during execution", util.Verbosity.always
+        )
+    except:
+        util.log(traceback.format_exc(), util.Verbosity.always)
+        util.output_pair("Error", "Exception during execution", util.Verbosity.always)
+    return None, plan
+
+
 if __name__ == "__main__":
     measure()
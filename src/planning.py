@@ -3,10 +3,12 @@ import os
 import pickle
 import random
 import sys
+import threading
 import time
 import traceback
 
 import contraction_methods
+from decompositions import lower_bounds
 import tensor_network
 import util
 from tensor_network import sliced_execution_plan
@@ -62,8 +64,23 @@ Entry point for just the planning phase
     default=None,
     help="CPU affinity for finding decomposition",
 )
+@click.option(
+    "--planner_workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of independently seeded planners to run in parallel",
+)
 def measure(
-    benchmark, weights, timeout, seed, reduction, planner, store, planner_affinity,
+    benchmark,
+    weights,
+    timeout,
+    seed,
+    reduction,
+    planner,
+    store,
+    planner_affinity,
+    planner_workers,
 ):
     sys.setrecursionlimit(100000)
     stopwatch = util.Stopwatch()
@@ -95,6 +112,7 @@ def measure(
             mem_limit=None,
             slicer=None,
             stopwatch=stopwatch,
+            planner_workers=planner_workers,
         )
 
     # Record information on all observed plans
@@ -127,6 +145,10 @@ def run(
     mem_limit,
     slicer,
     stopwatch=None,
+    planner_workers=1,
+    profile=None,
+    extraction_workers=0,
+    extraction_samples=1,
 ):
     """
     Find a contraction tree for the given tensor network
@@ -141,16 +163,57 @@ def run(
     :param mem_limit: Limit memory usage of plan (with slicing)
     :param slicer: Slicer to use (from tensor_network.ALL_SLICERS)
     :param stopwatch: The current Stopwatch
+    :param planner_workers: Number of independently seeded planners to run in parallel
+    :param profile: A calibration.PerformanceProfile to predict the contraction time (instead of performance_factor)
+    :param extraction_workers: Number of processes to extract contraction trees from decompositions in
+    :param extraction_samples: Number of contraction trees to extract from each decomposition, keeping the best
     :return: (execution plan, list of all (time generated, plan) tuples)
     """
     best_plan = None
     log = []
+    if planner_workers > 1:
+        planner = contraction_methods.ParallelMethod(planner, planner_workers)
+
+    def is_optimal(plan):
+        return (
+            plan is not None
+            and bound is not None
+            and bound.value is not None
+            and getattr(plan.tree, "treewidth", bound.value + 1) <= bound.value
+        )
+
+    # Once a tree matching the lower bound on treewidth is found, stop planning
+    #   (if the bound is found later, the timer is expired so that the planner stops at its next check)
+    planning = threading.Lock()
+    state = {"active": True, "interrupted": False}
+
+    def stop_if_optimal():
+        with planning:
+            if state["active"] and is_optimal(best_plan):
+                util.log(
+                    "Best tree has optimal treewidth " + str(bound.value),
+                    util.Verbosity.progress,
+                )
+                state["interrupted"] = True
+                timer.interrupt()
+
+    # The graph is exported (and indexed) in the background thread too, so the planner starts immediately
+    #   (bound is None until the constructor returns, in case the bound is found before then)
+    bound = None
+    bound = lower_bounds.BackgroundLowerBound(
+        lambda: planner.decomposed_graph(network), on_finish=stop_if_optimal
+    )
 
     try:
         # Continue the search for a new contraction tree until we have spent more than half of the estimated total
         # time on the search (i.e., we have spent more than the expected contraction time on the search).
         for tree, factored_network in planner.generate_contraction_trees(
-            network, timer, seed=seed, affinity=planner_affinity
+            network,
+            timer,
+            seed=seed,
+            affinity=planner_affinity,
+            extraction_workers=extraction_workers,
+            extraction_samples=extraction_samples,
         ):
             util.log(
                 "Found tree of max-rank " + str(tree.maxrank), util.Verbosity.progress
@@ -165,11 +228,25 @@ def run(
 
                 if slicer is not None:
                     slicer.slice_until(best_plan, memory=mem_limit, rank=rank_limit)
-                if performance_factor is not None:
+                if profile is not None:
+                    estimated_contraction_time = profile.predict(best_plan)
+                    util.log(
+                        "Predicted contraction time " + str(estimated_contraction_time),
+                        util.Verbosity.progress,
+                    )
+                    timer.recap_timeout(estimated_contraction_time)
+                elif performance_factor is not None:
                     estimated_contraction_time = (
                         best_plan.total_FLOPs * performance_factor
                     )
                     timer.recap_timeout(estimated_contraction_time)
+
+                if is_optimal(best_plan):
+                    util.log(
+                        "Found tree of optimal treewidth " + str(bound.value),
+                        util.Verbosity.progress,
+                    )
+                    break
             elif stopwatch is not None:
                 log.append(
                     (
@@ -189,6 +266,15 @@ def run(
     except:
         util.log(traceback.format_exc(), util.Verbosity.always)
         util.output_pair("Error", "Exception during execution", util.Verbosity.always)
+    finally:
+        with planning:
+            state["active"] = False
+
+    if state["interrupted"]:
+        timer.cancel()
+    bound.cancel()
+    if best_plan is not None:
+        best_plan.treewidth_lower_bound = bound.value
 
     # Use the best tree that we have found so far
     return best_plan, log
@@ -52,8 +52,29 @@ Entry point for just the slicing part of the execution phase
     type=util.TaggedChoice(tensor_network.ALL_SLICERS, case_sensitive=False),
     show_default=True,
 )
+@click.option(
+    "--slice_workers",
+    type=int,
+    help="Number of workers to balance slices among, for the parallel and hardware slicers (default: 1, since slices "
+    "are contracted one at a time; only set this when the slices are distributed among workers externally)",
+    required=False,
+)
+@click.option(
+    "--slice_cache",
+    type=int,
+    help="Cache size (bytes) to fit slices in, for the cache and hardware slicers (default: the last-level cache)",
+    required=False,
+)
 def measure(
-    network_pair, timeout, seed, entry_size, rank_limit, mem_limit, slicer,
+    network_pair,
+    timeout,
+    seed,
+    entry_size,
+    rank_limit,
+    mem_limit,
+    slicer,
+    slice_workers,
+    slice_cache,
 ):
     # Setup general system parameters
     sys.setrecursionlimit(100000)
@@ -65,6 +86,13 @@ def measure(
     if mem_limit is not None:
         mem_limit /= entry_size
 
+    # Configure the slicer for the hardware
+    if slice_workers is not None:
+        slicer.add_argument("workers", slice_workers)
+    if slice_cache is not None:
+        slicer.add_argument("cache_size", slice_cache)
+    slicer.add_argument("entry_size", entry_size)
+
     stopwatch = util.Stopwatch()
 
     # Load the network and plan
@@ -0,0 +1,262 @@
+import itertools
+import json
+import os
+import socket
+import time
+
+import numpy
+
+import util
+from contraction_methods.contraction_tree import ContractionTreeContext
+from tensor_network.sliced_execution_plan import SlicedExecutionPlan
+from tensor_network.tensor import BuiltTensor
+from tensor_network.tensor_network import TensorNetwork
+
+DEFAULT_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "tensororder", "calibration.json"
+)
+
+
+class PerformanceProfile:
+    """
+    A model of the time needed to contract a tensor network on this machine, fit from microbenchmarks:
+
+        time = (# of tensordot calls) * call_overhead
+                + FLOPs * seconds_per_FLOP
+                + (# of entries of the inputs and outputs of all calls) * seconds_per_entry
+
+    The last term accounts for transposes and copies, which (along with the call overhead) dominate small contractions.
+    """
+
+    def __init__(self, call_overhead, seconds_per_FLOP, seconds_per_entry):
+        self.call_overhead = call_overhead
+        self.seconds_per_FLOP = seconds_per_FLOP
+        self.seconds_per_entry = seconds_per_entry
+
+    def predict(self, plan):
+        """
+        Predict the time needed to contract all slices of the provided plan.
+
+        :param plan: A SlicedExecutionPlan
+        :return: The predicted time (s)
+        """
+        calls, entries = plan.contraction_counts()
+        return plan.num_slices * self.predict_slice(calls, plan.FLOPs, entries)
+
+    def predict_slice(self, calls, FLOPs, entries):
+        return (
+            calls * self.call_overhead
+            + FLOPs * self.seconds_per_FLOP
+            + entries * self.seconds_per_entry
+        )
+
+    def to_dict(self):
+        return {
+            "call_overhead": self.call_overhead,
+            "seconds_per_FLOP": self.seconds_per_FLOP,
+            "seconds_per_entry": self.seconds_per_entry,
+        }
+
+    @staticmethod
+    def from_dict(info):
+        return PerformanceProfile(
+            info["call_overhead"], info["seconds_per_FLOP"], info["seconds_per_entry"]
+        )
+
+    @staticmethod
+    def fit(samples):
+        """
+        Fit a profile to the provided measurements, minimizing the relative error of each prediction.
+
+        :param samples: A list of (calls, FLOPs, entries, seconds) measurements
+        :return: The PerformanceProfile with non-negative coefficients that best fits the samples
+        """
+        samples = numpy.array(samples, dtype=numpy.float64)
+        features = samples[:, :3] / samples[:, 3:4]
+        target = numpy.ones(len(samples))
+
+        # Each feature may be unhelpful (e.g. no transposes are needed), so try every subset of the features
+        best, best_error = numpy.zeros(3), float("inf")
+        for size in range(1, 4):
+            for subset in itertools.combinations(range(3), size):
+                coefficients, _, _, _ = numpy.linalg.lstsq(
+                    features[:, subset], target, rcond=None
+                )
+                if numpy.any(coefficients < 0):
+                    continue
+                error = numpy.sum((features[:, subset] @ coefficients - target) ** 2)
+                if error < best_error:
+                    best, best_error = numpy.zeros(3), error
+                    best[list(subset)] = coefficients
+        return PerformanceProfile(*best.tolist())
+
+
+def measure(function, min_time):
+    """
+    Measure the average time of a function, repeated for at least [min_time] seconds.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        result = function()
+        # Wait for libraries that run asynchronously
+        getattr(result, "block_until_ready", lambda: None)()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def benchmark_tensordot(tensor_library, max_log_FLOPs=24, min_time=0.02):
+    """
+    Time single tensordot calls on binary tensors of various ranks.
+
+    Half of the calls contract the leading axes of the left tensor with the trailing axes of the right tensor,
+    which requires both to be transposed.
+
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :param max_log_FLOPs: log2 of the largest number of FLOPs to time
+    :param min_time: Repeat each call for at least this long (s)
+    :return: A list of (1, FLOPs, entries, seconds) for each call timed
+    """
+    samples = []
+    for log_FLOPs in range(2, max_log_FLOPs + 1, 2):
+        for contracted in sorted({1, log_FLOPs // 4, log_FLOPs // 2} - {0}):
+            left_rank = (log_FLOPs + contracted) // 2
+            right_rank = log_FLOPs + contracted - left_rank
+            left = tensor_library.create_tensor((2,) * left_rank, 1)
+            right = tensor_library.create_tensor((2,) * right_rank, 1)
+            entries = 2 ** left_rank + 2 ** right_rank + 2 ** (log_FLOPs - contracted)
+
+            for transposed in [False, True]:
+                if transposed:
+                    axes = (
+                        list(range(contracted)),
+                        list(range(right_rank - contracted, right_rank)),
+                    )
+                else:
+                    axes = (
+                        list(range(left_rank - contracted, left_rank)),
+                        list(range(contracted)),
+                    )
+
+                seconds = measure(
+                    lambda: tensor_library.tensordot(left, right, axes), min_time
+                )
+                samples.append((1, 2 ** log_FLOPs, entries, seconds))
+    return samples
+
+
+def benchmark_network(tensor_library, sizes=(16, 64, 256), num_sliced=4, min_time=0.1):
+    """
+    Time complete contractions of sliced rings of small tensors, to include the overhead of slicing and
+    building tensors and of the bookkeeping done for each tensordot call.
+
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :param sizes: Number of tensors in each ring to time
+    :param num_sliced: Number of edges of each ring to slice
+    :param min_time: Repeat each contraction for at least this long (s)
+    :return: A list of (calls, FLOPs, entries, seconds) for each contraction timed
+    """
+    samples = []
+    for size in sizes:
+        network = TensorNetwork()
+        tensor_edges = [
+            network.add_node(BuiltTensor(numpy.ones((2, 2)))) for _ in range(size)
+        ]
+        ring = [
+            network.connect(*tensor_edges[i][1], *tensor_edges[(i + 1) % size][0])
+            for i in range(size)
+        ]
+
+        context = ContractionTreeContext()
+        root = context.leaf(network, 0)
+        for i in range(1, size):
+            root = context.join(root, context.leaf(network, i))
+        plan = SlicedExecutionPlan(context.get_tree(root), network)
+        for edge in ring[:: size // num_sliced]:
+            plan.slice_at(edge)
+
+        calls, entries = plan.contraction_counts()
+        seconds = measure(lambda: tensor_library.contract_sliced(plan), min_time)
+        samples.append(
+            (
+                plan.num_slices * calls,
+                plan.total_FLOPs,
+                plan.num_slices * entries,
+                seconds,
+            )
+        )
+    return samples
+
+
+def benchmark(tensor_library):
+    """
+    Fit a profile of the tensor library from tensordot calls and complete contractions.
+
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :return: A PerformanceProfile
+    """
+    profile = PerformanceProfile.fit(benchmark_tensordot(tensor_library))
+
+    # A lone tensordot call underestimates the overhead of each call within a contraction,
+    #   so take the overhead from complete contractions instead
+    overheads = [
+        (seconds - profile.predict_slice(0, FLOPs, entries)) / calls
+        for calls, FLOPs, entries, seconds in benchmark_network(tensor_library)
+    ]
+    profile.call_overhead = max(0.0, float(numpy.median(overheads)))
+    return profile
+
+
+def calibrate(tensor_library, thread_limit=None):
+    """
+    Measure the performance of the tensor library on this machine.
+
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :param thread_limit: Limit on execution number of threads
+    :return: A PerformanceProfile
+    """
+    if thread_limit is not None:
+        import threadpoolctl
+
+        with threadpoolctl.threadpool_limits(limits=thread_limit, user_api="blas"):
+            return benchmark(tensor_library)
+    return benchmark(tensor_library)
+
+
+def load_profile(tensor_library, entry_type, thread_limit=None, cache=DEFAULT_CACHE):
+    """
+    Get the performance profile of the tensor library on this machine, calibrating (and caching) it if needed.
+
+    :param tensor_library: Tensor API (from tensor_network.ALL_APIS) to use
+    :param entry_type: Type of tensor entries
+    :param thread_limit: Limit on execution number of threads
+    :param cache: A json file of profiles, by host and configuration
+    :return: A PerformanceProfile
+    """
+    key = "/".join(
+        [
+            socket.gethostname(),
+            type(tensor_library).__name__,
+            entry_type,
+            str(thread_limit),
+        ]
+    )
+
+    profiles = {}
+    if os.path.exists(cache):
+        with open(cache, "r") as f:
+            profiles = json.load(f)
+    if key in profiles:
+        return PerformanceProfile.from_dict(profiles[key])
+
+    util.log("Calibrating " + key, util.Verbosity.stages)
+    profile = calibrate(tensor_library, thread_limit)
+    util.log("Calibrated profile " + str(profile.to_dict()), util.Verbosity.plan_info)
+
+    profiles[key] = profile.to_dict()
+    os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+    with open(cache, "w") as f:
+        json.dump(profiles, f, indent=2)
+    return profile
@@ -1,3 +1,6 @@
+import itertools
+import numpy
+
 import util
 
 
@@ -18,6 +21,8 @@ class SlicedExecutionPlan:
 
         self.edges_to_slice = set()
         self.groups_to_slice = []
+        self.group_dimensions = []
+        self.treewidth_lower_bound = None  # A lower bound on the treewidth, if known
 
         (
             self.FLOPs,
@@ -55,6 +60,130 @@ class SlicedExecutionPlan:
         ]
         self.next_edge_to_slice = None
 
+    def refine(self, time_budget, max_rank=None):
+        """
+        Search for a cheaper contraction tree near the current tree, keeping the current slices
+
+        :param time_budget: Time (s) to spend refining the tree
+        :param max_rank: Largest rank allowed for intermediate tensors (default: the current maxrank)
+        :return: None
+        """
+        old_FLOPs = self.FLOPs
+        self.replace_tree(self.tree.anneal(time_budget, max_rank=max_rank))
+        util.log(
+            "Refined tree from " + str(old_FLOPs) + " to " + str(self.FLOPs) + " FLOPs",
+            util.Verbosity.progress,
+        )
+
+    def reoptimize_windows(self, window_size, max_rank=None):
+        """
+        Optimally reorder small windows of the contraction tree, keeping the current slices
+
+        :param window_size: Largest number of subtrees to reorder at once
+        :param max_rank: Largest rank allowed for intermediate tensors (default: the current maxrank)
+        :return: None
+        """
+        old_FLOPs = self.FLOPs
+        self.replace_tree(self.tree.optimize_windows(window_size, max_rank=max_rank))
+        util.log(
+            "Reoptimized windows from " + str(old_FLOPs) + " to " + str(self.FLOPs) + " FLOPs",
+            util.Verbosity.progress,
+        )
+
+    def replan_sliced(self, window_size, refine_time=0, max_rank=None):
+        """
+        Search for a cheaper contraction tree for the network with the sliced indices removed, keeping the current
+        slices (the best order of a sliced network often differs from the best order of the full network)
+
+        :param window_size: Largest number of subtrees to reorder at once (0 to disable)
+        :param refine_time: Time (s) to spend refining the sliced tree by local search
+        :param max_rank: Largest rank allowed for intermediate tensors (default: the current maxrank)
+        :return: None
+        """
+        old_FLOPs = self.FLOPs
+        reduced_tree = self.network.remove_sliced_indices_from(
+            self.tree, self.groups_to_slice
+        )
+        if refine_time > 0:
+            reduced_tree = reduced_tree.anneal(refine_time, max_rank=max_rank)
+        if window_size > 0:
+            reduced_tree = reduced_tree.optimize_windows(window_size, max_rank=max_rank)
+
+        # Restore the sliced indices, so that the tree can still be sliced
+        tree = self.network.remove_sliced_indices_from(reduced_tree, [])
+        tree.order_by_memory(self.edges_to_slice)
+        self.replace_tree(tree)
+        util.log(
+            "Replanned sliced tree from " + str(old_FLOPs) + " to " + str(self.FLOPs) + " FLOPs",
+            util.Verbosity.progress,
+        )
+
+    def order_by_memory(self):
+        """
+        Order the children in the contraction tree to minimize the memory cap, keeping the current slices
+        (this does not change the FLOPs)
+
+        :return: None
+        """
+        old_memory = self.memory
+        self.tree.order_by_memory(self.edges_to_slice)
+        (
+            self.FLOPs,
+            self.memory,
+            self.next_edge_to_slice,
+            self.maxrank,
+        ) = self.tree.estimate_cost(self.edges_to_slice)
+        util.log(
+            "Reordered tree from " + str(old_memory) + " to " + str(self.memory) + " memory",
+            util.Verbosity.progress,
+        )
+
+    def replace_tree(self, tree):
+        """
+        Use a new contraction tree (for the same network) in the execution plan
+
+        :param tree: The new contraction tree
+        :return: None
+        """
+        # Keep the width of the underlying decomposition
+        for width_attribute in ["treewidth", "branchwidth"]:
+            if hasattr(self.tree, width_attribute):
+                setattr(tree, width_attribute, getattr(self.tree, width_attribute))
+        self.tree = tree
+        (
+            self.FLOPs,
+            self.memory,
+            self.next_edge_to_slice,
+            self.maxrank,
+        ) = self.tree.estimate_cost(self.edges_to_slice)
+
+    def clear_slices(self):
+        """
+        Remove all slices from the execution plan
+
+        :return: None
+        """
+        self.edges_to_slice = set()
+        self.groups_to_slice = []
+        self.group_dimensions = []
+        (
+            self.FLOPs,
+            self.memory,
+            self.next_edge_to_slice,
+            self.maxrank,
+        ) = self.tree.estimate_cost(self.edges_to_slice)
+
+    def set_slices(self, groups):
+        """
+        Replace the slices of the execution plan
+
+        :param groups: A list of groups of equivalent edges to slice, in order
+        :return: None
+        """
+        self.clear_slices()
+        for group in groups:
+            self.slice_at(next(iter(group)))
+
     def slice_at(self, edge):
         """
         Include a slice at this index in the execution plan
@@ -72,6 +201,7 @@ class SlicedExecutionPlan:
             util.Verbosity.debug,
         )
         self.groups_to_slice.append(equivalent_edges)
+        self.group_dimensions.append(self.network.edge_dimension(edge))
         self.edges_to_slice |= equivalent_edges
 
         (
@@ -81,9 +211,45 @@ class SlicedExecutionPlan:
             self.maxrank,
         ) = self.tree.estimate_cost(self.edges_to_slice)
 
+    @property
+    def num_slices(self):
+        result = 1
+        for dimension in self.group_dimensions:
+            result *= dimension
+        return result
+
     @property
     def total_FLOPs(self):
-        return self.FLOPs * (2 ** len(self.groups_to_slice))
+        return self.FLOPs * self.num_slices
+
+    def count_contracted_slices(self, limit=None):
+        """
+        Count the slices that are contracted, i.e. that are not skipped as identically zero
+
+        :param limit: Stop counting at this number of slices (e.g. the slice cutoff)
+        :return: The number of slices contracted
+        """
+        groups = [group for group in self.groups_to_slice if len(group) > 0]
+        dimensions = [self.network.edge_dimension(next(iter(group))) for group in groups]
+        is_zero_slice = self.network.zero_slice_test(groups)
+        slices = (
+            assignment
+            for assignment in itertools.product(*map(range, dimensions))
+            if not is_zero_slice(assignment)
+        )
+        return sum(1 for _ in itertools.islice(slices, limit))
+
+    def contraction_counts(self):
+        """
+        Count the tensordot calls needed for each slice, and the entries of their inputs and outputs.
+
+        :return: (number of calls, total number of entries of the inputs and outputs of all calls)
+        """
+        flat = self.tree.flatten()
+        sizes = numpy.exp2(flat.log_sizes(self.edges_to_slice))
+        joins = numpy.flatnonzero(flat.left >= 0)
+        entries = sizes[joins] + sizes[flat.left[joins]] + sizes[flat.right[joins]]
+        return len(joins), float(entries.sum())
 
     @property
     def widths(self):
@@ -91,6 +257,11 @@ class SlicedExecutionPlan:
         # Treewidth-based methods include the width of the underlying tree decomposition
         if hasattr(self.tree, "treewidth"):
             widths["Treewidth"] = self.tree.treewidth
+            if self.treewidth_lower_bound is not None:
+                widths["Treewidth Lower Bound"] = self.treewidth_lower_bound
+                widths["Treewidth Gap"] = (
+                    self.tree.treewidth - self.treewidth_lower_bound
+                )
         if hasattr(self.tree, "branchwidth"):
             widths["Branchwidth"] = self.tree.branchwidth
         return widths
@@ -103,6 +274,6 @@ class SlicedExecutionPlan:
         :return: None
         """
         util.output_pair("# Sliced", len(self.groups_to_slice), verbosity)
-        util.output_pair("# Network Slices", 2 ** len(self.groups_to_slice), verbosity)
+        util.output_pair("# Network Slices", self.num_slices, verbosity)
         util.output_pair("Estimated Memory", float(self.memory), verbosity)
         util.output_pair("Estimated FLOPs", float(self.total_FLOPs), verbosity)
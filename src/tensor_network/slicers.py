@@ -1,6 +1,24 @@
 import collections
 import math
+import multiprocessing
+import numpy
+import os
 import random
+import time
+
+import util
+
+slice_tree = None  # The contraction tree whose slices are evaluated by the current pool of worker processes
+
+
+def set_slice_tree(tree):
+    global slice_tree
+    slice_tree = tree
+
+
+def estimate_slices(edges):
+    FLOPs, memory, _, maxrank = slice_tree.estimate_cost(set(edges))
+    return FLOPs, memory, maxrank
 
 
 class BaseSlicer:
@@ -23,6 +41,55 @@ class BaseSlicer:
         while slices is not None and len(plan.groups_to_slice) < slices:
             self.slice_once(plan)
 
+    def add_argument(self, key, value):
+        """
+        Configure the slicer.
+
+        :param key: The name of the argument
+        :param value: The value of the argument
+        :return: None
+        """
+        # Hardware settings are only used by slicers that balance slices among workers or fit slices in the cache
+        if key not in ["workers", "cache_size", "entry_size"]:
+            raise ValueError("Invalid argument " + str(key) + " for selected slicer")
+
+    def slice_and_replan(
+        self, plan, memory=None, rank=None, slices=None, rounds=4, window_size=8, refine_time=0
+    ):
+        """
+        Alternate between slicing and replanning the contraction tree for the sliced network, so that the tree
+        and the slices are tuned together. Replanning may raise the memory usage, in which case the next round
+        slices further; the plan with the fewest total FLOPs (across all slices) is kept.
+
+        :param plan: Plan to modify by slicing
+        :param memory: Upper bound of memory usage, in terms of number of tensor entries
+        :param rank: Upper bound on tensor dimensions
+        :param slices: Lower bound on number of slices to use
+        :param rounds: Largest number of rounds of slicing and replanning
+        :param window_size: Largest number of subtrees to reorder at once when replanning
+        :param refine_time: Time (s) to spend refining the tree by local search in each round
+        :return:
+        """
+        best = None  # (total FLOPs, tree, groups to slice) of the best plan
+        for _ in range(rounds):
+            self.slice_until(plan, memory, rank, slices)
+            if best is not None and plan.total_FLOPs >= best[0]:
+                break
+            best = (plan.total_FLOPs, plan.tree, list(plan.groups_to_slice))
+
+            old_FLOPs = plan.FLOPs
+            plan.replan_sliced(window_size, refine_time)
+            if plan.FLOPs >= old_FLOPs:
+                break
+        else:
+            self.slice_until(plan, memory, rank, slices)
+            if plan.total_FLOPs < best[0]:
+                return
+
+        if best is not None and (plan.tree is not best[1] or plan.groups_to_slice != best[2]):
+            plan.replace_tree(best[1])
+            plan.set_slices(best[2])
+
 
 class GreedyMemSlicer(BaseSlicer):
     """
@@ -39,14 +106,12 @@ class GreedyLargestSlicer(BaseSlicer):
     """
 
     def slice_once(self, plan):
-        max_size, edges = 0, None
-        for node in plan.tree.iterate_postorder():
-            size = sum(0 if e in plan.edges_to_slice else 1 for e in node.free_edges)
-            if size > max_size:
-                max_size = size
-                edges = node.free_edges
-
-        plan.slice_at(random.choice(edges))
+        flat = plan.tree.flatten()
+        sizes = flat.log_sizes(plan.edges_to_slice)
+        largest = int(sizes.argmax())
+        plan.slice_at(
+            random.choice([e for e in flat.node_free_edges(largest).tolist() if e not in plan.edges_to_slice])
+        )
 
 
 class GreedyMostSlicer(GreedyMemSlicer):
@@ -55,25 +120,22 @@ class GreedyMostSlicer(GreedyMemSlicer):
     """
 
     def slice_until(self, plan, memory=None, rank=None, slices=None):
-        highest_allowable_rank = min(
-            float("inf") if rank is None else rank,
-            float("inf") if memory is None else math.floor(math.log2(memory)),
-        )
-        if not math.isinf(highest_allowable_rank):
+        highest_allowable_rank = float("inf") if rank is None else rank
+        highest_allowable_log_size = float("inf") if memory is None else math.floor(math.log2(memory))
+        if not math.isinf(highest_allowable_rank) or not math.isinf(highest_allowable_log_size):
             rep_edge = plan.network.equivalent_edge_sets()
-            nodes = list(plan.tree.iterate_postorder())
-            node_sizes = [
-                sum(0 if e in plan.edges_to_slice else 1 for e in node.free_edges)
-                for node in nodes
-            ]
+            flat = plan.tree.flatten()
+            is_large = numpy.logical_or(
+                flat.ranks(plan.edges_to_slice) > highest_allowable_rank,
+                flat.log_sizes(plan.edges_to_slice) > highest_allowable_log_size,
+            )
 
             # For each edge e, record the large nodes that e is incident to
             large_nodes_by_edge = collections.defaultdict(set)
-            for i in range(len(nodes)):
-                if node_sizes[i] > highest_allowable_rank:
-                    for e in nodes[i].free_edges:
-                        if e not in plan.edges_to_slice:
-                            large_nodes_by_edge[rep_edge[e]].add(i)
+            for i in numpy.flatnonzero(is_large).tolist():
+                for e in flat.node_free_edges(i).tolist():
+                    if e not in plan.edges_to_slice:
+                        large_nodes_by_edge[rep_edge[e]].add(i)
 
             if len(large_nodes_by_edge) > 0:  # Otherwise, there are no large nodes
                 while True:
@@ -90,7 +152,7 @@ class GreedyMostSlicer(GreedyMemSlicer):
                     # Update large_nodes_by_edge for the next iteration
                     #   (Note the top-level list to avoid modifying the iterated set)
                     for i in list(large_nodes_by_edge[chosen_edge]):
-                        for e in nodes[i].free_edges:
+                        for e in flat.node_free_edges(i).tolist():
                             if e not in plan.edges_to_slice:
                                 large_nodes_by_edge[rep_edge[e]].discard(i)
 
@@ -99,6 +161,267 @@ class GreedyMostSlicer(GreedyMemSlicer):
         super().slice_until(plan, memory, rank, slices)
 
 
+class AnnealingSlicer(GreedyMemSlicer):
+    """
+    Slice greedily, then search by simulated annealing for slices with fewer total FLOPs (across all slices),
+    swapping groups of equivalent edges in and out while keeping the resource constraints.
+    """
+
+    def __init__(
+        self,
+        time_budget=5,
+        steps=500,
+        batch_size=8,
+        workers=None,
+        min_parallel_size=10000,
+        initial_temperature=1.0,
+        final_temperature=0.01,
+    ):
+        """
+        :param time_budget: Longest time (s) to spend annealing
+        :param steps: Largest number of annealing steps
+        :param batch_size: Number of candidate moves evaluated at each step (the best of which is proposed)
+        :param workers: Number of processes to evaluate candidates in (default: the available CPUs)
+        :param min_parallel_size: Evaluate candidates in this process for contraction trees with fewer nodes
+        :param initial_temperature: Initial temperature, in terms of log2 of the total FLOPs
+        :param final_temperature: Final temperature, in terms of log2 of the total FLOPs
+        """
+        self.__time_budget = time_budget
+        self.__steps = steps
+        self.__batch_size = batch_size
+        self.__workers = workers
+        self.__min_parallel_size = min_parallel_size
+        self.__initial_temperature = initial_temperature
+        self.__final_temperature = final_temperature
+
+    def slice_until(self, plan, memory=None, rank=None, slices=None):
+        # Start from a greedy solution that satisfies the constraints
+        super().slice_until(plan, memory, rank, slices)
+        if memory is None and rank is None and slices is None:
+            return
+
+        rep_edge = plan.network.equivalent_edge_sets()
+        initial = frozenset(rep_edge[next(iter(group))] for group in plan.groups_to_slice)
+        candidates = self.__candidates(plan, rep_edge, memory, rank, slices) | initial
+        if len(candidates) <= len(initial) and slices is None:
+            return  # No other edges can be sliced to reduce memory
+
+        groups = {e: plan.network.find_equivalent_edges(e) for e in candidates}
+        log_dimensions = {e: math.log2(plan.network.edge_dimension(e)) for e in candidates}
+
+        def cost(state, estimate):
+            """
+            :return: (log2 of the total FLOPs plus a penalty for exceeding the constraints, if the constraints hold)
+            """
+            FLOPs, state_memory, maxrank = estimate
+            excess = 0
+            if memory is not None and state_memory > memory:
+                excess += math.log2(state_memory) - math.log2(memory)
+            if rank is not None and maxrank > rank:
+                excess += maxrank - rank
+            if slices is not None and len(state) < slices:
+                excess += slices - len(state)
+            log_total = math.log2(max(FLOPs, 1)) + sum(log_dimensions[e] for e in state)
+            return log_total + 10 * excess, excess == 0
+
+        pool = None
+        if (self.__workers is None or self.__workers > 1) and plan.tree.flatten().size >= self.__min_parallel_size:
+            workers = self.__workers if self.__workers is not None else len(os.sched_getaffinity(0))
+            pool = multiprocessing.get_context("fork").Pool(
+                workers, initializer=set_slice_tree, initargs=(plan.tree,)
+            )
+        else:
+            set_slice_tree(plan.tree)
+
+        known = {}  # state -> (cost, feasible)
+
+        def evaluate(states):
+            new_states = list(set(s for s in states if s not in known))
+            edge_lists = [[f for e in s for f in groups[e]] for s in new_states]
+            if pool is not None:
+                estimates = pool.map(estimate_slices, edge_lists)
+            else:
+                estimates = [estimate_slices(edges) for edges in edge_lists]
+            for s, estimate in zip(new_states, estimates):
+                known[s] = cost(s, estimate)
+
+        try:
+            evaluate([initial])
+            current, best = initial, initial
+            start = time.time()
+            candidate_list = sorted(candidates)
+            for step in range(self.__steps):
+                elapsed = time.time() - start
+                if elapsed > self.__time_budget:
+                    break
+                progress = max(step / self.__steps, elapsed / self.__time_budget)
+                temperature = self.__initial_temperature * (
+                    self.__final_temperature / self.__initial_temperature
+                ) ** progress
+
+                moves = [self.__move(current, candidate_list) for _ in range(self.__batch_size)]
+                moves = [m for m in moves if m is not None]
+                if len(moves) == 0:
+                    break
+                evaluate(moves)
+                proposal = min(moves, key=lambda m: known[m][0])
+                delta = known[proposal][0] - known[current][0]
+                if delta <= 0 or random.random() < math.exp(-delta / temperature):
+                    current = proposal
+                    if known[current][1] and known[current][0] < known[best][0]:
+                        best = current
+        finally:
+            if pool is not None:
+                pool.terminate()
+            set_slice_tree(None)
+
+        if best != initial:
+            old_FLOPs = plan.total_FLOPs
+            plan.set_slices([groups[e] for e in sorted(best)])
+            util.log(
+                "Annealed slices from " + str(old_FLOPs) + " to " + str(plan.total_FLOPs) + " total FLOPs",
+                util.Verbosity.progress,
+            )
+
+    @staticmethod
+    def __candidates(plan, rep_edge, memory, rank, slices):
+        """
+        :return: The representatives of the edges that can be sliced to reduce the resources used by the plan
+        """
+        flat = plan.tree.flatten()
+        if slices is not None:
+            # Any edge may be needed to reach the number of slices
+            return set(rep_edge[e] for e in flat.free_edges.tolist())
+
+        is_large = numpy.zeros(flat.size, dtype=bool)
+        if rank is not None:
+            is_large |= flat.ranks() > rank
+        if memory is not None:
+            is_large |= flat.log_sizes() > math.log2(memory)
+        return set(
+            rep_edge[e] for i in numpy.flatnonzero(is_large).tolist() for e in flat.node_free_edges(i).tolist()
+        )
+
+    @staticmethod
+    def __move(state, candidates):
+        """
+        :return: A random neighbor of [state] (swapping, removing, or adding an edge group), or None
+        """
+        kind = random.random()
+        if len(state) > 0 and kind < 0.2:
+            return state - {random.choice(sorted(state))}
+        addition = random.choice(candidates)
+        if addition in state:
+            return None
+        if len(state) > 0 and kind < 0.8:
+            return (state - {random.choice(sorted(state))}) | {addition}
+        return state | {addition}
+
+
+class HardwareAwareSlicer(GreedyMemSlicer):
+    """
+    Slice greedily to meet the resource constraints, then keep slicing greedily while it is predicted to pay off:
+    enough (and evenly divisible) slices keep every worker busy, and slices whose intermediate tensors fit in the
+    last-level cache contract faster. The slices are chosen to minimize the predicted time
+
+        ceil(# of slices / workers) * (FLOPs per slice) / (cache_speedup if the slice fits in the cache else 1)
+
+    Note contract_sliced contracts the slices one at a time, so there is a single worker unless the slices are
+    distributed among workers by the caller.
+    """
+
+    def __init__(
+        self,
+        balance_workers=True,
+        fit_cache=True,
+        workers=1,
+        cache_size=None,
+        entry_size=8,
+        cache_speedup=2.0,
+        max_overhead=16.0,
+        max_slices_per_worker=8,
+    ):
+        """
+        :param balance_workers: If True, slice to balance the slices among the workers
+        :param fit_cache: If True, slice so that the intermediate tensors of each slice fit in the cache
+        :param workers: Number of workers contracting slices in parallel
+        :param cache_size: Size of the cache (bytes) (default: the last-level cache, read from sysfs)
+        :param entry_size: Size (bytes) of tensor entries
+        :param cache_speedup: Predicted speedup of a slice whose intermediate tensors fit in the cache
+        :param max_overhead: Never slice beyond this factor of the total FLOPs needed to meet the constraints
+        :param max_slices_per_worker: Stop slicing for balance beyond this many slices per worker
+        """
+        self.__balance_workers = balance_workers
+        self.__fit_cache = fit_cache
+        self.__workers = workers
+        self.__cache_size = cache_size
+        self.__entry_size = entry_size
+        self.__cache_speedup = cache_speedup
+        self.__max_overhead = max_overhead
+        self.__max_slices_per_worker = max_slices_per_worker
+
+    def add_argument(self, key, value):
+        if key == "workers":
+            self.__workers = value
+        elif key == "cache_size":
+            self.__cache_size = value
+        elif key == "entry_size":
+            self.__entry_size = value
+        else:
+            super().add_argument(key, value)
+
+    def slice_until(self, plan, memory=None, rank=None, slices=None):
+        super().slice_until(plan, memory, rank, slices)
+
+        workers = self.__workers if self.__balance_workers else 1
+        cache_entries = None
+        if self.__fit_cache:
+            cache_size = self.__cache_size if self.__cache_size is not None else util.last_level_cache_size()
+            if cache_size is not None:
+                cache_entries = cache_size / self.__entry_size
+
+        def fits_cache():
+            return cache_entries is not None and plan.memory <= cache_entries
+
+        def predict_time():
+            slice_time = plan.FLOPs / (self.__cache_speedup if fits_cache() else 1)
+            return math.ceil(plan.num_slices / workers) * slice_time
+
+        def needs_slices():
+            return (cache_entries is not None and not fits_cache()) or (
+                workers > 1 and plan.num_slices < workers * self.__max_slices_per_worker
+            )
+
+        base_FLOPs = plan.total_FLOPs
+        base_time = predict_time()
+        best_time, best_count = base_time, len(plan.groups_to_slice)
+        while (
+            needs_slices()
+            and plan.next_edge_to_slice is not None
+            and plan.next_edge_to_slice >= 0
+            and plan.total_FLOPs <= base_FLOPs * self.__max_overhead
+        ):
+            self.slice_once(plan)
+            predicted_time = predict_time()
+            if predicted_time < best_time:
+                best_time, best_count = predicted_time, len(plan.groups_to_slice)
+        if best_count < len(plan.groups_to_slice):
+            plan.set_slices(plan.groups_to_slice[:best_count])
+
+        util.log(
+            "Sliced for "
+            + str(workers)
+            + " workers and a cache of "
+            + str(cache_entries)
+            + " entries, using "
+            + str(plan.num_slices)
+            + " slices",
+            util.Verbosity.progress,
+        )
+        util.output_pair("Predicted Slicing Overhead", best_time / base_time, util.Verbosity.plan_info)
+        util.output_pair("Chosen Slicing FLOP Overhead", plan.total_FLOPs / base_FLOPs, util.Verbosity.plan_info)
+
+
 class DisabledSlicer(BaseSlicer):
     """
     Perform no slicing.
@@ -121,4 +444,8 @@ ALL_SLICERS = {
     "disable": DisabledSlicer(),
     "greedy_largest": GreedyLargestSlicer(),
     "greedy_most": GreedyMostSlicer(),
+    "anneal": AnnealingSlicer(),
+    "parallel": HardwareAwareSlicer(fit_cache=False),
+    "cache": HardwareAwareSlicer(balance_workers=False),
+    "hardware": HardwareAwareSlicer(),
 }
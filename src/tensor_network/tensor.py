@@ -19,7 +19,7 @@ class Tensor:
 
     def get_slice(self, which_edge, value):
         lookup = [
-            (value,) if i == which_edge else slice(0, self.shape[i])
+            slice(value, value + 1) if i == which_edge else slice(0, self.shape[i])
             for i in range(len(self.shape))
         ]
         return SlicedTensor(self, lookup)
@@ -28,6 +28,15 @@ class Tensor:
     def diagonal(self):
         return False
 
+    def is_zero_slice(self, fixed):
+        """
+        Determine if this tensor is zero at every entry where some indices take fixed values.
+
+        :param fixed: A dictionary from indices of this tensor to their values
+        :return: True if the tensor is known to be zero at every such entry
+        """
+        return False
+
     def build(self, tensor_factory):
         raise NotImplementedError()
 
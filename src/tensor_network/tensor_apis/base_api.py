@@ -14,15 +14,41 @@ class BaseTensorAPI:
     def contract(self, network, contraction_tree):
         raise NotImplementedError
 
+    def buffer_pool(self):
+        """
+        Get a pool of buffers to reuse for the tensors of each contraction (and across slices).
+        By default, tensors are allocated by create_tensor and tensordot instead.
+
+        :return: A pool with create_tensor, tensordot, release, and clear methods, or None
+        """
+        return None
+
+    def is_all_zero(self, tensor):
+        """
+        Determine if every entry of a tensor is zero, so that the contraction of a network containing it can stop
+        early. This is called on every tensor of the contraction, so libraries should only scan tensors that are
+        cheap to scan. By default, tensors are not checked.
+
+        :param tensor: A tensor created by this library
+        :return: True if every entry is known to be zero
+        """
+        return False
+
     def contract_sliced(self, execution_plan, num_slice_limit=None):
         """
         Contract the provided SlicedExecutionPlan
         """
         result = 0
-        slices = execution_plan.network.slice_groups(execution_plan.groups_to_slice)
+        slices = execution_plan.network.slice_groups(
+            execution_plan.groups_to_slice, skip_zero=True
+        )
         if num_slice_limit is not None:
             slices = itertools.islice(slices, num_slice_limit)
         for slice_network in slices:
             tensor_result = self.contract(slice_network, execution_plan.tree)
             result += tensor_result[tuple()]
+
+        pool = self.buffer_pool()
+        if pool is not None:
+            pool.clear()
         return result
@@ -187,11 +187,11 @@ class JaxAPI(BaseTensorAPI):
             else:
                 return self._jax.lax.dot(lookup_matrix, assignment).astype(int_type)
 
-        def at_leaf(leaf):
+        def at_leaf(tensor_index):
             def compute(lookup):
                 # Compute the relevant slice (of this tensor
-                full_tensor, _, resulting_shape = reordering_info[leaf.tensor_index]
-                which_slice = lookup[leaf.tensor_index]
+                full_tensor, _, resulting_shape = reordering_info[tensor_index]
+                which_slice = lookup[tensor_index]
                 tensor_slice = self._jax.lax.dynamic_slice(
                     self._numpy.asarray(full_tensor),
                     start_indices=tuple([which_slice] + [0] * len(resulting_shape)),
@@ -201,17 +201,20 @@ class JaxAPI(BaseTensorAPI):
 
             return compute
 
-        def at_join(join):
+        def at_join(axes):
             def compute(left, right):
-                return self.tensordot(
-                    left, right, (join.left_edge_map, join.right_edge_map),
-                )
+                return self.tensordot(left, right, axes)
 
             return compute
 
         # Record the functions to perform at each node in the tree
+        flat = tree.flatten()
+        is_leaf = (flat.left < 0).tolist()
         funcs = [
-            at_leaf(n) if n.is_leaf else at_join(n) for n in tree.iterate_postorder()
+            at_leaf(tensor_index) if leaf else at_join(axes)
+            for leaf, tensor_index, axes in zip(
+                is_leaf, flat.tensor_index.tolist(), flat.axes
+            )
         ]
 
         if self._build_full:
@@ -227,12 +230,12 @@ class JaxAPI(BaseTensorAPI):
             lookup = apply(compute_lookup)(assignment)
             # util.log(f" lookup: {time.time() - start}", flush=True)
             stack = []
-            for i, node in enumerate(tree.iterate_postorder()):
+            for i in range(flat.size):
                 start = time.time()
-                if node.is_leaf:
+                if is_leaf[i]:
                     stack.append(apply(funcs[i])(lookup))
                     # util.log(
-                    #     f" {i}: {time.time() - start} : {len(node.free_edges)}",
+                    #     f" {i}: {time.time() - start} : {len(flat.node_free_edges(i))}",
                     #     flush=True,
                     # )
                 else:
@@ -240,7 +243,7 @@ class JaxAPI(BaseTensorAPI):
                     left_tensor = stack.pop()
                     stack.append(apply(funcs[i])(left_tensor, right_tensor))
                     # util.log(
-                    #     f" {i}: {time.time() - start} : {left_tensor.shape} {right_tensor.shape} - {node.left_edge_map} {node.right_edge_map} -> {len(node.free_edges)}",
+                    #     f" {i}: {time.time() - start} : {left_tensor.shape} {right_tensor.shape} - {flat.axes[i]} -> {len(flat.node_free_edges(i))}",
                     #     flush=True,
                     # )
             return stack[0]
@@ -261,6 +264,11 @@ class JaxAPI(BaseTensorAPI):
             execution_plan.groups_to_slice, self.create_tensor
         )
 
+        # Skip slices that are zero, since some tensor is zero once its sliced indices are fixed
+        assignments = itertools.filterfalse(
+            execution_plan.network.zero_slice_test(execution_plan.groups_to_slice),
+            assignments,
+        )
         if num_slice_limit is not None:
             assignments = itertools.islice(assignments, num_slice_limit)
 
@@ -272,7 +280,7 @@ class JaxAPI(BaseTensorAPI):
             # The left matrix A is stored in the local unified buffer of 96k × 256 words
             # The right matrix B has size 256 × 256
             tree.sort_small()
-        util.output_pair("Tree Size", len(list(tree.iterate_postorder())), flush=True)
+        util.output_pair("Tree Size", tree.flatten().size, flush=True)
 
         identify = self.__build_function(tree, sequences)
         result = self.create_tensor(shape=(1,), default_value=0)
@@ -1,6 +1,148 @@
+import collections
+import functools
+import operator
+import weakref
+
 from tensor_network.tensor_apis.base_api import BaseTensorAPI, OutOfMemoryError
 
 
+def product(dimensions):
+    return functools.reduce(operator.mul, dimensions, 1)
+
+
+class BufferPool:
+    """
+    A pool of flat buffers, in size classes of a power of two entries, that are reused for the tensors of
+    a contraction (and across slices) instead of allocating (and page faulting) a new array for each tensor.
+
+    Tensors taken from the pool are views of a buffer; releasing a tensor returns its buffer to the pool.
+    Tensors that are never released are simply garbage collected. Small tensors are cheap to allocate
+    (and are not page faulted), so they are allocated directly instead.
+    """
+
+    def __init__(self, numpy, dtype, min_size=2 ** 14):
+        """
+        :param numpy: The numpy module
+        :param dtype: The type of entries of all buffers
+        :param min_size: Allocate tensors with fewer entries directly
+        """
+        self._numpy = numpy
+        self.dtype = numpy.dtype(dtype)
+        self.__min_size = min_size
+        self.__free = collections.defaultdict(list)  # size class -> list of unused buffers
+        self.__lent = weakref.WeakValueDictionary()  # id -> buffer, for buffers in use
+
+    def create_tensor(self, shape, default_value=None):
+        size = product(shape)
+        if size < self.__min_size:
+            if default_value is None:
+                return self._numpy.empty(shape, dtype=self.dtype)
+            return self._numpy.full(shape, default_value, dtype=self.dtype)
+
+        size_class = 1 << max(size - 1, 0).bit_length()
+        free = self.__free[size_class]
+        buffer = free.pop() if len(free) > 0 else self._numpy.empty(size_class, dtype=self.dtype)
+        self.__lent[id(buffer)] = buffer
+
+        result = buffer[:size].reshape(shape)
+        if default_value is not None:
+            result.fill(default_value)
+        return result
+
+    def release(self, tensor):
+        """
+        Return the buffer of a tensor to the pool. The tensor (and any other view of the buffer) must not be used.
+
+        :param tensor: A tensor, which may or may not have been taken from this pool
+        :return: None
+        """
+        base = tensor
+        while base is not None:
+            if self.__lent.get(id(base)) is base:
+                del self.__lent[id(base)]
+                self.__free[base.size].append(base)
+                return
+            base = base.base
+
+    def clear(self):
+        """
+        Drop all unused buffers.
+
+        :return: None
+        """
+        self.__free.clear()
+
+    def tensordot(self, a, b, axes):
+        """
+        Compute numpy.tensordot(a, b, axes) as a single matrix multiplication written into a buffer of the pool.
+        Inputs are only copied (into buffers of the pool) if they cannot be viewed as matrices.
+        """
+        left_axes, right_axes = list(axes[0]), list(axes[1])
+        contracted_size = product(a.shape[i] for i in left_axes)
+        result_size = (a.size // contracted_size) * (b.size // contracted_size)
+        if max(a.size, b.size, result_size) < self.__min_size:
+            # Only small tensors are involved
+            return self._numpy.tensordot(a, b, (left_axes, right_axes))
+
+        left_free = [i for i in range(a.ndim) if i not in left_axes]
+        right_free = [i for i in range(b.ndim) if i not in right_axes]
+
+        # The contracted axes can be matched in any order, so use an order that avoids copies if possible
+        best = None
+        for key in (left_axes, right_axes):
+            order = sorted(range(len(key)), key=key.__getitem__)
+            left_contracted = [left_axes[i] for i in order]
+            right_contracted = [right_axes[i] for i in order]
+            left_matrix = self.__as_matrix(a, left_free, left_contracted)
+            right_matrix = self.__as_matrix(b, right_contracted, right_free)
+            copies = (left_matrix is None) + (right_matrix is None)
+            if best is None or copies < best[0]:
+                best = (copies, left_contracted, right_contracted, left_matrix, right_matrix)
+            if copies == 0:
+                break
+        _, left_contracted, right_contracted, left_matrix, right_matrix = best
+
+        copied = []
+        if left_matrix is None:
+            left_matrix = self.__copy_as_matrix(a, left_free, left_contracted)
+            copied.append(left_matrix)
+        if right_matrix is None:
+            right_matrix = self.__copy_as_matrix(b, right_contracted, right_free)
+            copied.append(right_matrix)
+
+        result = self.create_tensor((left_matrix.shape[0], right_matrix.shape[1]))
+        self._numpy.matmul(left_matrix, right_matrix, out=result)
+        for matrix in copied:
+            self.release(matrix)
+        return result.reshape(
+            tuple(a.shape[i] for i in left_free) + tuple(b.shape[i] for i in right_free)
+        )
+
+    @staticmethod
+    def __as_matrix(tensor, rows, columns):
+        """
+        :return: A view of [tensor] as a matrix indexed by the [rows] axes and the [columns] axes, or None
+        """
+        num_rows = product(tensor.shape[i] for i in rows)
+        num_columns = product(tensor.shape[i] for i in columns)
+        view = tensor.transpose(rows + columns)
+        if view.flags.c_contiguous:
+            return view.reshape(num_rows, num_columns)
+        view = tensor.transpose(columns + rows)
+        if view.flags.c_contiguous:
+            return view.reshape(num_columns, num_rows).T
+        return None
+
+    def __copy_as_matrix(self, tensor, rows, columns):
+        view = tensor.transpose(rows + columns)
+        result = self.create_tensor(view.shape)
+        self._numpy.copyto(result, view)
+        return result.reshape(
+            product(tensor.shape[i] for i in rows),
+            product(tensor.shape[i] for i in columns),
+        )
+
+
 class NumpyAPI(BaseTensorAPI):
     def __init__(self):
         import numpy
@@ -9,6 +151,8 @@ class NumpyAPI(BaseTensorAPI):
         self._thread_limiter = None
         self._numpy = numpy
         self._entry_type = self._numpy.float64
+        self._buffer_pool = None
+        self._zero_check_size = 2 ** 10  # Larger tensors are not scanned for early termination
 
     def add_argument(self, key, value):
         if key == "entry_type":
@@ -42,6 +186,16 @@ class NumpyAPI(BaseTensorAPI):
     def tensordot(self, a, b, axes):
         return self._numpy.tensordot(a, b, axes)
 
+    def buffer_pool(self):
+        if self._numpy.dtype(self._entry_type) == object:
+            return None  # Python integers cannot be written into preallocated outputs by matmul
+        if self._buffer_pool is None or self._buffer_pool.dtype != self._entry_type:
+            self._buffer_pool = BufferPool(self._numpy, self._entry_type)
+        return self._buffer_pool
+
+    def is_all_zero(self, tensor):
+        return tensor.size <= self._zero_check_size and not self._numpy.any(tensor)
+
     def contract(self, network, contraction_tree):
         try:
             if self._thread_limit is not None:
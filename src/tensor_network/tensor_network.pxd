@@ -4,6 +4,7 @@ cdef struct TensorNetworkEdge:
     int id
     size_t tensor1_id
     size_t tensor2_id
+    size_t dimension
 
 cdef struct FactorResult:
     size_t new_tensor_id
@@ -14,5 +15,10 @@ cdef class TensorNetwork:
     cdef public vector[TensorNetworkEdge] __edges
     cdef public vector[vector[int]] __index_lists
     cdef public int __disconnected_edge_id
+    cdef public vector[int] __edge_parent  # Union-find of equivalent edges: the parent, or -size for a representative
+    cdef public vector[int] __edge_next  # The next edge in the same equivalence class (cyclically)
 
     cdef FactorResult factor_out(self, size_t tensor_index, size_t dim1, size_t dim2)
+    cdef int add_edge(self, size_t tensor1_id, size_t tensor2_id, size_t dimension)
+    cdef int find_representative(self, int edge)
+    cdef void union_edges(self, int edge1, int edge2)
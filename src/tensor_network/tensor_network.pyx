@@ -1,7 +1,9 @@
 # distutils: language=c++
 # distutils: extra_compile_args=-O3
 
+import collections
 from itertools import combinations, product
+import numpy
 from typing import Tuple, List, Iterator
 import tensor_network.tensor
 import contraction_methods.contraction_tree
@@ -15,6 +17,8 @@ cdef class TensorNetwork:
             self.__edges = base.__edges
             self.__index_lists = base.__index_lists
             self.__disconnected_edge_id = base.__disconnected_edge_id
+            self.__edge_parent = base.__edge_parent
+            self.__edge_next = base.__edge_next
         else:
             self.__nodes = []
             self.__disconnected_edge_id = -1
@@ -48,6 +52,9 @@ cdef class TensorNetwork:
     def num_edges(self):
         return self.__edges.size()
 
+    def edge_dimension(self, edge_id: int) -> int:
+        return self.__edges[edge_id].dimension
+
     def connected(self, tensor_id: int, edge_id: int) -> bool:
         return self.__index_lists[tensor_id][edge_id] >= 0
 
@@ -58,11 +65,34 @@ cdef class TensorNetwork:
             raise ValueError("Index of first tensor has already been assigned")
         if self.__index_lists[tensor2][edge2] >= 0:
             raise ValueError("Index of second tensor has already been assigned")
+        dimension = self.__nodes[tensor1].shape[edge1]
+        if self.__nodes[tensor2].shape[edge2] != dimension:
+            raise ValueError("Indices of different dimensions cannot be connected")
 
         edge_id = self.__edges.size()
         self.__index_lists[tensor1][edge1] = edge_id
         self.__index_lists[tensor2][edge2] = edge_id
-        self.__edges.push_back(TensorNetworkEdge(edge_id, tensor1, tensor2))
+        return self.add_edge(tensor1, tensor2, dimension)
+
+    cdef int add_edge(self, size_t tensor1_id, size_t tensor2_id, size_t dimension):
+        """
+        Add an edge (already in the index lists of both tensors), and record its equivalence to the other edges
+        of each diagonal tensor it is incident to.
+
+        :return: The id of the new edge
+        """
+        cdef int edge_id = self.__edges.size()
+        cdef int other_e
+        self.__edges.push_back(TensorNetworkEdge(edge_id, tensor1_id, tensor2_id, dimension))
+        self.__edge_parent.push_back(-1)
+        self.__edge_next.push_back(edge_id)
+        for tensor_id in [tensor1_id, tensor2_id]:
+            if self.__nodes[tensor_id].diagonal:
+                # All other connected edges of a diagonal tensor are already equivalent
+                for other_e in self.__index_lists[tensor_id]:
+                    if other_e >= 0 and other_e != edge_id:
+                        self.union_edges(edge_id, other_e)
+                        break
         return edge_id
 
     def add_node(self, tensor: tensor_network.tensor.Tensor) -> List[Tuple[int, int]]:
@@ -75,12 +105,25 @@ cdef class TensorNetwork:
         self.__disconnected_edge_id -= rank
         return [(len(self.__nodes) - 1, i) for i in range(rank)]
 
-    def save_structure(self, file, include_rank_zero: bool = False):
-        file.write(
-            b"p tw %d %d\n" % (self.__index_lists.size(), self.__edges.size())
-        )
-        for edge in self.__edges:
-            file.write(b"%d %d\n" % (edge.tensor1_id + 1, edge.tensor2_id + 1))
+    def save_structure(self, file, include_rank_zero: bool = False, deduplicate: bool = False):
+        file.write(format_graph(self.__index_lists.size(), self.structure_edges(deduplicate)))
+
+    def structure_edges(self, deduplicate: bool = False):
+        """
+        Get the edges of the structure graph, whose vertices are the tensors (numbered from 1).
+
+        :param deduplicate: If True, include each pair of connected tensors only once
+        :return: An array of shape (# edges, 2), in the order of the network edges unless deduplicated
+        """
+        edges = numpy.empty((self.__edges.size(), 2), dtype=numpy.intc)
+        cdef int[:, :] edges_view = edges
+        cdef size_t i
+        for i in range(self.__edges.size()):
+            edges_view[i, 0] = self.__edges[i].tensor1_id + 1
+            edges_view[i, 1] = self.__edges[i].tensor2_id + 1
+        if deduplicate:
+            return unique_edges(edges)
+        return edges
 
     def structure(self, include_rank_zero: bool = False, display: bool = True):
         import networkx as nx
@@ -95,17 +138,33 @@ cdef class TensorNetwork:
             result.add_edge(edge.tensor1_id, edge.tensor2_id, label=edge.id)
         return result
 
-    def save_line_structure(self, file):
-        cdef int num_line_edges = 0
+    def save_line_structure(self, file, deduplicate: bool = False):
+        file.write(format_graph(self.__edges.size(), self.line_structure_edges(deduplicate)))
+
+    def line_structure_edges(self, deduplicate: bool = False):
+        """
+        Get the edges of the line graph, whose vertices are the network edges (numbered from 1).
+
+        :param deduplicate: If True, include each pair of edges only once (pairs of parallel edges
+                            otherwise appear once for each of the two tensors they share)
+        :return: An array of shape (# edges, 2)
+        """
+        # Group the tensors by rank, so the pairs of all tensors of a given rank are found at once
+        tensors_by_rank = collections.defaultdict(list)
         for connections in self.__index_lists:
-            num_line_edges += (connections.size() * (connections.size() - 1)) // 2
-        file.write(
-            b"p tw %d %d\n" % (self.__edges.size(), num_line_edges)
-        )
-        for node_id in range(self.__index_lists.size()):
-            for i in range(self.__index_lists[node_id].size()):
-                for j in range(i+1, self.__index_lists[node_id].size()):
-                    file.write(b"%d %d\n" % (self.__index_lists[node_id][i]+1, self.__index_lists[node_id][j]+1))
+            connections = [e + 1 for e in connections if e >= 0]
+            if len(connections) > 1:
+                tensors_by_rank[len(connections)].append(connections)
+
+        blocks = [numpy.empty((0, 2), dtype=numpy.intc)]
+        for rank, tensors in tensors_by_rank.items():
+            tensors = numpy.array(tensors, dtype=numpy.intc)
+            first, second = numpy.triu_indices(rank, 1)
+            blocks.append(numpy.stack((tensors[:, first].ravel(), tensors[:, second].ravel()), axis=1))
+        edges = numpy.concatenate(blocks)
+        if deduplicate:
+            return unique_edges(edges)
+        return edges
 
     def line_structure(self):
         import networkx as nx
@@ -140,19 +199,44 @@ cdef class TensorNetwork:
         return np.einsum(operands, *tensors)
 
     def identify(self, contraction_tree, tensor_api):
+        flat = contraction_tree.flatten()
+        cdef int[:] left = flat.left
+        cdef int[:] tensor_index = flat.tensor_index
+        axes = flat.axes
         stack = []
-        for node in contraction_tree.iterate_postorder():
-            if node.is_leaf:
-                stack.append(
-                    self.__nodes[node.tensor_index].build(tensor_api.create_tensor)
-                )
+
+        # Reuse buffers for the tensors, if possible
+        pool = tensor_api.buffer_pool()
+        create_tensor = tensor_api.create_tensor if pool is None else pool.create_tensor
+        tensordot = tensor_api.tensordot if pool is None else pool.tensordot
+
+        # The contraction is zero as soon as any intermediate tensor is zero
+        #   (this is only checked for a scalar result, whose shape is known without slicing information, and
+        #   the tensor API only scans small tensors; zero slices are mostly skipped before contraction)
+        cdef bint scalar_result = flat.free_ptr[flat.size] == flat.free_ptr[flat.size - 1]
+        cdef Py_ssize_t i
+        for i in range(flat.size):
+            if left[i] < 0:
+                stack.append(self.__nodes[tensor_index[i]].build(create_tensor))
             else:
                 right_tensor = stack.pop()
                 left_tensor = stack.pop()
-                contraction_result = tensor_api.tensordot(
-                    left_tensor, right_tensor, (node.left_edge_map, node.right_edge_map)
-                )
+                contraction_result = tensordot(left_tensor, right_tensor, axes[i])
+                if pool is not None:
+                    pool.release(left_tensor)
+                    pool.release(right_tensor)
                 stack.append(contraction_result)
+            if scalar_result and tensor_api.is_all_zero(stack[-1]):
+                if pool is not None:
+                    for tensor in stack:
+                        pool.release(tensor)
+                return tensor_api.create_tensor((), 0)
+
+        if pool is not None:
+            # The result is used after the buffers are reused
+            result = stack[0].copy()
+            pool.release(stack[0])
+            return result
         return stack[0]
 
     def contract_pair(self, left_index, left_edge_map, right_index, right_edge_map, free_edges, tensor_api):
@@ -163,6 +247,8 @@ cdef class TensorNetwork:
         cdef result_index = len(self.__nodes) - 1
 
         # Correct the edges incident to the new node
+        #   (the result is not marked diagonal, but equivalent edges still take equal values in any nonzero entry,
+        #    so the equivalences of the edges are kept)
         cdef size_t i, e
         cdef size_t rank = len(free_edges)
         for i in range(rank):
@@ -182,15 +268,21 @@ cdef class TensorNetwork:
 
         result_tree_context = contraction_methods.contraction_tree.ContractionTreeContext()
 
-        for node in contraction_tree.iterate_postorder():
-            if node.is_leaf:
-                stack.append((True, node.tensor_index))
+        flat = contraction_tree.flatten()
+        cdef int[:] left_child = flat.left
+        cdef int[:] tensor_index = flat.tensor_index
+        cdef int[:] free_ptr = flat.free_ptr
+        axes = flat.axes
+        cdef Py_ssize_t i
+        for i in range(flat.size):
+            if left_child[i] < 0:
+                stack.append((True, tensor_index[i]))
             else:
                 right_created, right = stack.pop()
                 left_created, left = stack.pop()
-                if left_created and right_created and len(node.free_edges) < contract_below:
+                if left_created and right_created and free_ptr[i + 1] - free_ptr[i] < contract_below:
                     contraction_result = self.contract_pair(
-                        left, node.left_edge_map, right, node.right_edge_map, node.free_edges, tensor_api
+                        left, axes[i][0], right, axes[i][1], flat.node_free_edges(i), tensor_api
                     )
                     stack.append((True, contraction_result))
                 else:
@@ -223,17 +315,35 @@ cdef class TensorNetwork:
 
         # Remove edges that were contracted away
         cdef vector[int] new_eid_from_old
+        cdef vector[int] new_eid_of_class = vector[int](self.__edges.size(), -1)
+        cdef vector[int] equivalent_pairs
+        cdef int representative
         cdef size_t current_edge, fixed_edge = 0
         for current_edge in range(self.__edges.size()):
             if new_tid_from_old[self.__edges[current_edge].tensor1_id] >= 0 and new_tid_from_old[self.__edges[current_edge].tensor1_id] >= 0:
                 # Both edges of the tensor still exist; correct the tensor ids
                 self.__edges[fixed_edge].tensor1_id = new_tid_from_old[self.__edges[current_edge].tensor1_id]
                 self.__edges[fixed_edge].tensor2_id = new_tid_from_old[self.__edges[current_edge].tensor2_id]
+                self.__edges[fixed_edge].dimension = self.__edges[current_edge].dimension
                 new_eid_from_old.push_back(fixed_edge)
+
+                # Keep the equivalences of the remaining edges, even through edges that were contracted away
+                representative = self.find_representative(current_edge)
+                if new_eid_of_class[representative] >= 0:
+                    equivalent_pairs.push_back(new_eid_of_class[representative])
+                    equivalent_pairs.push_back(fixed_edge)
+                else:
+                    new_eid_of_class[representative] = fixed_edge
                 fixed_edge += 1
             else:
                 new_eid_from_old.push_back(-2)
         self.__edges.resize(fixed_edge)
+        self.__edge_parent.assign(fixed_edge, -1)
+        self.__edge_next.clear()
+        for current_edge in range(fixed_edge):
+            self.__edge_next.push_back(current_edge)
+        for current_edge in range(0, equivalent_pairs.size(), 2):
+            self.union_edges(equivalent_pairs[current_edge], equivalent_pairs[current_edge + 1])
         cdef size_t t_id, index
         for t_id in range(fixed_tensor):
             for index in range(self.__index_lists[t_id].size()):
@@ -320,7 +430,7 @@ cdef class TensorNetwork:
         edge_id = self.__edges.size()
         self.__index_lists[tensor_index].push_back(edge_id)
         self.__index_lists[new_tensor_index].push_back(edge_id)
-        self.__edges.push_back(TensorNetworkEdge(edge_id, tensor_index, new_tensor_index))
+        self.add_edge(tensor_index, new_tensor_index, left.shape[2])
 
         return FactorResult(new_tensor_index, edge_id)
 
@@ -360,7 +470,7 @@ cdef class TensorNetwork:
             yield tn_slice
 
 
-    def slice_groups(self, edge_groups):
+    def slice_groups(self, edge_groups, skip_zero=False):
         if len(edge_groups) == 0:
             yield self
             return
@@ -393,7 +503,10 @@ cdef class TensorNetwork:
             info = tensor_infos[-1][-1]
             index_values.append(list(range(self.__nodes[info[0]].shape[info[1]])))
 
+        is_zero_slice = self.zero_slice_test(edge_groups) if skip_zero else None
         for assignment in product(*index_values):
+            if is_zero_slice is not None and is_zero_slice(assignment):
+                continue
             tn_slice = self.copy()
             for group, value in zip(tensor_infos, assignment):
                 for info in group:
@@ -401,6 +514,35 @@ cdef class TensorNetwork:
             yield tn_slice
 
 
+    def zero_slice_test(self, edge_groups):
+        """
+        Build a test for slices that are zero, since some tensor is zero once its sliced indices are fixed
+        (e.g. a clause whose literals are all sliced to false, or a variable whose sliced value has weight zero).
+
+        :param edge_groups: The groups of edges to slice
+        :return: A function from an assignment to the (nonempty) groups to True if that slice is zero
+        """
+        fixed_indices = collections.defaultdict(list)  # tensor id -> list of (index, which group)
+        cdef size_t e, t_id, i, which_group = 0
+        for group in edge_groups:
+            if len(group) == 0:
+                continue
+            for e in group:
+                for t_id in [self.__edges[e].tensor1_id, self.__edges[e].tensor2_id]:
+                    for i in range(self.__index_lists[t_id].size()):
+                        if self.__index_lists[t_id][i] == <int>e:
+                            fixed_indices[t_id].append((i, which_group))
+                            break
+            which_group += 1
+        checks = [(self.__nodes[t], indices) for t, indices in fixed_indices.items()]
+
+        def is_zero_slice(assignment):
+            return any(
+                tensor.is_zero_slice({i: assignment[group] for i, group in indices})
+                for tensor, indices in checks
+            )
+        return is_zero_slice
+
     def get_tensor_slices(self, edge_groups, tensor_factory):
         if len(edge_groups) == 0:
             # Return a slice generator for each tensor that does no slicing
@@ -452,54 +594,126 @@ cdef class TensorNetwork:
             for edge_id in group:
                 is_edge_sliced[edge_id] = 1
 
-        stack = []
+        flat = contraction_tree.flatten()
+        cdef int[:] left = flat.left
+        cdef int[:] tensor_index = flat.tensor_index
+        cdef vector[int] stack
         cdef vector[int] free_edges
-        for node in contraction_tree.iterate_postorder():
-            if node.is_leaf:
+        cdef int left_tree, right_tree
+        cdef Py_ssize_t n
+        for n in range(flat.size):
+            if left[n] < 0:
                 free_edges.clear()
-                for edge_id in self.__index_lists[node.tensor_index]:
+                for edge_id in self.__index_lists[tensor_index[n]]:
                     if edge_id >= 0 and is_edge_sliced[edge_id] == 0:
                         free_edges.push_back(edge_id)
-                stack.append(result_tree_context.leaf_manual(node.tensor_index, free_edges))
+                        result_tree_context.set_edge_dimension(edge_id, self.__edges[edge_id].dimension)
+                stack.push_back(result_tree_context.leaf_manual(tensor_index[n], free_edges))
             else:
-                right = stack.pop()
-                left = stack.pop()
-                stack.append(result_tree_context.join(left, right))
-        return result_tree_context.get_tree(stack.pop())
-
-    def find_equivalent_edges(self, edge):
-        to_process = [edge]
-        seen = {edge}
-
-        cdef size_t other_e, t1, t2
-        while len(to_process) > 0:
-            e = to_process.pop()
-            t1 = self.__edges[e].tensor1_id
-            t2 = self.__edges[e].tensor2_id
-            if self.__nodes[t1].diagonal:
-                for other_e in self.__index_lists[t1]:
-                    if other_e not in seen:
-                        to_process.append(other_e)
-                        seen.add(other_e)
-            if self.__nodes[t2].diagonal:
-                for other_e in self.__index_lists[t2]:
-                    if other_e not in seen:
-                        to_process.append(other_e)
-                        seen.add(other_e)
-        return seen
+                right_tree = stack.back()
+                stack.pop_back()
+                left_tree = stack.back()
+                stack.pop_back()
+                stack.push_back(result_tree_context.join(left_tree, right_tree))
+        return result_tree_context.get_tree(stack.back())
+
+    cdef int find_representative(self, int edge):
+        cdef int root = edge
+        while self.__edge_parent[root] >= 0:
+            root = self.__edge_parent[root]
+        # Compress the path to the representative
+        cdef int parent
+        while self.__edge_parent[edge] >= 0:
+            parent = self.__edge_parent[edge]
+            self.__edge_parent[edge] = root
+            edge = parent
+        return root
+
+    cdef void union_edges(self, int edge1, int edge2):
+        edge1 = self.find_representative(edge1)
+        edge2 = self.find_representative(edge2)
+        if edge1 == edge2:
+            return
+        # Attach the smaller class below the larger
+        if self.__edge_parent[edge1] > self.__edge_parent[edge2]:
+            edge1, edge2 = edge2, edge1
+        self.__edge_parent[edge1] += self.__edge_parent[edge2]
+        self.__edge_parent[edge2] = edge1
+        # Splice the cycles of the two classes together
+        self.__edge_next[edge1], self.__edge_next[edge2] = self.__edge_next[edge2], self.__edge_next[edge1]
+
+    def edge_representative(self, int edge):
+        """
+        Find the representative of the edges equivalent to an edge (i.e. connected through diagonal tensors).
+
+        :param edge: An edge of the network
+        :return: An edge equivalent to [edge], which is the same for all equivalent edges
+        """
+        return self.find_representative(edge)
+
+    def find_equivalent_edges(self, int edge):
+        cdef int other_e = self.__edge_next[edge]
+        result = {edge}
+        while other_e != edge:
+            result.add(other_e)
+            other_e = self.__edge_next[other_e]
+        return result
 
     def equivalent_edge_sets(self):
         """
         For each edge, find a representative equivalent edge.
 
-        :return: A dictionary D such that, for each edge e, D[e] is equivalent to e.
+        :return: A list D such that, for each edge e, D[e] is equivalent to e.
         """
-        equivalent_edges = {}
-        for e in range(self.num_edges()):
-            if e not in equivalent_edges:
-                for f in self.find_equivalent_edges(e):
-                    equivalent_edges[f] = e
-        return equivalent_edges
+        cdef int e
+        return [self.find_representative(e) for e in range(self.__edges.size())]
+
+
+def unique_edges(edges):
+    """
+    Remove repeated edges from an undirected graph.
+
+    :param edges: An array of shape (# edges, 2) of non-negative vertex ids
+    :return: An array of the distinct edges, each with the smaller vertex first, in sorted order
+    """
+    if len(edges) == 0:
+        return edges
+    low = numpy.minimum(edges[:, 0], edges[:, 1]).astype(numpy.int64)
+    high = numpy.maximum(edges[:, 0], edges[:, 1]).astype(numpy.int64)
+    base = int(high.max()) + 1
+    keys = numpy.unique(low * base + high)
+    return numpy.stack((keys // base, keys % base), axis=1)
+
+
+def format_graph(num_vertices, edges):
+    """
+    Format a graph in the PACE .gr format (as used by the decomposition solvers) in a single buffer.
+
+    :param num_vertices: The number of vertices of the graph
+    :param edges: An array of shape (# edges, 2) of vertex ids, each at least 1
+    :return: The formatted graph, as bytes
+    """
+    header = b"p tw %d %d\n" % (num_vertices, len(edges))
+    values = numpy.asarray(edges, dtype=numpy.int64).ravel()
+    if len(values) == 0:
+        return header
+
+    # Write each vertex id right-aligned in a row of fixed width, followed by a separator:
+    #   a space after the first vertex of each edge and a newline after the second.
+    #   (There are usually far fewer vertices than edges, so the digits of each vertex id are computed once.)
+    max_digits = len(str(int(values.max())))
+    digits = numpy.zeros((int(values.max()) + 1, max_digits + 1), dtype=numpy.uint8)
+    remaining = numpy.arange(len(digits), dtype=numpy.int64)
+    for column in range(max_digits - 1, -1, -1):
+        digits[:, column] = numpy.where(remaining > 0, ord("0") + remaining % 10, 0)
+        remaining //= 10
+    rows = digits[values]
+    rows[0::2, max_digits] = ord(" ")
+    rows[1::2, max_digits] = ord("\n")
+
+    # Remove the padding (note every vertex id is at least 1, so no digit is dropped)
+    characters = rows.ravel()
+    return header + characters[characters != 0].tobytes()
 
 
 def draw_graph(networkx_graph):
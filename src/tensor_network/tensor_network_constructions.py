@@ -79,6 +79,24 @@ class OrTensor(Tensor):
     def output_index(self):
         return self.__output_index
 
+    def is_zero_slice(self, fixed):
+        # Each index is true if it takes the value that satisfies its literal
+        true_at = {
+            i: value == (1 if self.__literals_positive[i] else 0)
+            for i, value in fixed.items()
+        }
+        if self.__output_index is None:
+            # Only F | F | ... | F | F is zero
+            return len(true_at) == self.rank and not any(true_at.values())
+        if self.__output_index not in true_at:
+            return False
+        inputs = [true_at[i] for i in true_at if i != self.__output_index]
+        if true_at[self.__output_index]:
+            # * | * | ... | * | * = T is zero only if all inputs are false
+            return len(inputs) == self.rank - 1 and not any(inputs)
+        # * | * | ... | * | * = F is zero if some input is true
+        return any(inputs)
+
     def build(self, tensor_factory):
         result = tensor_factory(self.shape, 1)
         if self.__output_index is None:
@@ -154,6 +172,16 @@ class VariableTensor(Tensor):
     def diagonal(self):
         return True
 
+    def is_zero_slice(self, fixed):
+        values = set(fixed.values())
+        if len(values) > 1:
+            return True  # Off the diagonal
+        if 0 not in values and self.__positive_weight != 0:
+            return False
+        if 1 not in values and self.__negative_weight != 0:
+            return False
+        return True
+
     def build(self, tensor_factory):
         # Tensor is 1 at (a, b, c, ..., z) if a == b == c == ... == z, and 0 otherwise
         result = tensor_factory(self.shape, 0)
@@ -6,6 +6,7 @@ import sys
 import contraction_methods
 import tensor_network
 import util
+from tensor_network import calibration, sliced_execution_plan
 import planning
 import execution
 
@@ -70,6 +71,34 @@ Main entry point for the full TensorOrder tool
     default=None,
     help="CPU affinity for finding decomposition",
 )
+@click.option(
+    "--planner_workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of independently seeded planners to run in parallel",
+)
+@click.option(
+    "--extraction_workers",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Number of processes to extract contraction trees from decompositions in (0 to use the planner process)",
+)
+@click.option(
+    "--extraction_samples",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of contraction trees to extract from each decomposition (with different roots), keeping the best",
+)
+@click.option(
+    "--planner_warm_start",
+    type=bool,
+    help="Start the decomposition solver while the tensor network is constructed",
+    default=False,
+    show_default=True,
+)
 @click.option(
     "--performance_factor",
     type=float,
@@ -77,6 +106,55 @@ Main entry point for the full TensorOrder tool
     default=10 ** (-11),
     show_default=True,
 )
+@click.option(
+    "--calibrate",
+    type=bool,
+    help="Predict contraction time with a cost model calibrated on this machine, instead of performance_factor",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--calibration_cache",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File to cache calibrated cost models in, by host",
+    default=calibration.DEFAULT_CACHE,
+    show_default=True,
+)
+@click.option(
+    "--refine_time",
+    type=float,
+    help="Time (s) to spend refining the contraction tree by local search",
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "--reoptimize_window",
+    type=int,
+    help="Optimally reorder windows of this many subtrees in the contraction tree (0 to disable)",
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "--concurrent_execution",
+    type=bool,
+    help="Start contracting with the best plan so far while planning continues in the background",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--plan_switch_ratio",
+    type=float,
+    help="How much cheaper (in FLOPs) a new plan must be than the remaining work to switch to it",
+    default=2,
+    show_default=True,
+)
+@click.option(
+    "--cube_variables",
+    type=int,
+    help="Branch on this many variables, and plan each simplified subformula separately (0 to disable; wmc only)",
+    default=0,
+    show_default=True,
+)
 @click.option(
     "--log_contraction_tree",
     required=False,
@@ -122,6 +200,26 @@ Main entry point for the full TensorOrder tool
     type=util.TaggedChoice(tensor_network.ALL_SLICERS, case_sensitive=False),
     show_default=True,
 )
+@click.option(
+    "--slice_workers",
+    type=int,
+    help="Number of workers to balance slices among, for the parallel and hardware slicers (default: 1, since slices "
+    "are contracted one at a time; only set this when the slices are distributed among workers externally)",
+    required=False,
+)
+@click.option(
+    "--slice_cache",
+    type=int,
+    help="Cache size (bytes) to fit slices in, for the cache and hardware slicers (default: the last-level cache)",
+    required=False,
+)
+@click.option(
+    "--replan_rounds",
+    type=int,
+    help="Rounds of replanning the contraction tree for the sliced network, then slicing again (0 to disable)",
+    default=0,
+    show_default=True,
+)
 @click.option(
     "--early", type=int, help="Contract tensors early", default=0, show_default=False,
 )
@@ -177,7 +275,18 @@ def run(
     planner,
     planner_timeout,
     planner_affinity,
+    planner_workers,
+    extraction_workers,
+    extraction_samples,
+    planner_warm_start,
     performance_factor,
+    calibrate,
+    calibration_cache,
+    refine_time,
+    reoptimize_window,
+    concurrent_execution,
+    plan_switch_ratio,
+    cube_variables,
     log_contraction_tree,
     # Execution Stage options
     tensor_library,
@@ -186,6 +295,9 @@ def run(
     thread_limit,
     mem_limit,
     slicer,
+    slice_workers,
+    slice_cache,
+    replan_rounds,
     early,
     tpu,
     slice_cutoff,
@@ -225,73 +337,220 @@ def run(
             util.Verbosity.stages,
         )
 
+    # Configure the slicer for the hardware
+    if slice_workers is not None:
+        slicer.add_argument("workers", slice_workers)
+    if slice_cache is not None:
+        slicer.add_argument("cache_size", slice_cache)
+    slicer.add_argument("entry_size", tensor_library.get_entry_size())
+
     stopwatch = util.Stopwatch()
 
+    # Predict contraction time on this machine
+    profile = None
+    if calibrate:
+        profile = calibration.load_profile(
+            tensor_library, entry_type, thread_limit, calibration_cache
+        )
+        stopwatch.record_interval("Calibration")
+
+    # Start the solver early, so that its startup overlaps with the reduction
+    #   (solvers started by parallel or concurrent planners belong to their own processes, and in cube mode
+    #   each subformula is solved by its own solver)
+    if (
+        planner_warm_start
+        and planner_workers == 1
+        and not concurrent_execution
+        and cube_variables == 0
+    ):
+        planner.warm_up(seed=seed, affinity=planner_affinity)
+
     # Reduction phase: Construct the tensor network
-    network = reduction(benchmark, weights)
-    util.log("Completed reduction to tensor network", util.Verbosity.stages)
+    if cube_variables > 0:
+        # Each simplified subformula is reduced separately
+        if reduction is not tensor_network.ALL_CONSTRUCTIONS["wmc"]:
+            raise click.UsageError("--cube_variables requires --reduction wmc")
+        formula = util.Formula.parse_DIMACS(benchmark, weights)
+    else:
+        network = reduction(benchmark, weights)
+        util.log("Completed reduction to tensor network", util.Verbosity.stages)
     stopwatch.record_interval("Construction")
 
-    result = None
+    def prepare(plan):
+        # Reduce the FLOPs of the tree before slicing
+        if refine_time > 0:
+            plan.refine(refine_time)
+        if reoptimize_window > 0:
+            plan.reoptimize_windows(reoptimize_window)
+        # Compute the most memory-intensive child of each join first (without changing the FLOPs)
+        plan.order_by_memory()
+
+        # Slice the network according to resource constraints
+        if replan_rounds > 0:
+            # Tune the tree for the sliced network, and the slices for the new tree
+            slicer.slice_and_replan(
+                plan,
+                memory=mem_limit,
+                rank=rank_limit,
+                slices=minimum_slice,
+                rounds=replan_rounds,
+                window_size=reoptimize_window if reoptimize_window > 0 else 8,
+            )
+        else:
+            slicer.slice_until(
+                plan, memory=mem_limit, rank=rank_limit, slices=minimum_slice
+            )
+
+        # Contract each tensor network slice
+        if early > 0:
+            plan.contract_small(
+                early, tensor_network.ALL_APIS["numpy"](),
+            )
+        return plan
+
+    def report(plan):
+        util.output("-", util.Verbosity.stages)
+
+        # Treewidth-based methods include the width of the underlying tree decomposition
+        for width_name, width in plan.widths.items():
+            util.output_pair(width_name, width, util.Verbosity.plan_info)
+
+        # Report plan statistics
+        plan.report_statistics()
+
     if planner_timeout <= 0:
         planner_timeout = timeout
-    with util.TimeoutTimer(planner_timeout) as timer:
-        # Planning phase: find the execution plan to use
-        #   (see tensor_network/sliced_execution_plan.py)
-        plan, _ = planning.run(
-            planner,
-            network,
-            seed,
-            timer,
-            planner_affinity,
-            rank_limit,
-            performance_factor,
-            mem_limit=None,
-            slicer=None,
-            stopwatch=None,
-        )
-        stopwatch.record_interval("Tree")
 
-        if plan is not None:
-            # Report on plan information
-            util.log(
-                "Identified plan has max-rank " + str(plan.tree.maxrank),
-                util.Verbosity.stages,
-            )
-            if log_contraction_tree:
-                util.log("Contraction Tree: " + str(plan.tree), util.Verbosity.always)
+    result = None
+    if cube_variables > 0:
+        # All subproblems share the overall timeout; each is planned within its share of the remaining time,
+        #   and its execution may use all of the remaining time
+        elapsed = util.Stopwatch()
+
+        def solve_subproblem(subproblem_network, share):
+            remaining = None
+            if timeout > 0:
+                remaining = timeout - elapsed.elapsed_time()
+                if remaining <= 0:
+                    util.output_pair(
+                        "Error", "Timeout during execution", util.Verbosity.always
+                    )
+                    return None
+            limits = [
+                limit
+                for limit in [planner_timeout, remaining * share if remaining else 0]
+                if limit > 0
+            ]
 
-            # Execution phase: Contract the tensor network
-            timer.reset_timeout(timeout)
-            try:
-                # Slice the network according to resource constraints
-                slicer.slice_until(
-                    plan, memory=mem_limit, rank=rank_limit, slices=minimum_slice
+            with util.TimeoutTimer(min(limits, default=0)) as timer:
+                plan, _ = planning.run(
+                    planner,
+                    subproblem_network,
+                    seed,
+                    timer,
+                    planner_affinity,
+                    rank_limit,
+                    performance_factor,
+                    mem_limit=None,
+                    slicer=None,
+                    planner_workers=planner_workers,
+                    profile=profile,
+                    extraction_workers=extraction_workers,
+                    extraction_samples=extraction_samples,
                 )
+                if plan is None:
+                    return None
 
-                # Contract each tensor network slice
-                if early > 0:
-                    plan.contract_small(
-                        early, tensor_network.ALL_APIS["numpy"](),
+                try:
+                    timer.reset_timeout(0 if remaining is None else remaining)
+                    prepare(plan)
+                except TimeoutError:
+                    util.output_pair(
+                        "Error", "Timeout during execution", util.Verbosity.always
                     )
-                result = execution.run(plan, tensor_library, slicer, slice_cutoff)
-                stopwatch.record_interval("Contraction")
-            except:
-                util.output_pair(
-                    "Error", "Tree above specified limits", util.Verbosity.always
-                )
+                    return None
+                return execution.run(plan, tensor_library, slicer, slice_cutoff)
 
+        # Planning and execution phases for each subformula
+        result = execution.run_cube_and_conquer(
+            formula, cube_variables, solve_subproblem
+        )
+        stopwatch.record_interval("Contraction")
+        stopwatch.record_total("Total")
+    elif concurrent_execution:
+        with util.TimeoutTimer(timeout) as timer:
+            # Planning and execution phases together: contract the tensor network with the best
+            #   plan so far, while planning continues in the background
+            with contraction_methods.BackgroundPlanner(
+                planner,
+                planner_workers,
+                network,
+                seed=seed,
+                affinity=planner_affinity,
+                extraction_workers=extraction_workers,
+                extraction_samples=extraction_samples,
+            ) as background:
+                result, plan = execution.run_concurrent(
+                    background,
+                    tensor_library,
+                    slicer,
+                    lambda tree, factored_network: prepare(
+                        sliced_execution_plan.SlicedExecutionPlan(tree, factored_network)
+                    ),
+                    plan_switch_ratio,
+                    slice_cutoff,
+                )
+            stopwatch.record_interval("Contraction")
             stopwatch.record_total("Total")
             timer.cancel()
 
-            util.output("-", util.Verbosity.stages)
+            if plan is not None:
+                report(plan)
+    else:
+        with util.TimeoutTimer(planner_timeout) as timer:
+            # Planning phase: find the execution plan to use
+            #   (see tensor_network/sliced_execution_plan.py)
+            plan, _ = planning.run(
+                planner,
+                network,
+                seed,
+                timer,
+                planner_affinity,
+                rank_limit,
+                performance_factor,
+                mem_limit=None,
+                slicer=None,
+                stopwatch=None,
+                planner_workers=planner_workers,
+                profile=profile,
+                extraction_workers=extraction_workers,
+                extraction_samples=extraction_samples,
+            )
+            stopwatch.record_interval("Tree")
 
-            # Treewidth-based methods include the width of the underlying tree decomposition
-            for width_name, width in plan.widths.items():
-                util.output_pair(width_name, width, util.Verbosity.plan_info)
+            if plan is not None:
+                # Report on plan information
+                util.log(
+                    "Identified plan has max-rank " + str(plan.tree.maxrank),
+                    util.Verbosity.stages,
+                )
+                if log_contraction_tree:
+                    util.log("Contraction Tree: " + str(plan.tree), util.Verbosity.always)
+
+                # Execution phase: Contract the tensor network
+                timer.reset_timeout(timeout)
+                try:
+                    prepare(plan)
+                    result = execution.run(plan, tensor_library, slicer, slice_cutoff)
+                    stopwatch.record_interval("Contraction")
+                except:
+                    util.output_pair(
+                        "Error", "Tree above specified limits", util.Verbosity.always
+                    )
 
-            # Report plan statistics
-            plan.report_statistics()
+                stopwatch.record_total("Total")
+                timer.cancel()
+                report(plan)
 
     # Report time statistics
     stopwatch.report_times()
@@ -75,6 +75,91 @@ class Formula:
         """
         self._variables[var_id] = [neg_weight, pos_weight]
 
+    def condition(self, literals):
+        """
+        Condition the formula on some literals being true, then simplify it by unit propagation.
+
+        Variables that no longer appear in any clause are removed, and their weights are collected into a constant
+        factor. The remaining variables are renumbered in order of their first appearance, so that conditioning
+        on different literals gives identical formulas if the remaining clauses are identical.
+
+        :param literals: An iterable of DIMACS literals to set to true
+        :return: (the constant factor, the simplified formula), or (0, None) if the count is zero
+        """
+        assignment = {}
+        pending = list(literals)
+        clauses = self._clauses
+        while True:
+            for literal in pending:
+                if assignment.setdefault(abs(literal), literal > 0) != (literal > 0):
+                    return 0, None  # Conflicting unit literals
+            pending = []
+
+            remaining = []
+            for clause in clauses:
+                reduced = []
+                for literal in clause:
+                    value = assignment.get(abs(literal))
+                    if value is None:
+                        reduced.append(literal)
+                    elif value == (literal > 0):
+                        break
+                else:  # The clause is not yet satisfied
+                    if len(reduced) == 0:
+                        return 0, None
+                    if len(reduced) == 1:
+                        pending.append(reduced[0])
+                    remaining.append(reduced)
+            clauses = remaining
+            if len(pending) == 0:
+                break
+
+        renumbered = {}
+        for clause in clauses:
+            for literal in clause:
+                renumbered.setdefault(abs(literal), len(renumbered) + 1)
+
+        factor = 1
+        for var, (neg_weight, pos_weight) in self._variables.items():
+            if var in assignment:
+                factor *= pos_weight if assignment[var] else neg_weight
+            elif var not in renumbered:
+                factor *= neg_weight + pos_weight
+        if factor == 0:
+            return 0, None
+
+        result = Formula()
+        for var, new_var in renumbered.items():
+            result.set_variable_weight(new_var, *self._variables.get(var, [1, 1]))
+        for clause in clauses:
+            result.add_clause(
+                renumbered[abs(literal)] * (1 if literal > 0 else -1)
+                for literal in clause
+            )
+        return factor, result
+
+    def structure_key(self):
+        """
+        :return: A hashable key that is equal for formulas with identical clauses and weights
+        """
+        return (
+            tuple(tuple(clause) for clause in self._clauses),
+            tuple((var, tuple(weight)) for var, weight in self._variables.items()),
+        )
+
+    def cube_variables(self, count):
+        """
+        Choose the variables with the most impact on unit propagation, i.e. those that occur most in short clauses.
+
+        :param count: The number of variables to choose
+        :return: A list of at most [count] variables
+        """
+        scores = {var: 0 for var in self._variables}
+        for clause in self._clauses:
+            for literal in clause:
+                scores[abs(literal)] = scores.get(abs(literal), 0) + 2 ** -len(clause)
+        return sorted(scores, key=lambda var: (-scores[var], var))[:count]
+
     def write_cachet(self, filename):
         """
         Write the formula into the format expected by cachet.
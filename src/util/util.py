@@ -1,12 +1,12 @@
 import click
 import ctypes
 import enum
+import glob
 import itertools
 import os
-import queue
+import selectors
 import signal
 import sys
-import threading
 import time
 
 
@@ -71,7 +71,10 @@ class TimeoutTimer:
                     self._enabled = True
             except AttributeError:
                 pass
-            self._end_time = self._start_time + new_timeout
+            # A later timeout must not extend the time until the timer goes off
+            new_end_time = self._start_time + new_timeout
+            if not self._enabled or new_end_time < self._end_time:
+                self._end_time = new_end_time
 
     def reset_timeout(self, new_timeout):
         """
@@ -117,9 +120,26 @@ class TimeoutTimer:
             pass
         self._end_time = self._start_time
 
+    def interrupt(self):
+        """
+        Make this timer expire now. Unlike the other methods, this may be called from any thread; no TimeoutError is
+        raised asynchronously, so the expiration is only seen by code that checks expired() or remaining().
+        :return: None
+        """
+        self._end_time = time.time()
+        self._enabled = True
+
     def expired(self):
         return (time.time() > self._end_time) and self._enabled
 
+    def remaining(self):
+        """
+        :return: The number of seconds until this timer expires, or None if it is not running
+        """
+        if not self._enabled:
+            return None
+        return max(self._end_time - time.time(), 0)
+
 
 class Stopwatch:
     """
@@ -401,6 +421,52 @@ def log(arg, verbosity=Verbosity.debug, flush=True, **kwargs):
         print(arg, flush=flush, file=sys.stderr, **kwargs)
 
 
+def parse_cpu_list(cpu_list):
+    """
+    Parse a list of CPUs in the format of taskset, e.g. "0-3,8".
+
+    :param cpu_list: The list of CPUs to parse
+    :return: A sorted list of CPU ids
+    """
+    cpus = set()
+    for part in cpu_list.split(","):
+        if "-" in part:
+            low, high = part.split("-")
+            cpus.update(range(int(low), int(high) + 1))
+        elif len(part.strip()) > 0:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def last_level_cache_size(cpu=0):
+    """
+    Read the size of the last-level data cache of a CPU from sysfs.
+
+    :param cpu: The CPU to read the caches of
+    :return: The size of the cache (bytes), or None if it is unknown
+    """
+    best_level, best_size = -1, None
+    for cache in glob.glob("/sys/devices/system/cpu/cpu" + str(cpu) + "/cache/index*"):
+        try:
+            with open(os.path.join(cache, "type")) as f:
+                if f.read().strip() == "Instruction":
+                    continue
+            with open(os.path.join(cache, "level")) as f:
+                level = int(f.read())
+            with open(os.path.join(cache, "size")) as f:
+                size = f.read().strip()  # e.g. "32768K"
+            units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+            if size[-1:] in units:
+                size = int(size[:-1]) * units[size[-1]]
+            else:
+                size = int(size)
+        except (OSError, ValueError):
+            continue
+        if level > best_level:
+            best_level, best_size = level, size
+    return best_size
+
+
 def kill_on_crash(sig=None):
     """
     Ensure that the child process is killed if the parent exits (e.g. from a cython segfault).
@@ -417,42 +483,101 @@ def kill_on_crash(sig=None):
     return do
 
 
-class BufferedStream:
+class BlockStream:
     """
-    Buffer the output of the stream through a queue on a separate thread.
+    Read the output of a process in chunks as soon as it is available, and split it into the blocks
+    of text that end at each separator line (or at EOF).
 
-    An unbuffered process.stdout stream does not behave well with timeouts.
+    The stream is waited on with a selector, using the time remaining on the timer as the timeout.
     """
 
-    def __init__(self, stream, timer=None):
+    def __init__(self, stream, separator="=", timer=None, chunk_size=1 << 20):
+        """
+        :param stream: A binary stream to read (e.g. process.stdout)
+        :param separator: Character separator to indicate the end of a block
+        :param timer: A timer to check expiration of
+        :param chunk_size: The maximum number of bytes to read at once
+        """
         self.__stream = stream
+        self.__fd = stream.fileno()
+        self.__separator = separator.encode()
         self.__timer = timer
-        self.__queue = queue.Queue()
-        self.__finished = False
+        self.__chunk_size = chunk_size
 
-        def enqueue_output():
-            for line in self.__stream:
-                self.__queue.put(line)
-            self.__stream.close()
-            self.__finished = True
+        self.__buffer = bytearray()  # Always begins at the start of a line
+        self.__searched = 0  # The buffer has no separator line before this position
+        self.__finished = False
 
-        self.__thread = threading.Thread(target=enqueue_output)
-        self.__thread.daemon = True
-        self.__thread.start()
+        os.set_blocking(self.__fd, False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__fd, selectors.EVENT_READ)
 
     def __iter__(self):
         return self
 
     def __next__(self):
         while True:
-            try:
-                if self.__timer is not None and self.__timer.expired():
-                    # If the timer does not successfully go off (i.e., Windows), trigger it here
-                    raise TimeoutError()
-                return self.__queue.get(block=True, timeout=1)
-            except queue.Empty:
-                if self.__finished:
+            block = self.__split_block()
+            if block is not None:
+                return block
+            if self.__finished:
+                if len(self.__buffer) == 0:
                     raise StopIteration
+                block = self.__buffer.decode()
+                self.__buffer.clear()
+                return block
+            self.__read()
+
+    def __split_block(self):
+        """
+        Remove the first complete block from the buffer, if there is one.
+
+        :return: The text of the block (excluding the separator line), or None
+        """
+        if self.__buffer.startswith(self.__separator):
+            separator = 0
+        else:
+            separator = self.__buffer.find(b"\n" + self.__separator, self.__searched) + 1
+            if separator == 0:
+                self.__searched = max(len(self.__buffer) - 1, 0)
+                return None
+
+        end = self.__buffer.find(b"\n", separator) + 1
+        if end == 0:
+            if not self.__finished:
+                self.__searched = separator - 1
+                return None  # Wait for the rest of the separator line
+            end = len(self.__buffer)
+
+        block = self.__buffer[:separator].decode()
+        del self.__buffer[:end]
+        self.__searched = 0
+        return block
+
+    def __read(self):
+        """
+        Wait until more output is available (or the timer expires), and add it to the buffer.
+        """
+        timeout = None
+        if self.__timer is not None:
+            if self.__timer.expired():
+                # If the timer does not successfully go off (i.e., Windows), trigger it here
+                raise TimeoutError()
+            timeout = self.__timer.remaining()
+
+        if len(self.__selector.select(timeout)) == 0:
+            return  # Timer expired; checked on the next read
+
+        try:
+            chunk = os.read(self.__fd, self.__chunk_size)
+        except BlockingIOError:
+            return
+        if len(chunk) == 0:
+            self.__finished = True
+            self.__selector.close()
+            self.__stream.close()
+        else:
+            self.__buffer += chunk
 
 
 class GroupedHelp(click.Command):